@@ -7,7 +7,7 @@ from flask_migrate import Migrate
 
 migrate = Migrate()
 
-def create_app():
+def create_app(test_config=None):
     # Use instance_relative_config to tell Flask the instance folder is outside the app package
     app = Flask(__name__, instance_relative_config=True) 
     
@@ -17,7 +17,77 @@ def create_app():
         # This tells SQLAlchemy where to create the database inside the instance folder
         SQLALCHEMY_DATABASE_URI=f'sqlite:///{os.path.join(app.instance_path, "site.db")}',
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # Background analysis jobs
+        ANALYSIS_WORKERS=int(os.environ.get('ANALYSIS_WORKERS', 2)),
+        ANALYSIS_QUEUE_SIZE=int(os.environ.get('ANALYSIS_QUEUE_SIZE', 16)),
+        ANALYSIS_JOB_TTL=600, # Seconds a finished job stays pollable
+        ANALYSIS_BATCH_IMAGES=int(os.environ.get('ANALYSIS_BATCH_IMAGES', 8)), # Images per inference batch in analyze_all
+        # Admission control: analyses running inference at once, intra-op threads each (0 = cores / concurrency),
+        # seconds a request may wait for a slot
+        ANALYSIS_CONCURRENCY=int(os.environ.get('ANALYSIS_CONCURRENCY', 2)),
+        ANALYSIS_THREADS=int(os.environ.get('ANALYSIS_THREADS', 0)),
+        ANALYSIS_SLOT_TIMEOUT=float(os.environ.get('ANALYSIS_SLOT_TIMEOUT', 60)),
+        # Model loading: 'background' (thread at startup), 'lazy' (first analysis request) or 'eager' (blocking)
+        ANALYSIS_WARMUP=os.environ.get('ANALYSIS_WARMUP', 'background'),
+        # Emotion classifier backend: torch | torch-int8 | onnx | onnx-int8
+        EMOTION_BACKEND=os.environ.get('EMOTION_BACKEND', 'torch'),
+        EMOTION_MODEL_DIR=os.environ.get('EMOTION_MODEL_DIR', os.path.join(app.instance_path, 'models')),
+        # Face detection: fixed | adaptive | tiled | auto
+        DETECTION_MODE=os.environ.get('DETECTION_MODE', 'fixed'),
+        # Separate model process (`flask inference serve`): Unix socket path(s), comma-separated. Empty = in-process models
+        INFERENCE_SERVER=os.environ.get('INFERENCE_SERVER', ''),
+        INFERENCE_MAX_BATCH=int(os.environ.get('INFERENCE_MAX_BATCH', 8)),
+        INFERENCE_MAX_WAIT_MS=float(os.environ.get('INFERENCE_MAX_WAIT_MS', 10)),
+        INFERENCE_TIMEOUT=float(os.environ.get('INFERENCE_TIMEOUT', 120)),
+        # Largest capture image accepted by the binary upload mode
+        CAPTURE_MAX_BYTES=int(os.environ.get('CAPTURE_MAX_BYTES', 20 * 1024 * 1024)),
+        # Bulk capture endpoint: frames per request, parallel file writers
+        CAPTURE_BULK_MAX_FRAMES=int(os.environ.get('CAPTURE_BULK_MAX_FRAMES', 50)),
+        CAPTURE_BULK_WORKERS=int(os.environ.get('CAPTURE_BULK_WORKERS', 4)),
+        # Captures API: page size when no ?limit is given, and the largest limit honoured
+        CAPTURES_PAGE_SIZE=int(os.environ.get('CAPTURES_PAGE_SIZE', 60)),
+        CAPTURES_MAX_PAGE_SIZE=int(os.environ.get('CAPTURES_MAX_PAGE_SIZE', 200)),
+        # Video analysis: frames sampled per second, longest clip analyzed, largest upload accepted
+        VIDEO_SAMPLE_FPS=float(os.environ.get('VIDEO_SAMPLE_FPS', 2.0)),
+        VIDEO_MAX_SECONDS=int(os.environ.get('VIDEO_MAX_SECONDS', 600)),
+        VIDEO_MAX_BYTES=int(os.environ.get('VIDEO_MAX_BYTES', 500 * 1024 * 1024)),
+        VIDEO_UPLOAD_DIR=os.path.join(app.instance_path, 'uploads', 'videos'),
+        # Face embedding index: storage precision, live faces before switching to IVF search, IVF lists probed
+        FACE_INDEX_DIR=os.path.join(app.instance_path, 'face_index'),
+        FACE_INDEX_DTYPE=os.environ.get('FACE_INDEX_DTYPE', 'float16'),
+        FACE_INDEX_APPROX_THRESHOLD=int(os.environ.get('FACE_INDEX_APPROX_THRESHOLD', 10000)),
+        FACE_INDEX_NPROBE=int(os.environ.get('FACE_INDEX_NPROBE', 16)),
+        # Near-duplicate reuse: copy the analysis of a capture within MAX_DISTANCE dHash bits and WINDOW_S seconds
+        NEAR_DUPLICATE_REUSE=os.environ.get('NEAR_DUPLICATE_REUSE', '1') == '1',
+        NEAR_DUPLICATE_MAX_DISTANCE=int(os.environ.get('NEAR_DUPLICATE_MAX_DISTANCE', 4)),
+        NEAR_DUPLICATE_WINDOW_S=int(os.environ.get('NEAR_DUPLICATE_WINDOW_S', 300)),
+        # Live channel (needs flask_socketio): async mode, frames a stream may have unacked on the server
+        SOCKETIO_ASYNC_MODE=os.environ.get('SOCKETIO_ASYNC_MODE', 'threading'),
+        SOCKETIO_MAX_INFLIGHT=int(os.environ.get('SOCKETIO_MAX_INFLIGHT', 8)),
+        # Message queue URL (e.g. redis://localhost:6379/0) linking the rooms of several workers. Empty = one process
+        SOCKETIO_MESSAGE_QUEUE=os.environ.get('SOCKETIO_MESSAGE_QUEUE', ''),
+        # Server-side stream ingest (stream_ingest.py): sampling triggers, per-stream limits, streams at once.
+        # STREAM_CPUS is a comma-separated CPU list for the decoding processes (empty = any)
+        STREAM_INTERVAL_S=float(os.environ.get('STREAM_INTERVAL_S', 10)),
+        STREAM_SCENE_BITS=int(os.environ.get('STREAM_SCENE_BITS', 12)),
+        STREAM_DETECT_FACES=os.environ.get('STREAM_DETECT_FACES', '1') == '1',
+        STREAM_MIN_GAP_S=float(os.environ.get('STREAM_MIN_GAP_S', 1.0)),
+        STREAM_MAX_FPS=float(os.environ.get('STREAM_MAX_FPS', 4)),
+        STREAM_NICE=int(os.environ.get('STREAM_NICE', 10)),
+        STREAM_THREADS=int(os.environ.get('STREAM_THREADS', 1)),
+        STREAM_CPUS=os.environ.get('STREAM_CPUS', ''),
+        STREAM_MAX_ACTIVE=int(os.environ.get('STREAM_MAX_ACTIVE', 4)),
+        # Hosts the web routes may stream from: names, IPs or CIDRs, comma-separated. Empty = any public host.
+        # Loopback, private and link-local addresses are refused unless listed here
+        STREAM_ALLOWED_HOSTS=os.environ.get('STREAM_ALLOWED_HOSTS', ''),
+        # Seconds the reports dashboard's numbers are cached per user (writes invalidate them sooner)
+        REPORT_STATS_TTL=int(os.environ.get('REPORT_STATS_TTL', 60)),
+        # Prometheus metrics at /metrics (needs prometheus_client)
+        METRICS_ENABLED=os.environ.get('METRICS_ENABLED', '1') == '1',
     )
+    if test_config is not None:
+        # Tests override settings (e.g. an in-memory database) before anything reads them
+        app.config.update(test_config)
 
     # Ensure the instance folder exists
     try:
@@ -43,8 +113,31 @@ def create_app():
     # --- Register Blueprints ---
     from .routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
+    from . import analysis_jobs, live_channel, metrics, stream_ingest, thumbnails
+    analysis_jobs.init_app(app)
+    thumbnails.init_app(app)
+    stream_ingest.init_app(app)
+    live_channel.init_app(app)
+    metrics.init_app(app)
     from . import analysis_utils
-    with app.app_context():
+    analysis_utils.configure(app.config['EMOTION_BACKEND'], app.config['EMOTION_MODEL_DIR'],
+                             app.config['DETECTION_MODE'])
+    analysis_utils.configure_governor(app.config['ANALYSIS_CONCURRENCY'], app.config['ANALYSIS_THREADS'] or None,
+                                      app.config['ANALYSIS_SLOT_TIMEOUT'])
+    from . import face_index
+    face_index.configure(app.config['FACE_INDEX_DIR'], app.config['FACE_INDEX_DTYPE'],
+                         app.config['FACE_INDEX_APPROX_THRESHOLD'], app.config['FACE_INDEX_NPROBE'])
+    if app.config['INFERENCE_SERVER']:
+        # Web workers keep no models; `flask inference serve` loads them once
+        from .inference_server import InferenceClient
+        analysis_utils.use_inference_server(InferenceClient(
+            app.config['INFERENCE_SERVER'], app.config['SECRET_KEY'].encode(), timeout=app.config['INFERENCE_TIMEOUT']))
+    elif app.config['ANALYSIS_WARMUP'] == 'eager':
         analysis_utils.initialize_models()
+    elif app.config['ANALYSIS_WARMUP'] == 'background':
+        analysis_utils.start_warmup()
+
+    from .commands import register_commands
+    register_commands(app)
 
     return app
\ No newline at end of file
@@ -0,0 +1,389 @@
+# app/analysis_jobs.py
+import hashlib
+import math
+import os
+import queue
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from flask import current_app
+from sqlalchemy import or_
+
+from .models import db, Capture, AnalysisResult
+from . import analysis_utils, analysis_store, capture_storage, metrics, video_analysis
+
+
+# Called with each finished AnalysisJob, inside an app context (e.g. live_channel pushes)
+JOB_LISTENERS = []
+
+
+class QueueFullError(Exception):
+    """Raised when the analysis queue cannot take another job."""
+
+    def __init__(self, retry_after):
+        super().__init__("Analysis queue is full.")
+        self.retry_after = retry_after
+
+
+# --- Job Record ---
+class AnalysisJob:
+    def __init__(self, capture_id, user_id, kind='capture', payload=None):
+        self.id = secrets.token_hex(8)
+        self.capture_id = capture_id
+        self.user_id = user_id
+        self.kind = kind # 'capture' or 'video'
+        self.payload = payload or {}
+        # In-flight dedupe key: one job per capture, every video job is its own
+        self.key = capture_id if kind == 'capture' else (kind, self.id)
+        self.status = 'queued'  # queued -> running -> done | failed
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def wait(self, timeout):
+        """Blocks until the job finishes or the timeout expires."""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        """Job status payload. Needs a request context to render a finished result."""
+        data = {'job_id': self.id, 'capture_id': self.capture_id, 'status': self.status}
+        if self.kind == 'video':
+            data['kind'] = 'video'
+            data['investigation_id'] = self.payload.get('investigation_id')
+            if self.status == 'done':
+                data['result'] = self.result # Plain JSON, nothing to render
+            elif self.status == 'failed':
+                data['error'] = self.error
+            return data
+        if self.status == 'done':
+            result = db.session.get(AnalysisResult, self.result['analysis_id'])
+            if result is None:
+                data['status'], data['error'] = 'failed', "Analysis result no longer exists."
+            else:
+                data['result'] = analysis_store.render(result)
+        elif self.status == 'failed':
+            data['error'] = self.error
+        return data
+
+
+# --- Bounded Worker Pool ---
+class AnalysisJobQueue:
+    """
+    Runs capture analyses on a fixed pool of worker threads.
+    Duplicate submissions for a capture that is already queued or running
+    return the in-flight job instead of creating a new one.
+    """
+
+    def __init__(self, app, workers=2, max_queued=16, job_ttl=600):
+        self.app = app
+        self.workers = workers
+        self.job_ttl = job_ttl
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._inflight = {}
+        self._running = 0
+        self._avg_duration = 5.0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, capture_id, user_id):
+        """Returns (job, created). Raises QueueFullError when the queue is full."""
+        with self._lock:
+            self._prune()
+            job = self._inflight.get(capture_id)
+            if job is not None:
+                return job, False
+            job = AnalysisJob(capture_id, user_id)
+            self._enqueue(job)
+        return job, True
+
+    def submit_video(self, video_path, user_id, investigation_id, sample_fps):
+        """Queues a clip for tracked video analysis. The file is deleted once the job ends."""
+        payload = {'video_path': video_path, 'investigation_id': investigation_id, 'sample_fps': sample_fps}
+        job = AnalysisJob(None, user_id, kind='video', payload=payload)
+        with self._lock:
+            self._prune()
+            self._enqueue(job)
+        return job
+
+    def _enqueue(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError(self._estimate_wait())
+        self._jobs[job.id] = job
+        self._inflight[job.key] = job
+        metrics.ANALYSIS_QUEUE_DEPTH.inc()
+        self._start_workers()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'running': self._running,
+                'workers': self.workers,
+                'max_queued': self._queue.maxsize,
+            }
+
+    def _estimate_wait(self):
+        pending = self._queue.qsize() + self._running
+        return max(1, math.ceil(pending * self._avg_duration / self.workers))
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _start_workers(self):
+        # Workers are started on first use so importing the app stays cheap
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker_loop, name=f"analysis-worker-{len(self._threads)}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                self._running += 1
+            metrics.ANALYSIS_QUEUE_DEPTH.dec()
+            metrics.ANALYSIS_JOBS_RUNNING.inc()
+            job.status = 'running'
+            started = time.time()
+            try:
+                with self.app.app_context():
+                    if job.kind == 'video':
+                        job.result = run_video_analysis(user_id=job.user_id, **job.payload)
+                    else:
+                        job.result = run_capture_analysis(job.capture_id, job.user_id)
+                if 'error' in job.result:
+                    job.status, job.error = 'failed', job.result['error']
+                else:
+                    job.status = 'done'
+            except Exception as e:
+                print(f"[WARN] Analysis job {job.id} failed: {e}")
+                job.status, job.error = 'failed', str(e)
+            finally:
+                job.finished_at = time.time()
+                with self._lock:
+                    self._running -= 1
+                    if job.kind == 'capture': # Clips would skew the per-capture wait estimate
+                        self._avg_duration = 0.8*self._avg_duration + 0.2*(job.finished_at - started)
+                    self._inflight.pop(job.key, None)
+                metrics.ANALYSIS_JOBS_RUNNING.dec()
+                metrics.ANALYSIS_JOBS.labels(job.kind, job.status).inc()
+                job._done.set()
+                for listener in JOB_LISTENERS:
+                    try:
+                        with self.app.app_context():
+                            listener(job)
+                    except Exception as e:
+                        print(f"[WARN] Job listener failed for {job.id}: {e}")
+                self._queue.task_done()
+
+
+# --- Job Body ---
+def run_capture_analysis(capture_id, user_id=None):
+    """
+    Analyzes one capture and saves the result. Must run inside an app context.
+    Returns {"analysis_id": ...} or {"error": ...}; the JSON is rendered per request.
+    """
+    capture = db.session.get(Capture, capture_id)
+    if capture is None:
+        return {"error": "Capture not found."}
+
+    image_path = capture_storage.path_for(capture.image_filename)
+    if not os.path.exists(image_path):
+        return {"error": "Capture file not found."}
+
+    # Stored results are served without touching the models. Content-addressed files are named by their digest
+    digest = capture_storage.digest_of(capture.image_filename) or analysis_store.file_digest(image_path)
+    cached = analysis_store.get_cached(capture, digest)
+    if cached is not None:
+        return {"analysis_id": cached.id}
+
+    if not analysis_utils.models_ready():
+        return {"error": "Analysis models are not loaded."}
+    img, error = analysis_utils.load_image(image_path)
+    if error:
+        return {"error": error}
+
+    try:
+        with analysis_utils.analysis_slot(user_id):
+            analysis = analysis_utils.analyze_image(img)
+    except analysis_utils.AnalysisBusyError as e:
+        return {"error": str(e)}
+    try:
+        result = analysis_store.save(capture, digest, analysis)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error saving analysis result: {e}")
+        return {"error": "Could not save the analysis result."}
+
+    return {"analysis_id": result.id}
+
+
+def run_video_analysis(video_path, investigation_id, sample_fps, user_id=None):
+    """Tracked panic time series for an uploaded clip. Returns the summary or {"error": ...}."""
+    try:
+        if not analysis_utils.models_ready():
+            return {"error": "Analysis models are not loaded."}
+        try:
+            with analysis_utils.analysis_slot(user_id):
+                summary = video_analysis.analyze_video(
+                    video_path, sample_fps=sample_fps,
+                    max_seconds=current_app.config['VIDEO_MAX_SECONDS'],
+                )
+        except (ValueError, analysis_utils.AnalysisBusyError) as e:
+            return {"error": str(e)}
+        if not summary['sampled_frames']:
+            return {"error": "No frames could be decoded from the video."}
+        summary['investigation_id'] = investigation_id
+        return summary
+    finally:
+        # Uploaded clips are only kept for the duration of the job
+        try:
+            os.remove(video_path)
+        except OSError:
+            pass
+
+
+# --- Investigation Batches ---
+# One batch per investigation at a time, per process
+_active_batches = set()
+_active_batches_lock = threading.Lock()
+
+
+def claim_batch(investigation_id):
+    """Marks an investigation as being batch-analyzed. False if a batch is already running."""
+    with _active_batches_lock:
+        if investigation_id in _active_batches:
+            return False
+        _active_batches.add(investigation_id)
+        return True
+
+
+def release_batch(investigation_id):
+    with _active_batches_lock:
+        _active_batches.discard(investigation_id)
+
+
+def pending_captures(investigation_id):
+    """Captures with no stored result for the current model and scoring versions."""
+    return (Capture.query.outerjoin(AnalysisResult)
+            .filter(Capture.investigation_id == investigation_id)
+            .filter(or_(AnalysisResult.id.is_(None),
+                        AnalysisResult.model_version != analysis_utils.MODEL_VERSION,
+                        AnalysisResult.scoring_version != analysis_utils.SCORING_VERSION))
+            .order_by(Capture.timestamp, Capture.id)
+            .all())
+
+
+def _load_capture(image_path):
+    """Reads a capture once for both its digest and its pixels: (digest, img, error)."""
+    try:
+        with open(image_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None, None, "Capture file not found."
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None, None, "Could not read the image file."
+    return hashlib.sha256(data).hexdigest(), img, None
+
+
+def analyze_investigation(investigation_id, chunk_size=8, workers=2, user_id=None):
+    """
+    Generator of progress events while analyzing every pending capture of an investigation.
+    Each result is committed as soon as it is ready, so a batch that dies part-way
+    resumes where it stopped: finished captures are no longer pending.
+    Must be iterated inside a request context (results are rendered with url_for).
+    """
+    total = Capture.query.filter_by(investigation_id=investigation_id).count()
+    pending = pending_captures(investigation_id)
+    yield {"type": "start", "total": total, "pending": len(pending), "skipped": total - len(pending)}
+
+    started = time.time()
+    counts = {"analyzed": 0, "cached": 0, "failed": 0}
+
+    def event(capture, status, result=None, error=None):
+        counts[status] += 1
+        data = {"type": "result", "capture_id": capture.id, "status": status,
+                "done": sum(counts.values()), "pending": len(pending)}
+        if result is not None:
+            data["result"] = analysis_store.render(result)
+        if error:
+            data["error"] = error
+        return data
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            paths = [capture_storage.path_for(c.image_filename) for c in chunk]
+            to_infer = []
+            for capture, (digest, img, error) in zip(chunk, pool.map(_load_capture, paths)):
+                if error:
+                    yield event(capture, "failed", error=error)
+                    continue
+                cached = analysis_store.get_cached(capture, digest)
+                if cached is not None:
+                    yield event(capture, "cached", result=cached)
+                else:
+                    to_infer.append((capture, digest, img))
+
+            if not to_infer:
+                continue
+            # One detection pass per image on the pool, one emotion pass for the whole chunk
+            try:
+                # One slot per chunk, released before the results are streamed
+                with analysis_utils.analysis_slot(user_id):
+                    analyses = analysis_utils.analyze_images([img for _, _, img in to_infer], pool=pool)
+            except analysis_utils.AnalysisBusyError as e:
+                for capture, _, _ in to_infer:
+                    yield event(capture, "failed", error=str(e))
+                continue
+            except Exception as e:
+                print(f"[WARN] Batch analysis failed for investigation {investigation_id}: {e}")
+                for capture, _, _ in to_infer:
+                    yield event(capture, "failed", error="Analysis failed.")
+                continue
+            for (capture, digest, _), analysis in zip(to_infer, analyses):
+                try:
+                    result = analysis_store.save(capture, digest, analysis)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error saving analysis result: {e}")
+                    yield event(capture, "failed", error="Could not save the analysis result.")
+                    continue
+                yield event(capture, "analyzed", result=result)
+
+    yield dict(type="end", elapsed_s=round(time.time() - started, 3), **counts)
+
+
+def init_app(app):
+    app.extensions['analysis_jobs'] = AnalysisJobQueue(
+        app,
+        workers=app.config['ANALYSIS_WORKERS'],
+        max_queued=app.config['ANALYSIS_QUEUE_SIZE'],
+        job_ttl=app.config['ANALYSIS_JOB_TTL'],
+    )
+
+
+def get_queue():
+    return current_app.extensions['analysis_jobs']
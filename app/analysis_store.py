@@ -0,0 +1,177 @@
+# app/analysis_store.py
+import hashlib
+from collections import Counter
+
+from flask import url_for
+from sqlalchemy import select
+
+from .models import db, AnalysisResult, AnalysisFace, Capture
+from . import analysis_utils, face_index, near_duplicates
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """sha256 of a file's bytes, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _is_current(result, digest):
+    if (result.model_version != analysis_utils.MODEL_VERSION
+            or result.scoring_version != analysis_utils.SCORING_VERSION):
+        return False
+    if result.content_hash == digest:
+        return True
+    if result.reused_from_id is None:
+        return False
+    # A near-duplicate copy keeps its source's hash (see get_cached). It stays
+    # current while the source capture still holds a real analysis of those bytes
+    return db.session.query(AnalysisResult.id).filter_by(
+        capture_id=result.reused_from_id,
+        content_hash=result.content_hash,
+        model_version=result.model_version,
+        scoring_version=result.scoring_version,
+        reused_from_id=None,
+    ).first() is not None
+
+
+def get_cached(capture, digest):
+    """
+    Returns a stored AnalysisResult for this capture's bytes, or None.
+    A result stored for another capture with identical bytes is copied over,
+    and so is one from a near-duplicate capture of the same scene (see
+    near_duplicates.find_reusable), so no inference is needed in any case.
+    A near-duplicate copy is stored under the source's content_hash, the bytes
+    its boxes and scores describe, so it is never served as an exact-bytes hit.
+    """
+    result = capture.analysis
+    if result is not None and _is_current(result, digest):
+        return result
+
+    donor = AnalysisResult.query.filter_by(
+        content_hash=digest,
+        model_version=analysis_utils.MODEL_VERSION,
+        scoring_version=analysis_utils.SCORING_VERSION,
+    ).filter(AnalysisResult.reused_from_id.is_(None)).first() # Exact hits only come from real analyses
+    if donor is not None:
+        return _copy_from(capture, digest, donor)
+
+    match = near_duplicates.find_reusable(capture)
+    if match is not None:
+        source, distance = match
+        print(f"[INFO] Capture {capture.id} reuses the analysis of capture {source.id} (dHash distance {distance}).")
+        return _copy_from(capture, source.analysis.content_hash, source.analysis, reused_from=source)
+    return None
+
+
+def _copy_from(capture, digest, donor, reused_from=None):
+    result = save(capture, digest, to_analysis(donor), reused_from=reused_from)
+    try:
+        face_index.get_index(capture.investigation_id).copy_capture(
+            face_index.get_index(donor.capture.investigation_id), donor.capture_id, capture.id)
+    except Exception as e:
+        print(f"[WARN] Could not copy face embeddings from capture {donor.capture_id}: {e}")
+    return result
+
+
+def detach_copies(investigation_id):
+    """
+    Clears reused_from_id on results copied from this investigation's captures,
+    before they are deleted. SQLite does not enforce the column's ON DELETE SET NULL.
+    """
+    sources = select(Capture.id).where(Capture.investigation_id == investigation_id)
+    AnalysisResult.query.filter(AnalysisResult.reused_from_id.in_(sources)) \
+        .update({AnalysisResult.reused_from_id: None}, synchronize_session=False)
+
+
+def save(capture, digest, analysis, reused_from=None):
+    """Stores a raw analysis for a capture, replacing any stale result."""
+    if capture.analysis is not None:
+        db.session.delete(capture.analysis)
+        db.session.flush()
+
+    emotions = Counter(face['emotion_label'] for face in analysis['faces'])
+    emotions.pop('N/A', None)
+    result = AnalysisResult(
+        capture=capture,
+        content_hash=digest,
+        model_version=analysis_utils.MODEL_VERSION,
+        scoring_version=analysis_utils.SCORING_VERSION,
+        total_faces=analysis['total_faces'],
+        male_count=analysis['male_count'],
+        female_count=analysis['female_count'],
+        panic_score=analysis['panic_score'],
+        emotion_summary=dict(emotions),
+        reused_from_id=reused_from.id if reused_from is not None else None,
+    )
+    for face in analysis['faces']:
+        x1, y1, x2, y2 = face['bbox']
+        result.faces.append(AnalysisFace(
+            face_index=face['id'],
+            x1=x1, y1=y1, x2=x2, y2=y2,
+            gender=face['gender'],
+            age=face['age'],
+            emotion_label=face['emotion_label'],
+            det_score=face['face_conf'],
+            fear_score=face['emo_fear'],
+            vulnerability=face['age_vuln'],
+            gender_score=face['gender_score'],
+            raw_score=face['raw_score'],
+            panic_score=face['panic_score'],
+        ))
+    db.session.add(result)
+    db.session.commit()
+
+    # Fresh analyses carry embeddings; copies of a stored result are indexed by get_cached
+    if all('embedding' in face for face in analysis['faces']):
+        try:
+            face_index.get_index(capture.investigation_id).add(
+                capture.id, [(face['id'], face['embedding']) for face in analysis['faces']])
+        except Exception as e:
+            print(f"[WARN] Could not index faces of capture {capture.id}: {e}")
+    return result
+
+
+def to_analysis(result):
+    """Rebuilds the raw analysis dict produced by analysis_utils.analyze_image."""
+    return {
+        "total_faces": result.total_faces,
+        "male_count": result.male_count,
+        "female_count": result.female_count,
+        "panic_score": result.panic_score,
+        "faces": [{
+            "id": face.face_index,
+            "bbox": face.bbox,
+            "gender": face.gender,
+            "age": face.age,
+            "emotion_label": face.emotion_label,
+            "face_conf": face.det_score,
+            "emo_fear": face.fear_score,
+            "age_vuln": face.vulnerability,
+            "gender_score": face.gender_score,
+            "raw_score": face.raw_score,
+            "panic_score": face.panic_score,
+        } for face in result.faces],
+    }
+
+
+def crop_version(content_hash, bbox):
+    """
+    Cache key of a face crop: the image bytes and the box cut from them, so a re-analysis
+    that moves the box gets a new URL. Result ids are not used; SQLite can hand a
+    replaced row's id to its successor.
+    """
+    return hashlib.sha1(f"{content_hash}:{','.join(map(str, bbox))}".encode()).hexdigest()[:16]
+
+
+def render(result):
+    """JSON payload for the reports UI. Face crops are served by URL, see routes.face_crop."""
+    def crop_url(face):
+        return url_for('main.face_crop', capture_id=result.capture_id, face_index=face['id'],
+                       v=crop_version(result.content_hash, face['bbox']))
+    payload = analysis_utils.format_analysis(to_analysis(result), crop_url)
+    if result.reused_from_id is not None:
+        payload["reused_from"] = {"capture_id": result.reused_from_id}
+    return payload
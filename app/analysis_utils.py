@@ -1,56 +1,281 @@
 # app/analysis_utils.py
 import cv2
-import torch
 import numpy as np
-from PIL import Image
-import base64
-from io import BytesIO
-import asyncio
-import scipy.io.wavfile as wav
-import tempfile
-
-# --- Conditionally import models to avoid errors during setup ---
-try:
-    from insightface.app import FaceAnalysis
-    from transformers import ViTImageProcessor, ViTForImageClassification
-    MODELS_LOADED = True
-except ImportError:
-    MODELS_LOADED = False
+import importlib.util
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+from .emotion_backends import EMOTION_MODEL_ID, load_backend
+from .panic_scoring import FaceBatch
+from . import metrics
+
+# --- Heavy model libraries (torch, transformers, insightface) are imported lazily ---
+# Only check that they are installed here so importing the app stays fast.
+MODELS_LOADED = all(importlib.util.find_spec(m) is not None for m in ("torch", "insightface", "transformers"))
 
 # --- Global Variables ---
 device = "cpu"
 face_app = None
 processor = None
-emotion_model = None
+emotion_backend = None
+EMOTION_BACKEND = "torch" # See emotion_backends.BACKENDS
+EMOTION_MODEL_DIR = None # Where `flask emotion export` writes the ONNX files
+# Model lifecycle: cold -> loading -> ready | failed ("unavailable" when libraries are missing)
+MODEL_STATE = "cold" if MODELS_LOADED else "unavailable"
+MODEL_ERROR = None
+_models_lock = threading.Lock()
+_warmup_thread = None
+# Set by use_inference_server(): models live in a separate process (inference_server.py)
+INFERENCE_CLIENT = None
+# Face detection: "fixed" (640x640 for every image), "adaptive" (size picked per image),
+# "tiled" (overlapping tiles plus one whole-image pass) or "auto" (adaptive, tiled for very large images)
+DETECTION_MODES = ("fixed", "adaptive", "tiled", "auto")
+DETECTION_MODE = "fixed"
+DET_FIXED_SIZE = (640, 640)
+DET_SIZE_RANGE = (320, 1280) # Min/max detector long side in adaptive mode
+DET_MIN_FACE_PX = 16 # Smallest face (source pixels) adaptive mode should still find
+DETECTOR_MIN_FACE_PX = 12 # Smallest face RetinaFace reliably finds at its input scale
+TILE_SIZE = 640
+TILE_OVERLAP = 0.25
+TILE_WORKERS = 4
+NMS_IOU = 0.4
+# Stored analyses are reused only while both of these match
+MODEL_VERSION = f"buffalo_l+{EMOTION_MODEL_ID}:{EMOTION_BACKEND}"
+SCORING_VERSION = "1"
 EMOTIONS = ['Angry', 'Disgust', 'Fear', 'Happy', 'Sad', 'Surprise', 'Neutral']
+EMOTION_BATCH_SIZE = 32 # Max face crops per emotion model forward pass
 AGE_BUCKETS = [(1,5),(6,10),(11,15),(16,20),(21,25),(26,30),
                (31,35),(36,40),(41,45),(46,50),(51,55),(56,60),(61,65),(66,70),(71,75),(76,80),
                (81,85),(86,90),(91,95),(96,100)]
 
 # --- Model Initialization ---
+def configure(emotion_backend_name="torch", emotion_model_dir=None, detection_mode="fixed"):
+    """Applies app config before the models load. Backend and detection mode are part of MODEL_VERSION."""
+    global EMOTION_BACKEND, EMOTION_MODEL_DIR, DETECTION_MODE, MODEL_VERSION
+    if detection_mode not in DETECTION_MODES:
+        raise ValueError(f"Unknown detection mode '{detection_mode}'. Choose one of: {', '.join(DETECTION_MODES)}")
+    EMOTION_BACKEND = emotion_backend_name
+    EMOTION_MODEL_DIR = emotion_model_dir
+    DETECTION_MODE = detection_mode
+    detector = "buffalo_l" if detection_mode == "fixed" else f"buffalo_l/{detection_mode}"
+    MODEL_VERSION = f"{detector}+{EMOTION_MODEL_ID}:{EMOTION_BACKEND}"
+
+def use_inference_server(client):
+    """Routes analysis to an inference_server.InferenceClient instead of loading models here."""
+    global INFERENCE_CLIENT
+    INFERENCE_CLIENT = client
+
 def initialize_models():
-    """Initializes and loads all the necessary AI models."""
-    global device, face_app, processor, emotion_model
+    """Initializes and loads all the necessary AI models. Safe to call from several threads."""
+    global device, face_app, processor, emotion_backend, MODEL_STATE, MODEL_ERROR
+    if INFERENCE_CLIENT is not None: # The inference server owns the models
+        return
     if not MODELS_LOADED:
         print("[WARN] Analysis libraries not installed. Skipping model loading.")
         return
 
-    if face_app is not None: # Models already loaded
+    with _models_lock:
+        if face_app is not None: # Models already loaded
+            return
+        MODEL_STATE = "loading"
+        try:
+            import torch
+            from insightface.app import FaceAnalysis
+            from transformers import ViTImageProcessor
+
+            device = "mps" if torch.backends.mps.is_available() else ("cuda" if torch.cuda.is_available() else "cpu")
+            print(f"[INFO] Using device: {device}")
+
+            threads = GOVERNOR.threads_per_analysis
+            torch.set_num_threads(threads)
+            print(f"[INFO] {threads} intra-op threads per analysis, {GOVERNOR.slots} concurrent analyses.")
+
+            print("[INFO] Loading InsightFace...")
+            app = FaceAnalysis(name="buffalo_l")
+            app.prepare(ctx_id=0, det_size=DET_FIXED_SIZE)
+            _limit_onnx_threads(app, threads)
+            print("[INFO] InsightFace ready.")
+
+            print(f"[INFO] Loading HuggingFace ViT Emotion Model ({EMOTION_BACKEND} backend)...")
+            processor = ViTImageProcessor.from_pretrained(EMOTION_MODEL_ID)
+            emotion_backend = load_backend(EMOTION_BACKEND, EMOTION_MODEL_DIR, device=device, num_threads=threads)
+            print("[INFO] Emotion model loaded successfully.")
+
+            # Published last: face_app being set is what marks the models as usable
+            face_app = app
+            MODEL_STATE = "ready"
+        except Exception as e:
+            MODEL_STATE, MODEL_ERROR = "failed", str(e)
+            print(f"[WARN] Model loading failed: {e}")
+
+def _limit_onnx_threads(app, threads):
+    """Recreates InsightFace's ONNX sessions with an intra-op thread budget (it takes no session options)."""
+    import onnxruntime as ort
+
+    for model in app.models.values():
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        model.session = ort.InferenceSession(model.model_file, options, providers=model.session.get_providers())
+
+def start_warmup():
+    """Loads the models on a background thread. Returns immediately; repeat calls are no-ops."""
+    global _warmup_thread
+    if MODEL_STATE != "cold" or INFERENCE_CLIENT is not None:
         return
+    with _models_lock:
+        if _warmup_thread is not None:
+            return
+        _warmup_thread = threading.Thread(target=initialize_models, name="model-warmup", daemon=True)
+        _warmup_thread.start()
+
+def models_ready():
+    return model_status()["state"] == "ready"
+
+def model_status():
+    global MODEL_VERSION
+    if INFERENCE_CLIENT is not None:
+        status = INFERENCE_CLIENT.status()
+        # Results are keyed by the version of the models that actually produced them
+        if status.get("model_version") and status["model_version"] != MODEL_VERSION:
+            print(f"[WARN] Inference server runs {status['model_version']}, not {MODEL_VERSION}. Using the server's.")
+            MODEL_VERSION = status["model_version"]
+        return status
+    return {"state": MODEL_STATE, "device": device, "error": MODEL_ERROR}
+
+
+# --- Admission Control ---
+class AnalysisBusyError(Exception):
+    """Raised when no analysis slot frees up within the governor's timeout."""
+
+
+class AnalysisGovernor:
+    """
+    Caps how many analyses run model inference at once, so concurrent users don't
+    oversubscribe the cores. Requests beyond `slots` wait in a per-user queue and
+    are admitted round-robin across users, so one user's batch can't starve the others.
+    torch and ONNX Runtime thread pools are process-wide, so each analysis gets
+    threads_per_analysis = cores // slots (applied when the models load).
+    """
+
+    def __init__(self, slots=2, threads_per_analysis=None, timeout=60.0):
+        self.configure(slots, threads_per_analysis, timeout)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = OrderedDict() # user -> deque of tickets, in round-robin order
+        self._admitted = self._timed_out = 0
+        self._wait_total = self._wait_max = 0.0
+
+    def configure(self, slots, threads_per_analysis=None, timeout=60.0):
+        self.slots = max(1, slots)
+        self.threads_per_analysis = threads_per_analysis or max(1, (os.cpu_count() or 1) // self.slots)
+        self.timeout = timeout
 
-    device = "mps" if torch.backends.mps.is_available() else ("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"[INFO] Using device: {device}")
+    def _head(self):
+        return next(iter(self._waiting.values()))[0] if self._waiting else None
 
-    print("[INFO] Loading InsightFace...")
-    face_app = FaceAnalysis(name="buffalo_l")
-    face_app.prepare(ctx_id=0, det_size=(640, 640))
-    print("[INFO] InsightFace ready.")
+    def _dequeue_head(self):
+        user, tickets = next(iter(self._waiting.items()))
+        tickets.popleft()
+        if tickets:
+            self._waiting.move_to_end(user) # Next waiter comes from another user
+        else:
+            del self._waiting[user]
 
-    print("[INFO] Loading HuggingFace ViT Emotion Model...")
-    processor = ViTImageProcessor.from_pretrained("abhilash88/face-emotion-detection")
-    emotion_model = ViTForImageClassification.from_pretrained("abhilash88/face-emotion-detection").to(device)
-    emotion_model.eval()
-    print("[INFO] Emotion model loaded successfully.")
+    def _remove(self, user, ticket):
+        tickets = self._waiting[user]
+        tickets.remove(ticket)
+        if not tickets:
+            del self._waiting[user]
+
+    @contextmanager
+    def slot(self, user_id=None):
+        """Holds one analysis slot for the duration of the block. Raises AnalysisBusyError on timeout."""
+        start = time.perf_counter()
+        with self._cond:
+            if self._active >= self.slots or self._waiting:
+                ticket = object()
+                self._waiting.setdefault(user_id, deque()).append(ticket)
+                metrics.ANALYSIS_SLOT_WAITING.inc()
+                deadline = time.monotonic() + self.timeout
+                try:
+                    while not (self._head() is ticket and self._active < self.slots):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._remove(user_id, ticket)
+                            self._timed_out += 1
+                            metrics.ANALYSIS_SLOT_TIMEOUTS.inc()
+                            self._cond.notify_all() # The head may have changed
+                            raise AnalysisBusyError("Analysis capacity is busy. Try again shortly.")
+                        self._cond.wait(remaining)
+                    self._dequeue_head()
+                finally:
+                    metrics.ANALYSIS_SLOT_WAITING.dec()
+            self._active += 1
+            waited = time.perf_counter() - start
+            self._admitted += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._cond.notify_all() # Another slot may still be free for the new head
+        metrics.ANALYSIS_SLOT_WAIT.observe(waited)
+        metrics.ANALYSIS_SLOTS_ACTIVE.inc()
+        try:
+            yield
+        finally:
+            metrics.ANALYSIS_SLOTS_ACTIVE.dec()
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "threads_per_analysis": self.threads_per_analysis,
+                "active": self._active,
+                "waiting": sum(len(t) for t in self._waiting.values()),
+                "waiting_users": len(self._waiting),
+                "admitted": self._admitted,
+                "timed_out": self._timed_out,
+                "mean_wait_s": round(self._wait_total / self._admitted, 4) if self._admitted else 0.0,
+                "max_wait_s": round(self._wait_max, 4),
+            }
+
+
+GOVERNOR = AnalysisGovernor()
+
+def configure_governor(slots, threads_per_analysis=None, timeout=60.0):
+    """Applies app config. Thread budgets take effect when the models load."""
+    GOVERNOR.configure(slots, threads_per_analysis, timeout)
+
+def analysis_slot(user_id=None):
+    return GOVERNOR.slot(user_id)
+
+
+# --- Stage Timing ---
+# Callables observer(stage, seconds), notified after each pipeline stage finishes.
+# They may be called from detection pool threads. With no observers, stages are not timed.
+STAGE_OBSERVERS = []
+STAGES = ("decode", "detection", "attributes", "crop", "emotion_preprocess", "emotion_forward",
+          "scoring", "crop_encode")
+
+@contextmanager
+def stage_timer(stage):
+    if not STAGE_OBSERVERS:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for observer in STAGE_OBSERVERS:
+            observer(stage, elapsed)
 
 
 # --- Analysis Helper Functions ---
@@ -62,24 +287,52 @@ def age_to_range(age):
     return "100+"
 
 def get_emotion_vit(face_crop):
+    labels, fear_scores = get_emotions_vit_batch([face_crop])
+    return labels[0], fear_scores[0]
+
+def get_emotions_vit_batch(face_crops):
+    """
+    Runs the ViT emotion model over many face crops at once.
+    Returns a list of labels and a list of fear scores, one per crop.
+    """
+    labels = ["N/A"] * len(face_crops)
+    fear_scores = [0.0] * len(face_crops)
+    if not MODELS_LOADED or emotion_backend is None:
+        return labels, fear_scores
+
+    valid_idx = [i for i, crop in enumerate(face_crops) if crop is not None and crop.size > 0]
+    if not valid_idx:
+        return labels, fear_scores
+
     try:
-        if not MODELS_LOADED or face_crop.size == 0:
-            return "N/A", 0.0
-        img_pil = Image.fromarray(cv2.cvtColor(face_crop, cv2.COLOR_BGR2RGB))
-        inputs = processor(img_pil, return_tensors="pt").to(device)
-        with torch.no_grad():
-            outputs = emotion_model(**inputs)
-            probs = torch.nn.functional.softmax(outputs.logits, dim=-1)
-            idx = torch.argmax(probs, dim=-1).item()
-            pred_emotion = EMOTIONS[idx]
-        fear_score = (
-            probs[0][2].item() + 0.5*probs[0][5].item() + 0.3*probs[0][0].item() + 0.2*probs[0][1].item()
-        )
-        fear_score = np.clip(fear_score,0,1)
-        return pred_emotion, fear_score
+        # The processor takes RGB arrays directly, so there is no PIL round-trip here.
+        # Their layout is stated: guessing it from the first crop misreads one 1 or 3 pixels tall
+        with stage_timer("emotion_preprocess"):
+            rgb_crops = [cv2.cvtColor(face_crops[i], cv2.COLOR_BGR2RGB) for i in valid_idx]
+        probs = []
+        for start in range(0, len(rgb_crops), EMOTION_BATCH_SIZE):
+            chunk = rgb_crops[start:start + EMOTION_BATCH_SIZE]
+            with stage_timer("emotion_preprocess"):
+                pixel_values = processor(images=chunk, return_tensors="np",
+                                         input_data_format="channels_last")["pixel_values"]
+            with stage_timer("emotion_forward"):
+                probs.append(emotion_backend.predict_proba(pixel_values))
+        probs = np.concatenate(probs, axis=0)
     except Exception as e:
         print("[WARN] Emotion prediction failed:", e)
-        return "N/A", 0.0
+        return labels, fear_scores
+
+    pred_idx = np.argmax(probs, axis=-1)
+    fear = fear_scores_from_probs(probs)
+    for row, i in enumerate(valid_idx):
+        labels[i] = EMOTIONS[pred_idx[row]]
+        fear_scores[i] = float(fear[row])
+    return labels, fear_scores
+
+def fear_scores_from_probs(probs):
+    """Fear score per row of an (N, 7) emotion probability matrix."""
+    probs = np.asarray(probs, dtype=np.float64) # Same precision as the old .item() math
+    return np.clip(probs[:, 2] + 0.5*probs[:, 5] + 0.3*probs[:, 0] + 0.2*probs[:, 1], 0, 1)
 
 def get_vulnerability_from_age(age):
     if age is None: return 0.2
@@ -88,6 +341,7 @@ def get_vulnerability_from_age(age):
     if age<=64: return 0.2
     return 0.9
 
+# Per-face reference scorers. panic_scoring.FaceBatch computes the same numbers for whole batches.
 def compute_panic_score(age_vuln, fear, gender_score, conf):
     W_AGE = 0.4; W_FACE = 0.4; W_GENDER = 0.2
     raw_score = W_AGE*age_vuln + W_FACE*fear + W_GENDER*gender_score
@@ -111,79 +365,285 @@ def compute_group_panic(face_data_list):
     PanicScore = 100*np.clip(alpha*G_score_raw + beta*max_individual_raw,0,1)
     return {'PanicScore': PanicScore}
 
-def image_to_base64(img_arr):
-    """Converts a numpy array (OpenCV image) to a base64 string."""
-    _, buffer = cv2.imencode('.jpg', img_arr)
-    return f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}"
+# --- Face Detection ---
+def _round_up_32(value):
+    # RetinaFace needs input sides that are multiples of its largest stride
+    return int(np.ceil(value / 32.0) * 32)
 
-# --- Main Analysis Function ---
-def analyze_image_from_path(image_path):
+def choose_det_size(height, width):
     """
-    Performs full face, emotion, and panic analysis on an image file.
-    Returns a dictionary with group stats and individual face data.
+    Detector input size (w, h) for an image in adaptive mode. The image is shrunk only
+    as far as keeps a DET_MIN_FACE_PX face at DETECTOR_MIN_FACE_PX on the detector input,
+    then clamped to DET_SIZE_RANGE, keeping the image aspect ratio.
     """
-    if not MODELS_LOADED or face_app is None:
-        return {"error": "Analysis models are not loaded."}
+    long_side = max(height, width)
+    scale = min(1.0, DETECTOR_MIN_FACE_PX / DET_MIN_FACE_PX)
+    target = float(np.clip(long_side * scale, *DET_SIZE_RANGE))
+    ratio = target / long_side
+    return _round_up_32(width * ratio), _round_up_32(height * ratio)
+
+def needs_tiling(height, width):
+    """True when adaptive mode would have to shrink the image below the target face size."""
+    scale = min(1.0, DETECTOR_MIN_FACE_PX / DET_MIN_FACE_PX)
+    return max(height, width) * scale > DET_SIZE_RANGE[1] * 1.5
+
+def nms(boxes, scores, iou_threshold=NMS_IOU):
+    """Greedy non-maximum suppression. Returns kept indices, highest score first."""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.maximum(0.0, xx2 - xx1 + 1) * np.maximum(0.0, yy2 - yy1 + 1)
+        iou = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[1:][iou <= iou_threshold]
+    return np.array(keep, dtype=int)
+
+def _tile_origins(length, tile, step):
+    if length <= tile:
+        return [0]
+    return list(range(0, length - tile, step)) + [length - tile]
+
+def _detect_tiled(img):
+    h, w = img.shape[:2]
+    step = max(32, int(TILE_SIZE * (1 - TILE_OVERLAP)))
+    origins = [(x, y) for y in _tile_origins(h, TILE_SIZE, step) for x in _tile_origins(w, TILE_SIZE, step)]
+
+    def detect_tile(origin):
+        x, y = origin
+        tile = img[y:y + TILE_SIZE, x:x + TILE_SIZE]
+        bboxes, kpss = face_app.det_model.detect(tile, input_size=(TILE_SIZE, TILE_SIZE), max_num=0)
+        bboxes = bboxes.copy()
+        bboxes[:, [0, 2]] += x
+        bboxes[:, [1, 3]] += y
+        if kpss is not None:
+            kpss = kpss.copy()
+            kpss[..., 0] += x
+            kpss[..., 1] += y
+        return bboxes, kpss
+
+    # The whole-image pass catches faces too large to fit inside one tile
+    with ThreadPoolExecutor(max_workers=TILE_WORKERS) as pool:
+        results = list(pool.map(detect_tile, origins))
+    results.append(face_app.det_model.detect(img, input_size=choose_det_size(h, w), max_num=0))
+
+    bboxes = np.concatenate([b for b, _ in results], axis=0)
+    if bboxes.shape[0] == 0:
+        return bboxes, None
+    kpss = None
+    if all(k is not None for _, k in results):
+        kpss = np.concatenate([k for _, k in results], axis=0)
+    keep = nms(bboxes[:, :4], bboxes[:, 4])
+    return bboxes[keep], (kpss[keep] if kpss is not None else None)
+
+def detect_boxes(img, mode=None):
+    """Runs only the face detector. Returns (bboxes N x 5, keypoints N x 5 x 2 or None)."""
+    mode = mode or DETECTION_MODE
+    h, w = img.shape[:2]
+    if mode == "auto":
+        mode = "tiled" if needs_tiling(h, w) else "adaptive"
+    if mode == "tiled":
+        return _detect_tiled(img)
+    input_size = choose_det_size(h, w) if mode == "adaptive" else None
+    return face_app.det_model.detect(img, input_size=input_size, max_num=0)
+
+def detect_faces(img, mode=None):
+    """
+    Same output as face_app.get(img), with the detector pass chosen by mode.
+    Age, gender and embedding models run once per face on the full image.
+    """
+    from insightface.app.common import Face
 
+    with stage_timer("detection"):
+        bboxes, kpss = detect_boxes(img, mode)
+    faces = []
+    with stage_timer("attributes"):
+        for i in range(bboxes.shape[0]):
+            face = Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+            run_face_models(img, face)
+            faces.append(face)
+    return faces
+
+def run_face_models(img, face, tasks=None):
+    """Runs the per-face InsightFace models (all but detection, or only `tasks`) on one face."""
+    for taskname, model in face_app.models.items():
+        if taskname == 'detection' or (tasks is not None and taskname not in tasks):
+            continue
+        model.get(img, face)
+    return face
+
+
+# --- Face Crop Helpers ---
+@lru_cache(maxsize=4)
+def _decoded_image(image_path, mtime):
+    return cv2.imread(image_path)
+
+@lru_cache(maxsize=1024)
+def encode_face_crop(image_path, mtime, bbox):
+    """
+    JPEG bytes of one face crop, cut from the source capture by bbox.
+    The file mtime is part of the cache key so a replaced file is not served stale.
+    """
+    with stage_timer("crop_encode"):
+        img = _decoded_image(image_path, mtime)
+        if img is None:
+            return None
+        x1, y1, x2, y2 = bbox
+        ok, buffer = cv2.imencode('.jpg', img[y1:y2, x1:x2])
+        return buffer.tobytes() if ok else None
+
+# --- Main Analysis Function ---
+def load_image(image_path):
+    """Reads an image file with OpenCV. Returns (img, error)."""
     try:
-        img = cv2.imread(image_path)
+        with stage_timer("decode"):
+            img = cv2.imread(image_path)
         if img is None:
-            return {"error": "Could not read the image file."}
+            return None, "Could not read the image file."
     except Exception as e:
-        return {"error": f"Error loading image: {e}"}
+        return None, f"Error loading image: {e}"
+    return img, None
 
-    faces = face_app.get(img)
-    if not faces:
-        return {"group_stats": {}, "faces": []}
+def _detect_and_crop(img):
+    """Detection pass for one image: (number of faces, [(idx, bbox, face, crop), ...])."""
+    faces = detect_faces(img)
+    detected = []
+    with stage_timer("crop"):
+        for idx, f in enumerate(faces):
+            x1, y1, x2, y2 = map(int, f.bbox)
+            face_crop = img[y1:y2, x1:x2]
+            if face_crop.size == 0:
+                continue
+            detected.append((idx, (x1, y1, x2, y2), f, face_crop))
+    return len(faces), detected
 
-    face_data_list = []
-    person_details = []
-    male_count = 0
-    female_count = 0
+def _score_faces(detections, emo_labels, emo_fears):
+    """
+    Scores every face of every image in one vectorised pass (panic_scoring.FaceBatch).
+    `detections` holds one _detect_and_crop result per image. The emotion lists cover
+    all their faces in order. Returns one raw analysis per image.
+    """
+    faces = [f for _, detected in detections for _, _, f, _ in detected]
+    offsets = np.cumsum([0] + [len(detected) for _, detected in detections])
+    batch = FaceBatch(
+        det_score=[float(getattr(f, "det_score", 1.0)) for f in faces],
+        age=[int(f.age) if hasattr(f, "age") else 25 for f in faces],
+        is_male=[f.gender == 1 for f in faces],
+        fear=emo_fears,
+        offsets=offsets,
+    )
+    raw_scores, panic_scores, group_scores = batch.score()
 
-    for idx, f in enumerate(faces):
-        x1, y1, x2, y2 = map(int, f.bbox)
-        face_crop = img[y1:y2, x1:x2]
-        if face_crop.size == 0:
-            continue
+    analyses = []
+    for c, (total_faces, detected) in enumerate(detections):
+        face_records = []
+        for row, (idx, bbox, f, _) in enumerate(detected, start=offsets[c]):
+            face_records.append({
+                "id": idx,
+                "bbox": bbox,
+                "gender": "Male" if batch.is_male[row] else "Female",
+                "age": int(batch.age[row]),
+                "emotion_label": emo_labels[row],
+                "face_conf": float(batch.det_score[row]),
+                "emo_fear": float(batch.fear[row]),
+                "age_vuln": float(batch.vulnerability[row]),
+                "gender_score": float(batch.gender_score[row]),
+                "raw_score": float(raw_scores[row]),
+                "panic_score": float(panic_scores[row]),
+                # Kept for the face index (face_index.py), never sent to the client
+                "embedding": getattr(f, "normed_embedding", None),
+            })
+        male_count = int(batch.is_male[offsets[c]:offsets[c + 1]].sum())
+        analyses.append({
+            "total_faces": total_faces,
+            "male_count": male_count,
+            "female_count": len(detected) - male_count,
+            "panic_score": float(group_scores[c]),
+            "faces": face_records,
+        })
+    return analyses
 
-        gender = "Male" if f.gender == 1 else "Female"
-        if gender == "Male": male_count += 1
-        else: female_count += 1
+def analyze_images(imgs, pool=None):
+    """
+    Analyzes several decoded images together. Detection runs per image (on `pool`
+    when given), then a single batched emotion pass covers every face of every image,
+    and one vectorised pass scores them all.
+    Returns one raw analysis per image, in order.
+    With an inference server configured, the images are sent there instead and
+    batched with other workers' requests.
+    """
+    if INFERENCE_CLIENT is not None:
+        analyses = INFERENCE_CLIENT.analyze_images(imgs)
+    else:
+        if pool is not None:
+            detections = list(pool.map(_detect_and_crop, imgs))
+        else:
+            detections = [_detect_and_crop(img) for img in imgs]
 
-        age = int(f.age) if hasattr(f, "age") else 25
-        age_vuln = get_vulnerability_from_age(age)
-        gender_score = 0.8 if gender == "Male" else 1.0
-        face_conf = float(getattr(f, "det_score", 1.0))
+        crops = [crop for _, detected in detections for _, _, _, crop in detected]
+        emo_labels, emo_fears = get_emotions_vit_batch(crops)
+        with stage_timer("scoring"):
+            analyses = _score_faces(detections, emo_labels, emo_fears)
+    for analysis in analyses:
+        metrics.FACES_PER_CAPTURE.observe(analysis["total_faces"])
+    return analyses
 
-        emo_label, emo_fear = get_emotion_vit(face_crop)
-        raw_score, panic_score = compute_panic_score(age_vuln, emo_fear, gender_score, face_conf)
+def analyze_image(img):
+    """
+    Runs detection, emotion and panic scoring on a decoded BGR image.
+    Returns unformatted numbers so the result can be stored and re-rendered later.
+    """
+    return analyze_images([img])[0]
 
-        face_data_list.append({
-            'emo_fear': emo_fear, 'age_vuln': age_vuln,
-            'gender_score': gender_score, 'face_conf': face_conf, 'raw_score': raw_score
-        })
+def format_analysis(analysis, crop_url=None):
+    """
+    Builds the JSON payload the reports UI expects from a raw analysis.
+    crop_url(face) returns the URL of a face crop; crops are never inlined.
+    """
+    if not analysis["total_faces"]:
+        return {"group_stats": {}, "faces": []}
 
+    person_details = []
+    for face in analysis["faces"]:
         person_details.append({
-            "id": idx,
-            "crop_base64": image_to_base64(face_crop),
-            "gender": gender,
-            "age": age,
-            "age_range": age_to_range(age),
-            "emotion_label": emo_label,
-            "confidence": f"{face_conf:.2%}",
-            "fear_score": f"{emo_fear:.2%}",
-            "vulnerability": f"{age_vuln:.2%}",
-            "panic_score": f"{panic_score:.0f}"
+            "id": face["id"],
+            "bbox": list(face["bbox"]),
+            "crop_url": crop_url(face) if crop_url else None,
+            "gender": face["gender"],
+            "age": face["age"],
+            "age_range": age_to_range(face["age"]),
+            "emotion_label": face["emotion_label"],
+            "confidence": f"{face['face_conf']:.2%}",
+            "fear_score": f"{face['emo_fear']:.2%}",
+            "vulnerability": f"{face['age_vuln']:.2%}",
+            "panic_score": f"{face['panic_score']:.0f}"
         })
 
-    group_scores = compute_group_panic(face_data_list)
     group_stats = {
-        "total_faces": len(faces),
-        "male_count": male_count,
-        "female_count": female_count,
-        "panic_score": f"{group_scores.get('PanicScore', 0.0):.0f}"
+        "total_faces": analysis["total_faces"],
+        "male_count": analysis["male_count"],
+        "female_count": analysis["female_count"],
+        "panic_score": f"{analysis['panic_score']:.0f}"
     }
 
     return {"group_stats": group_stats, "faces": person_details}
 
+def analyze_image_from_path(image_path):
+    """
+    Performs full face, emotion, and panic analysis on an image file.
+    Returns a dictionary with group stats and individual face data.
+    """
+    if not models_ready():
+        return {"error": "Analysis models are not loaded."}
+
+    img, error = load_image(image_path)
+    if error:
+        return {"error": error}
+
+    return format_analysis(analyze_image(img))
@@ -0,0 +1,202 @@
+# app/capture_storage.py
+"""
+Content-addressed storage for capture images.
+
+A capture file is named after the sha256 of its bytes and sharded two levels
+deep under static/captures:
+
+    static/captures/ab/cd/abcd...64 hex....jpg
+
+so no directory holds more than a few hundred files even with millions of
+captures. Capture.image_filename stores that relative path. Identical uploads
+share one file. Its CaptureBlob row counts the captures that reference it, and
+the file is deleted when the last one goes. Adding a reference and removing an
+orphaned file both lock the blob first (_lock_blob), so an identical upload
+racing a deletion either keeps the file alive or writes it again.
+
+Captures saved before this layout keep their flat `<random>.jpg` names, which
+still resolve through path_for / url_for_capture.
+`flask captures migrate-storage` moves them into the sharded layout.
+
+Thumbnails (see thumbnails.py) mirror the capture's relative path under
+static/thumbnails/<size>/, so identical captures share them too.
+"""
+import hashlib
+import os
+import secrets
+from collections import Counter
+
+from flask import current_app, has_request_context, url_for
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import OperationalError
+
+from .models import db, CaptureBlob
+from . import uploads
+
+EXTENSION = ".jpg"
+THUMBNAIL_SIZES = (160, 640) # Longest side in pixels
+THUMBNAIL_EXTENSION = ".webp"
+INCOMING_DIR = ".incoming" # Uploads in progress, on the same filesystem as their final place
+
+
+def captures_dir():
+    return os.path.join(current_app.root_path, 'static', 'captures')
+
+def relative_path(digest):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{EXTENSION}"
+
+def path_for(image_filename):
+    return os.path.join(captures_dir(), image_filename)
+
+def url_for_capture(image_filename):
+    if not has_request_context(): # Background savers (stream_ingest) have no request to build the URL from
+        return f"{current_app.static_url_path}/captures/{image_filename}"
+    return url_for('static', filename=f'captures/{image_filename}')
+
+def thumbnail_filename(image_filename, size):
+    return f"{size}/{os.path.splitext(image_filename)[0]}{THUMBNAIL_EXTENSION}"
+
+def thumbnail_path(image_filename, size):
+    return os.path.join(current_app.root_path, 'static', 'thumbnails', thumbnail_filename(image_filename, size))
+
+def thumbnail_urls(image_filename):
+    return {str(size): url_for('static', filename=f'thumbnails/{thumbnail_filename(image_filename, size)}')
+            for size in THUMBNAIL_SIZES}
+
+def digest_of(image_filename):
+    """sha256 of a content-addressed capture, read from its name. None for legacy files."""
+    name = os.path.splitext(os.path.basename(image_filename))[0]
+    return name if '/' in image_filename and len(name) == 64 else None
+
+
+def _incoming_path():
+    incoming = os.path.join(captures_dir(), INCOMING_DIR)
+    os.makedirs(incoming, exist_ok=True)
+    return os.path.join(incoming, secrets.token_hex(16))
+
+def _lock_blob(digest):
+    """
+    Serializes placing and removing one blob's file until the session commits.
+    An upload and the removal of the same digest's orphaned file then cannot
+    interleave: whichever locks second sees the other's committed result.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(select(func.pg_advisory_xact_lock(int(digest[:15], 16))))
+    else: # SQLite: any write holds the database write lock until commit
+        db.session.execute(update(CaptureBlob).where(CaptureBlob.sha256 == digest)
+                           .values(ref_count=CaptureBlob.ref_count))
+
+def _place(tmp_path, digest):
+    """
+    Moves a staged upload to its content address, or drops it if those bytes are
+    already stored. Only call with the blob locked and its reference added, so an
+    orphan removal cannot unlink the file between this check and the commit.
+    """
+    image_filename = relative_path(digest)
+    final_path = path_for(image_filename)
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+    return image_filename
+
+
+def add_ref(digest, size, count=1):
+    """Counts `count` more captures using a blob, creating its row if needed. Commit is up to the caller."""
+    _lock_blob(digest)
+    insert = postgresql.insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    stmt = insert(CaptureBlob).values(sha256=digest, size=size, ref_count=count)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['sha256'], set_={'ref_count': CaptureBlob.ref_count + count}))
+
+
+def stage_stream(stream, max_bytes):
+    """
+    Streams an uploaded JPEG to a staging file without touching the database,
+    so several can be written from worker threads. Pass each to store_staged.
+    Returns (tmp_path, sha256, size). Raises uploads.UploadError.
+    """
+    hasher = hashlib.sha256()
+    tmp_path = _incoming_path()
+    size = uploads.save_stream(stream, tmp_path, max_bytes, hasher=hasher)
+    return tmp_path, hasher.hexdigest(), size
+
+def store_staged(tmp_path, digest, size):
+    """
+    Adds the reference, then moves the staged file into place. Commit is up to the caller.
+    If the move fails (OSError), the reference is dropped again and the staged file removed.
+    """
+    add_ref(digest, size)
+    try:
+        return _place(tmp_path, digest)
+    except OSError:
+        release([relative_path(digest)])
+        remove_files([tmp_path])
+        raise
+
+def store_stream(stream, max_bytes):
+    """stage_stream plus store_staged. Returns (image_filename, sha256, size)."""
+    tmp_path, digest, size = stage_stream(stream, max_bytes)
+    return store_staged(tmp_path, digest, size), digest, size
+
+def store_bytes(data):
+    """Like store_stream, for an image already in memory."""
+    digest = hashlib.sha256(data).hexdigest()
+    tmp_path = _incoming_path()
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    return store_staged(tmp_path, digest, len(data)), digest, len(data)
+
+
+def release(image_filenames):
+    """
+    Drops one reference per filename (captures being deleted). Returns the filenames
+    no capture uses anymore; pass them to remove_orphans once the deletion is committed.
+    """
+    orphans = []
+    for image_filename, count in Counter(image_filenames).items():
+        digest = digest_of(image_filename)
+        if digest is not None:
+            db.session.execute(update(CaptureBlob).where(CaptureBlob.sha256 == digest)
+                               .values(ref_count=CaptureBlob.ref_count - count))
+            gone = db.session.execute(delete(CaptureBlob).where(CaptureBlob.sha256 == digest,
+                                                                CaptureBlob.ref_count <= 0))
+            if not gone.rowcount:
+                continue
+        # Legacy files (no digest) are owned by exactly one capture
+        orphans.append(image_filename)
+    return orphans
+
+def remove_orphans(image_filenames):
+    """
+    Deletes the files (and thumbnails) of captures returned by release().
+    A content-addressed file is only unlinked if, with the blob locked, no row
+    has been created for it since: an identical upload may have claimed it.
+    Runs one short transaction per blob.
+    """
+    for image_filename in image_filenames:
+        digest = digest_of(image_filename)
+        if digest is not None:
+            try:
+                _lock_blob(digest)
+                claimed = db.session.execute(select(CaptureBlob.sha256).where(CaptureBlob.sha256 == digest)).first()
+            except OperationalError as e: # Lock timeout: a stray file is harmless, a missing one is not
+                db.session.rollback()
+                print(f"[WARN] Kept capture file {image_filename}, could not lock its blob: {e}")
+                continue
+            if claimed is not None:
+                db.session.commit()
+                continue
+        remove_files([path_for(image_filename)] +
+                     [thumbnail_path(image_filename, size) for size in THUMBNAIL_SIZES])
+        if digest is not None:
+            db.session.commit()
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
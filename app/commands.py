@@ -0,0 +1,365 @@
+# app/commands.py
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, case, event, func, or_
+
+from . import analysis_store, analysis_utils, capture_storage, emotion_backends, face_index, near_duplicates, report_stats, stream_ingest, thumbnails
+from .inference_server import InferenceServer, InferenceClient
+from .models import db, IST, Investigation, Capture, Report, ThreadFeedItem
+
+# --- flask emotion ... ---
+emotion_cli = AppGroup('emotion', help='Emotion model conversion tools.')
+
+
+@emotion_cli.command('export')
+@click.option('--output', default=None, help='Target directory (defaults to EMOTION_MODEL_DIR).')
+@click.option('--no-quantize', is_flag=True, help='Skip the INT8 ONNX copy.')
+@click.option('--opset', default=17, show_default=True)
+def export_emotion_model(output, no_quantize, opset):
+    """Exports the ViT emotion model to ONNX (fp32 and dynamic INT8)."""
+    model_dir = output or current_app.config['EMOTION_MODEL_DIR']
+    for path in emotion_backends.export_onnx(model_dir, quantize=not no_quantize, opset=opset):
+        click.echo(f"Wrote {path}")
+    click.echo("Set EMOTION_BACKEND=onnx or onnx-int8 to use it.")
+
+
+# --- flask faces ... ---
+faces_cli = AppGroup('faces', help='Face embedding index tools.')
+
+
+def _investigation_ids(investigation_id):
+    if investigation_id is not None:
+        return [investigation_id]
+    return [inv.id for inv in Investigation.query.order_by(Investigation.id).all()]
+
+
+@faces_cli.command('stats')
+@click.argument('investigation_id', type=int, required=False)
+def face_index_stats(investigation_id):
+    """Shows the size of each investigation's face index."""
+    for inv_id in _investigation_ids(investigation_id):
+        stats = face_index.get_index(inv_id).stats()
+        if stats['rows']:
+            click.echo(f"investigation {inv_id}: {stats}")
+
+
+@faces_cli.command('build')
+@click.argument('investigation_id', type=int, required=False)
+@click.option('--force', is_flag=True, help='Build even below FACE_INDEX_APPROX_THRESHOLD.')
+def build_face_index(investigation_id, force):
+    """(Re)builds the approximate IVF index for one or all investigations."""
+    for inv_id in _investigation_ids(investigation_id):
+        index = face_index.get_index(inv_id)
+        if force or index.needs_rebuild():
+            lists = index.build_ivf()
+            click.echo(f"investigation {inv_id}: {lists} lists")
+
+
+# --- flask captures ... ---
+captures_cli = AppGroup('captures', help='Capture maintenance tools.')
+
+
+@captures_cli.command('dhash-backfill')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--workers', default=4, show_default=True)
+def dhash_backfill(batch_size, workers):
+    """Computes the near-duplicate hash of captures stored before it existed."""
+    done = missing = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        last_id = 0
+        while True:
+            batch = Capture.query.filter(Capture.dhash.is_(None), Capture.id > last_id) \
+                .order_by(Capture.id).limit(batch_size).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+            paths = [capture_storage.path_for(c.image_filename) for c in batch]
+            for capture, dhash in zip(batch, pool.map(near_duplicates.dhash_file, paths)):
+                if dhash is None:
+                    missing += 1
+                else:
+                    capture.dhash = dhash
+                    done += 1
+            db.session.commit()
+            click.echo(f"{done} hashed, {missing} unreadable")
+
+
+def _link_or_copy(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target) # The old name stays valid until the commit
+    except OSError:
+        shutil.copy2(source, target)
+
+
+@captures_cli.command('migrate-storage')
+@click.option('--batch-size', default=200, show_default=True)
+def migrate_storage(batch_size):
+    """
+    Moves flat legacy capture files, and their thumbnails, into the
+    content-addressed layout. Captures whose thumbnails cannot be moved are
+    marked not ready, for `flask captures thumbnails-backfill`.
+    """
+    moved = deduplicated = missing = no_thumbnails = 0
+    last_id = 0
+    while True:
+        batch = Capture.query.filter(Capture.id > last_id, Capture.image_filename.notlike('%/%')) \
+            .order_by(Capture.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        sources = []
+        for capture in batch:
+            source = capture_storage.path_for(capture.image_filename)
+            if not os.path.exists(source):
+                missing += 1
+                continue
+            digest = analysis_store.file_digest(source)
+            image_filename = capture_storage.relative_path(digest)
+            target = capture_storage.path_for(image_filename)
+            capture_storage.add_ref(digest, os.path.getsize(source)) # Locks the blob before the check below
+            if os.path.exists(target):
+                deduplicated += 1
+            else:
+                _link_or_copy(source, target)
+            # Thumbnail paths follow image_filename, so they move with it
+            thumbnails_moved = True
+            for size in capture_storage.THUMBNAIL_SIZES:
+                old_thumbnail = capture_storage.thumbnail_path(capture.image_filename, size)
+                new_thumbnail = capture_storage.thumbnail_path(image_filename, size)
+                if os.path.exists(old_thumbnail):
+                    if not os.path.exists(new_thumbnail):
+                        _link_or_copy(old_thumbnail, new_thumbnail)
+                    sources.append(old_thumbnail)
+                elif not os.path.exists(new_thumbnail):
+                    thumbnails_moved = False
+            if capture.thumbnails_ready and not thumbnails_moved:
+                capture.thumbnails_ready = False
+                no_thumbnails += 1
+            capture.image_filename = image_filename
+            sources.append(source)
+            moved += 1
+        db.session.commit()
+        capture_storage.remove_files(sources)
+        click.echo(f"{moved} moved ({deduplicated} duplicates), {missing} missing")
+    if no_thumbnails:
+        click.echo(f"{no_thumbnails} captures lost their thumbnails. Run `flask captures thumbnails-backfill`.")
+
+
+@captures_cli.command('thumbnails-backfill')
+@click.option('--batch-size', default=200, show_default=True)
+@click.option('--workers', default=4, show_default=True)
+def thumbnails_backfill(batch_size, workers):
+    """Generates thumbnails for captures that have none yet."""
+    app = current_app._get_current_object()
+
+    def generate(image_filename):
+        with app.app_context():
+            return thumbnails.generate_for(image_filename)
+
+    done = failed = 0
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = Capture.query.filter(Capture.thumbnails_ready.is_(False), Capture.id > last_id) \
+                .order_by(Capture.id).limit(batch_size).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for capture, ok in zip(batch, pool.map(generate, [c.image_filename for c in batch])):
+                if ok:
+                    capture.thumbnails_ready = True
+                    done += 1
+                else:
+                    failed += 1
+            db.session.commit()
+            click.echo(f"{done} captures done, {failed} failed")
+
+
+@captures_cli.command('duplicates')
+@click.argument('investigation_id', type=int, required=False)
+@click.option('--max-distance', type=int, default=None, help='Defaults to NEAR_DUPLICATE_MAX_DISTANCE.')
+def duplicate_report(investigation_id, max_distance):
+    """Lists clusters of near-duplicate captures per investigation."""
+    if max_distance is None:
+        max_distance = current_app.config['NEAR_DUPLICATE_MAX_DISTANCE']
+    for inv_id in _investigation_ids(investigation_id):
+        captures = Capture.query.filter(Capture.investigation_id == inv_id, Capture.dhash.isnot(None)) \
+            .order_by(Capture.timestamp).all()
+        clusters = near_duplicates.duplicate_clusters(captures, max_distance)
+        if not clusters:
+            continue
+        redundant = sum(len(c) - 1 for c in clusters)
+        click.echo(f"investigation {inv_id}: {len(captures)} captures, {len(clusters)} clusters, {redundant} redundant")
+        for cluster in clusters:
+            click.echo(f"  {len(cluster)} captures: " + ", ".join(str(c.id) for c in cluster))
+
+
+# --- flask inference ... ---
+inference_cli = AppGroup('inference', help='Standalone model server for the web workers.')
+
+
+@inference_cli.command('serve')
+@click.option('--socket', 'address', default=None, help='Unix socket path (defaults to the first INFERENCE_SERVER entry).')
+@click.option('--max-batch', type=int, default=None, help='Defaults to INFERENCE_MAX_BATCH.')
+@click.option('--max-wait-ms', type=float, default=None, help='Defaults to INFERENCE_MAX_WAIT_MS.')
+@click.option('--detect-workers', default=4, show_default=True)
+def inference_serve(address, max_batch, max_wait_ms, detect_workers):
+    """Loads the models once and serves analysis requests over a Unix socket."""
+    config = current_app.config
+    address = address or config['INFERENCE_SERVER'].split(',')[0].strip()
+    if not address:
+        raise click.UsageError('Pass --socket or set INFERENCE_SERVER.')
+    analysis_utils.use_inference_server(None) # This process is the server
+    analysis_utils.initialize_models()
+    if not analysis_utils.models_ready():
+        raise click.ClickException(f"Models not available: {analysis_utils.model_status()}")
+    InferenceServer(
+        address, config['SECRET_KEY'].encode(),
+        max_batch=max_batch or config['INFERENCE_MAX_BATCH'],
+        max_wait_ms=config['INFERENCE_MAX_WAIT_MS'] if max_wait_ms is None else max_wait_ms,
+        detect_workers=detect_workers,
+    ).serve_forever()
+
+
+@inference_cli.command('status')
+def inference_status():
+    """Shows the status and batching counters of each configured inference server."""
+    for address in filter(None, (a.strip() for a in current_app.config['INFERENCE_SERVER'].split(','))):
+        click.echo(f"{address}: {InferenceClient(address, current_app.config['SECRET_KEY'].encode()).status()}")
+
+
+# --- flask streams ... ---
+streams_cli = AppGroup('streams', help='Server-side capture from drone video streams.')
+
+
+@streams_cli.command('ingest')
+@click.argument('investigation_id', type=int)
+@click.argument('source')
+@click.option('--interval', 'interval_s', type=float, default=None, help='Seconds between scheduled captures (0 = off).')
+@click.option('--scene-bits', type=int, default=None, help='dHash bits that count as a scene change (0 = off).')
+@click.option('--faces/--no-faces', 'detect_faces', default=None, help='Capture when new faces appear.')
+@click.option('--max-fps', type=float, default=None, help='Frames looked at per second.')
+@click.option('--duration', type=float, default=None, help='Stop after this many seconds.')
+def streams_ingest(investigation_id, source, interval_s, scene_bits, detect_faces, max_fps, duration):
+    """Samples captures from SOURCE (stream URL or video file) until it ends or Ctrl-C."""
+    if db.session.get(Investigation, investigation_id) is None:
+        raise click.UsageError(f'Investigation {investigation_id} not found.')
+    options = stream_ingest.stream_options(current_app.config, interval_s=interval_s, scene_bits=scene_bits,
+                                           detect_faces=detect_faces, max_fps=max_fps)
+    stream = stream_ingest.StreamIngest(current_app._get_current_object(), investigation_id, source, options)
+    deadline = time.monotonic() + duration if duration else None
+    try:
+        while not stream.finished.wait(5 if deadline is None else max(0.1, min(5, deadline - time.monotonic()))):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            status = stream.status()
+            click.echo(f"{status['captures']} captures, {status['frames_evaluated']}/{status['frames_read']} frames looked at")
+    except KeyboardInterrupt:
+        pass
+    stream.stop()
+    status = stream.status()
+    if status['error']:
+        raise click.ClickException(status['error'])
+    click.echo(f"Saved {status['captures']} captures {status['reasons']} from {status['frames_read']} frames.")
+
+
+# --- flask indexes ... ---
+indexes_cli = AppGroup('indexes', help='Query plan checks for the hot paths.')
+
+# "SCAN <table>" with no index is a full table scan. Ordered index walks read "SCAN <table> USING ... INDEX".
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def _hot_queries(user_id, investigation_id):
+    """(name, callable) pairs that run the queries of the busiest pages, as the routes do."""
+    since = datetime.now(IST)
+    return [
+        ('home: recent investigations', lambda: Investigation.query.filter_by(user_id=user_id)
+            .order_by(Investigation.timestamp.desc()).limit(6).all()),
+        ('home: investigation count', lambda: Investigation.query.filter_by(user_id=user_id).count()),
+        ('home: recent reports', lambda: Report.query.filter_by(user_id=user_id).limit(4).all()),
+        ('home: thread feed', lambda: ThreadFeedItem.query.order_by(ThreadFeedItem.timestamp.desc()).limit(5).all()),
+        ('investigations: list', lambda: Investigation.query.filter_by(user_id=user_id)
+            .order_by(Investigation.timestamp.desc()).all()),
+        ('investigations: status count', lambda: Investigation.query.filter_by(user_id=user_id, status='Live').count()),
+        ('reports: stats', lambda: report_stats.compute(user_id)),
+        ('live_investigation: recent captures', lambda: Capture.query.filter_by(investigation_id=investigation_id)
+            .order_by(Capture.timestamp.desc()).limit(12).all()),
+        ('get_captures: validator', lambda: db.session.query(
+            func.count(Capture.id), func.max(Capture.id), func.sum(case((Capture.thumbnails_ready, 1), else_=0)))
+            .filter(Capture.investigation_id == investigation_id).one()),
+        ('get_captures: page', lambda: Capture.query.filter(
+            Capture.investigation_id == investigation_id,
+            or_(Capture.timestamp < since, and_(Capture.timestamp == since, Capture.id < 1 << 31)))
+            .order_by(Capture.timestamp.desc(), Capture.id.desc()).limit(61).all()),
+    ]
+
+
+@contextmanager
+def recorded_selects(engine):
+    """Collects (statement, parameters) of every SELECT run on `engine` inside the block."""
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def query_plan(engine, statement, parameters):
+    """SQLite's EXPLAIN QUERY PLAN lines for a statement, and the tables it scans without an index."""
+    with engine.connect() as conn:
+        plan = [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+    return plan, [m.group(1) for m in map(FULL_SCAN.match, plan) if m]
+
+
+@indexes_cli.command('check')
+@click.option('--verbose', '-v', is_flag=True, help='Print every plan, not only the failures.')
+def indexes_check(verbose):
+    """
+    Runs EXPLAIN QUERY PLAN on the hot queries against this database and fails if
+    any does a full table scan (SQLite). tests/test_query_plans.py checks the
+    routes themselves; this checks that a deployed database has the indexes.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        raise click.ClickException(f'EXPLAIN QUERY PLAN checks are SQLite-only (this is {engine.dialect.name}).')
+    inv = Investigation.query.order_by(Investigation.id).first()
+    user_id, investigation_id = (inv.user_id, inv.id) if inv is not None else (1, 1) # Plans do not depend on data
+
+    failures = 0
+    for name, run in _hot_queries(user_id, investigation_id):
+        with recorded_selects(engine) as statements:
+            run()
+        for statement, parameters in statements:
+            plan, scans = query_plan(engine, statement, parameters)
+            failures += bool(scans)
+            if scans or verbose:
+                click.echo(f"{'FAIL' if scans else 'ok'}  {name}" + (f": full scan of {', '.join(scans)}" if scans else ''))
+                for line in plan:
+                    click.echo(f"      {line}")
+    if failures:
+        raise click.ClickException(f'{failures} hot query statements fall back to a full table scan. Is the database upgraded?')
+    click.echo('Every hot query uses an index.')
+
+
+def register_commands(app):
+    app.cli.add_command(emotion_cli)
+    app.cli.add_command(faces_cli)
+    app.cli.add_command(captures_cli)
+    app.cli.add_command(inference_cli)
+    app.cli.add_command(streams_cli)
+    app.cli.add_command(indexes_cli)
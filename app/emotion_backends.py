@@ -0,0 +1,132 @@
+# app/emotion_backends.py
+"""
+Interchangeable inference backends for the ViT face-emotion classifier.
+
+All backends take the preprocessed `pixel_values` batch from ViTImageProcessor
+(float32, N x 3 x 224 x 224) and return softmax probabilities (N x 7).
+
+Backends (EMOTION_BACKEND setting):
+  torch       eager PyTorch, fp32. The reference.
+  torch-int8  PyTorch with dynamic INT8 quantization of the Linear layers (CPU only).
+  onnx        exported ONNX graph on ONNX Runtime, fp32.
+  onnx-int8   ONNX graph with dynamic INT8 weight quantization, on ONNX Runtime.
+
+The ONNX files are produced by `flask emotion export`. Outputs must stay within
+TOLERANCES of the torch backend. `benchmarks/bench_emotion_backends.py` checks this
+on the bundled captures.
+"""
+import os
+
+import numpy as np
+
+EMOTION_MODEL_ID = "abhilash88/face-emotion-detection"
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+ONNX_FILENAMES = {"onnx": "face_emotion_vit.onnx", "onnx-int8": "face_emotion_vit.int8.onnx"}
+
+# Allowed drift from the torch fp32 reference, per backend:
+# max absolute fear-score difference, and minimum share of faces with the same label
+TOLERANCES = {
+    "torch": {"max_fear_abs_diff": 0.0, "min_label_agreement": 1.0},
+    "onnx": {"max_fear_abs_diff": 1e-3, "min_label_agreement": 0.99},
+    "torch-int8": {"max_fear_abs_diff": 0.05, "min_label_agreement": 0.95},
+    "onnx-int8": {"max_fear_abs_diff": 0.05, "min_label_agreement": 0.95},
+}
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+# --- PyTorch Backends ---
+class TorchEmotionBackend:
+    name = "torch"
+
+    def __init__(self, device="cpu"):
+        import torch
+        from transformers import ViTForImageClassification
+
+        self._torch = torch
+        self.device = device
+        self.model = ViTForImageClassification.from_pretrained(EMOTION_MODEL_ID).to(device)
+        self.model.eval()
+
+    def predict_proba(self, pixel_values):
+        torch = self._torch
+        with torch.no_grad():
+            inputs = torch.from_numpy(pixel_values).to(self.device)
+            logits = self.model(pixel_values=inputs).logits
+            return torch.nn.functional.softmax(logits, dim=-1).cpu().numpy()
+
+
+class QuantizedTorchEmotionBackend(TorchEmotionBackend):
+    name = "torch-int8"
+
+    def __init__(self):
+        # Dynamic quantization kernels only exist for CPU
+        super().__init__(device="cpu")
+        self.model = self._torch.ao.quantization.quantize_dynamic(
+            self.model, {self._torch.nn.Linear}, dtype=self._torch.qint8
+        )
+
+
+# --- ONNX Runtime Backend ---
+class OnnxEmotionBackend:
+    def __init__(self, model_path, name="onnx", num_threads=None):
+        import onnxruntime as ort
+
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"{model_path} not found. Run `flask emotion export` first.")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.name = name
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict_proba(self, pixel_values):
+        logits = self.session.run(None, {self.input_name: pixel_values.astype(np.float32, copy=False)})[0]
+        return _softmax(logits)
+
+
+def load_backend(name, model_dir, device="cpu", num_threads=None):
+    """Builds the backend selected by EMOTION_BACKEND."""
+    if name == "torch":
+        return TorchEmotionBackend(device)
+    if name == "torch-int8":
+        return QuantizedTorchEmotionBackend()
+    if name in ONNX_FILENAMES:
+        return OnnxEmotionBackend(os.path.join(model_dir, ONNX_FILENAMES[name]), name=name, num_threads=num_threads)
+    raise ValueError(f"Unknown emotion backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+
+
+# --- Conversion ---
+def export_onnx(model_dir, quantize=True, opset=17):
+    """Exports the ViT to ONNX (and optionally an INT8 copy). Returns the written paths."""
+    import torch
+    from transformers import ViTForImageClassification
+
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, ONNX_FILENAMES["onnx"])
+
+    model = ViTForImageClassification.from_pretrained(EMOTION_MODEL_ID)
+    model.eval()
+    model.config.return_dict = False
+    dummy = torch.randn(1, 3, 224, 224)
+    torch.onnx.export(
+        model, (dummy,), fp32_path,
+        input_names=["pixel_values"], output_names=["logits"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+    )
+    written = [fp32_path]
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        int8_path = os.path.join(model_dir, ONNX_FILENAMES["onnx-int8"])
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        written.append(int8_path)
+    return written
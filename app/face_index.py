@@ -0,0 +1,341 @@
+# app/face_index.py
+"""
+Per-investigation face embedding index for "where else does this person appear?".
+
+Each investigation has a directory under FACE_INDEX_DIR holding:
+  vectors.bin  L2-normalised ArcFace embeddings (N x 512, float16 or float32), append-only
+  rows.bin     (capture_id, face_index) per vector; capture_id = -1 marks a tombstone
+  ivf.npz      optional inverted-file index (k-means centroids + per-list row ids)
+
+Both .bin files are memory-mapped for reads. Re-analysing a capture tombstones
+its old rows and appends new ones. An append writes the vectors, then the rows;
+a tail left by an interrupted append is cut off before the next one. Search is an exact, vectorised cosine
+similarity (a dot product, since the vectors are normalised) until the index
+holds APPROX_THRESHOLD live faces. Past that, the IVF index is built in the
+background and queries only scan the NPROBE closest lists, plus any rows added
+since the last build.
+"""
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows: only the in-process lock applies
+    fcntl = None
+
+EMBEDDING_DIM = 512
+ROW_DTYPE = np.dtype([('capture_id', '<i8'), ('face_index', '<i4')])
+SCAN_CHUNK = 16384 # Rows converted to float32 at a time in exact search
+
+INDEX_DIR = None
+VECTOR_DTYPE = np.float16
+APPROX_THRESHOLD = 10000
+NPROBE = 16
+TRAIN_SAMPLE = 50000
+KMEANS_ITERS = 10
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def configure(index_dir, dtype="float16", approx_threshold=10000, nprobe=16):
+    global INDEX_DIR, VECTOR_DTYPE, APPROX_THRESHOLD, NPROBE
+    if dtype not in ("float16", "float32"):
+        raise ValueError("FACE_INDEX_DTYPE must be float16 or float32.")
+    INDEX_DIR = index_dir
+    VECTOR_DTYPE = np.dtype(dtype)
+    APPROX_THRESHOLD = approx_threshold
+    NPROBE = nprobe
+
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def kmeans(vectors, n_clusters, iters=KMEANS_ITERS, seed=0):
+    """Spherical k-means (cosine) on normalised float32 vectors. Returns the centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iters):
+        assign = assign_lists(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = np.bincount(assign, minlength=n_clusters) == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))] # Re-seed empty lists
+        centroids = _normalise(sums)
+    return centroids
+
+def assign_lists(vectors, centroids):
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), SCAN_CHUNK):
+        chunk = np.asarray(vectors[start:start + SCAN_CHUNK], dtype=np.float32)
+        assign[start:start + SCAN_CHUNK] = np.argmax(chunk @ centroids.T, axis=1)
+    return assign
+
+
+class FaceIndex:
+    def __init__(self, path):
+        self.path = path
+        self.vectors_path = os.path.join(path, "vectors.bin")
+        self.rows_path = os.path.join(path, "rows.bin")
+        self.ivf_path = os.path.join(path, "ivf.npz")
+        self._lock = threading.RLock()
+        self._n = 0
+        self._vectors = None
+        self._rows = None
+        self._ivf = None
+        self._ivf_mtime = None
+        self._building = False
+
+    # --- Storage ---
+    @contextmanager
+    def _write_lock(self):
+        """Serialises writers across threads and, where fcntl exists, across processes."""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.path, "lock"), "w") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _sizes(self):
+        """Byte sizes of rows.bin and vectors.bin (0 when missing)."""
+        return tuple(os.path.getsize(p) if os.path.exists(p) else 0 for p in (self.rows_path, self.vectors_path))
+
+    def _repair(self):
+        """
+        Cuts both files back to the rows they have in full. Needs the write lock.
+        An append interrupted between the two writes (crash, ENOSPC, short write)
+        leaves vectors.bin longer than rows.bin. Without this, every later append
+        would pair its rows with the wrong vectors.
+        """
+        vector_bytes = EMBEDDING_DIM * VECTOR_DTYPE.itemsize
+        rows_size, vectors_size = self._sizes()
+        n = min(rows_size // ROW_DTYPE.itemsize, vectors_size // vector_bytes)
+        for path, size, keep in ((self.rows_path, rows_size, n * ROW_DTYPE.itemsize),
+                                 (self.vectors_path, vectors_size, n * vector_bytes)):
+            if size > keep:
+                print(f"[WARN] Face index {self.path}: dropping {size - keep} bytes of "
+                      f"{os.path.basename(path)} left by an interrupted write.")
+                os.truncate(path, keep)
+
+    def _refresh(self):
+        """Re-maps the files if another thread or process appended to them."""
+        rows_size, vectors_size = self._sizes()
+        n = rows_size // ROW_DTYPE.itemsize
+        # vectors.bin may run ahead of rows.bin while an append is in progress, never behind
+        if vectors_size < n * EMBEDDING_DIM * VECTOR_DTYPE.itemsize:
+            raise ValueError(f"Face index {self.path} is damaged: {n} rows but "
+                             f"{vectors_size // (EMBEDDING_DIM * VECTOR_DTYPE.itemsize)} vectors.")
+        if n != self._n:
+            self._n = n
+            self._vectors = np.memmap(self.vectors_path, dtype=VECTOR_DTYPE, mode="r", shape=(n, EMBEDDING_DIM)) if n else None
+            self._rows = np.memmap(self.rows_path, dtype=ROW_DTYPE, mode="r+", shape=(n,)) if n else None
+        mtime = os.path.getmtime(self.ivf_path) if os.path.exists(self.ivf_path) else None
+        if mtime != self._ivf_mtime:
+            self._ivf_mtime = mtime
+            self._ivf = dict(np.load(self.ivf_path)) if mtime else None
+
+    def _tombstone(self, capture_id):
+        if self._n:
+            dead = self._rows["capture_id"] == capture_id
+            if dead.any():
+                self._rows["capture_id"][dead] = -1
+                self._rows.flush()
+
+    def add(self, capture_id, faces):
+        """Replaces a capture's faces. `faces` is a list of (face_index, embedding)."""
+        with self._write_lock():
+            self._refresh()
+            self._tombstone(capture_id)
+            faces = [(idx, emb) for idx, emb in faces if emb is not None]
+            if faces:
+                self._append([capture_id] * len(faces), [idx for idx, _ in faces], [emb for _, emb in faces])
+            self._refresh()
+        self._maybe_rebuild()
+
+    def append(self, capture_ids, face_indices, embeddings):
+        """Bulk append for captures that are not in the index yet (no tombstoning)."""
+        with self._write_lock():
+            self._append(capture_ids, face_indices, embeddings)
+            self._refresh()
+        self._maybe_rebuild()
+
+    def _append(self, capture_ids, face_indices, embeddings):
+        vectors = _normalise(embeddings).astype(VECTOR_DTYPE)
+        rows = np.empty(len(vectors), dtype=ROW_DTYPE)
+        rows["capture_id"], rows["face_index"] = capture_ids, face_indices
+        self._repair() # Drop whatever an interrupted append left, so the files stay row-aligned
+        # Vectors first: a reader sizing the index from rows.bin never sees a row without its vector
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.rows_path, "ab") as f:
+            f.write(rows.tobytes())
+
+    def remove_capture(self, capture_id):
+        with self._write_lock():
+            self._refresh()
+            self._tombstone(capture_id)
+
+    def copy_capture(self, source, source_capture_id, capture_id):
+        """Indexes a capture with the vectors of an identical capture in `source`."""
+        with source._lock:
+            source._refresh()
+            if not source._n:
+                return
+            rows = np.flatnonzero(source._rows["capture_id"] == source_capture_id)
+            faces = [(int(source._rows["face_index"][r]), np.asarray(source._vectors[r], dtype=np.float32)) for r in rows]
+        self.add(capture_id, faces)
+
+    # --- Queries ---
+    def lookup(self, capture_id, face_index):
+        """The stored embedding of one face, or None."""
+        with self._lock:
+            self._refresh()
+            if not self._n:
+                return None
+            hit = np.flatnonzero((self._rows["capture_id"] == capture_id) & (self._rows["face_index"] == face_index))
+            return np.asarray(self._vectors[hit[-1]], dtype=np.float32) if len(hit) else None
+
+    def search(self, query, k=10, exclude=None):
+        """
+        Top-k live faces by cosine similarity to `query`.
+        Returns ([(capture_id, face_index, score), ...], mode). mode is "exact" or "ivf".
+        `exclude` is a (capture_id, face_index) pair left out of the results.
+        """
+        q = _normalise(query)[0]
+        with self._lock:
+            self._refresh()
+            if not self._n:
+                return [], "exact"
+            ivf = self._ivf
+            if ivf is not None and int(ivf["n_indexed"]) <= self._n:
+                candidates = self._ivf_candidates(ivf, q)
+                scores = np.asarray(self._vectors[candidates], dtype=np.float32) @ q
+                mode = "ivf"
+            else:
+                candidates = np.arange(self._n)
+                scores = np.empty(self._n, dtype=np.float32)
+                for start in range(0, self._n, SCAN_CHUNK):
+                    scores[start:start + SCAN_CHUNK] = np.asarray(self._vectors[start:start + SCAN_CHUNK], dtype=np.float32) @ q
+                mode = "exact"
+
+            rows = self._rows[candidates]
+            scores[rows["capture_id"] < 0] = -np.inf
+            if exclude is not None:
+                scores[(rows["capture_id"] == exclude[0]) & (rows["face_index"] == exclude[1])] = -np.inf
+            top = [i for i in _top_k(scores, k) if np.isfinite(scores[i])]
+            return [(int(rows["capture_id"][i]), int(rows["face_index"][i]), float(scores[i])) for i in top], mode
+
+    def _ivf_candidates(self, ivf, q):
+        centroids, order, offsets = ivf["centroids"], ivf["order"], ivf["offsets"]
+        probe = _top_k(centroids @ q, NPROBE)
+        parts = [order[offsets[l]:offsets[l + 1]] for l in probe]
+        parts.append(np.arange(int(ivf["n_indexed"]), self._n)) # Added since the last build
+        # Sorted row ids keep the memmap reads sequential
+        return np.sort(np.concatenate(parts))
+
+    # --- Approximate Index ---
+    def live_count(self):
+        with self._lock:
+            self._refresh()
+            return int((self._rows["capture_id"] >= 0).sum()) if self._n else 0
+
+    def needs_rebuild(self):
+        with self._lock:
+            self._refresh()
+            if self.live_count() < APPROX_THRESHOLD:
+                return False
+            if self._ivf is None:
+                return True
+            indexed = int(self._ivf["n_indexed"])
+            return self._n - indexed > max(1000, indexed // 10)
+
+    def build_ivf(self):
+        """(Re)builds the IVF index over every row present now. Returns the number of lists."""
+        with self._lock:
+            self._refresh()
+            n, vectors = self._n, self._vectors
+            live = np.flatnonzero(self._rows["capture_id"] >= 0) if n else np.array([], dtype=np.int64)
+        if len(live) < 2:
+            return 0
+        started = time.time()
+        n_lists = int(np.clip(np.sqrt(len(live)), 1, 4096))
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(live, min(len(live), max(TRAIN_SAMPLE, 40 * n_lists)), replace=False))
+        centroids = kmeans(np.asarray(vectors[sample], dtype=np.float32), n_lists)
+        assign = assign_lists(vectors[live], centroids)
+        by_list = np.argsort(assign, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+
+        with self._write_lock():
+            tmp_path = self.ivf_path + ".tmp.npz"
+            np.savez(tmp_path, centroids=centroids, order=live[by_list], offsets=offsets, n_indexed=n)
+            os.replace(tmp_path, self.ivf_path)
+            self._refresh()
+        print(f"[INFO] Face index {self.path}: IVF with {n_lists} lists over {len(live)} faces "
+              f"built in {time.time() - started:.1f}s")
+        return n_lists
+
+    def _maybe_rebuild(self):
+        if self._building or not self.needs_rebuild():
+            return
+        self._building = True
+
+        def run():
+            try:
+                self.build_ivf()
+            except Exception as e:
+                print(f"[WARN] Face index rebuild failed for {self.path}: {e}")
+            finally:
+                self._building = False
+
+        threading.Thread(target=run, name="face-index-build", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            return {
+                "rows": self._n,
+                "live": self.live_count(),
+                "dtype": str(VECTOR_DTYPE),
+                "ivf_lists": int(len(self._ivf["centroids"])) if self._ivf is not None else 0,
+                "ivf_indexed": int(self._ivf["n_indexed"]) if self._ivf is not None else 0,
+            }
+
+
+# --- Per-Investigation Access ---
+def get_index(investigation_id):
+    with _indexes_lock:
+        index = _indexes.get(investigation_id)
+        if index is not None:
+            return index
+        index = _indexes[investigation_id] = FaceIndex(os.path.join(INDEX_DIR, f"inv_{investigation_id}"))
+        if os.path.isdir(index.path):
+            with index._write_lock(): # Files opened for the first time in this process: check they line up
+                index._repair()
+        return index
+
+def delete_index(investigation_id):
+    with _indexes_lock:
+        _indexes.pop(investigation_id, None)
+    shutil.rmtree(os.path.join(INDEX_DIR, f"inv_{investigation_id}"), ignore_errors=True)
@@ -0,0 +1,318 @@
+# app/inference_server.py
+"""
+Standalone inference process that owns the analysis models.
+
+Without it, every web worker loads InsightFace and the ViT itself, so model
+memory grows with the number of workers. With INFERENCE_SERVER set to a Unix
+socket path, web workers skip model loading entirely. analysis_utils then
+hands each decoded frame to this process through a shared memory buffer and
+gets the raw analysis back.
+
+Start it with `flask inference serve`, using the same configuration as the
+web app. Several servers can run side by side on different sockets. List
+them comma-separated in INFERENCE_SERVER, and client threads are spread
+across them.
+
+Protocol:
+  - Control messages are small pickled dicts sent over multiprocessing.connection,
+    authenticated with SECRET_KEY.
+  - Pixels never go through the socket. Each client thread keeps one
+    SharedMemory segment, reused and grown as needed, and writes its frames
+    into it.
+  - The server reads the frames in place.
+
+On the server, frames from all connections go into one queue. A batching
+thread takes up to INFERENCE_MAX_BATCH of them, or whatever has arrived within
+INFERENCE_MAX_WAIT_MS, and runs them through a single
+analysis_utils.analyze_images call. That way concurrent requests share one
+emotion forward pass.
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+from multiprocessing import connection, resource_tracker, shared_memory
+
+import numpy as np
+
+from . import analysis_utils, video_analysis
+
+ALIGNMENT = 64 # Frame offsets inside the shared buffer
+MIN_BUFFER_BYTES = 8 * 1024 * 1024
+STATUS_TTL = 2.0 # Seconds a client reuses the last status reply
+STATUS_TIMEOUT = 2.0
+
+
+class InferenceServerError(RuntimeError):
+    """Raised by the client when the inference server cannot be reached or fails."""
+
+
+def _attach(name):
+    """Opens a client's segment without registering it with this process's resource tracker."""
+    shm = shared_memory.SharedMemory(name=name)
+    # Before Python 3.13 attaching registers the segment too, and the tracker would
+    # unlink it when the server exits. The client owns it.
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError: # A frame view is still alive; the mapping goes away with it
+        pass
+
+
+# --- Server ---
+class _Pending:
+    __slots__ = ("img", "result", "error", "done")
+
+    def __init__(self, img):
+        self.img = img
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceServer:
+    def __init__(self, address, authkey, max_batch=8, max_wait_ms=10, detect_workers=4):
+        self.address = address
+        self.authkey = authkey
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.detect_workers = detect_workers
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.stats = {"connections": 0, "requests": 0, "frames": 0, "batches": 0, "max_batch_seen": 0}
+        self.started_at = time.time()
+
+    def serve_forever(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        if os.path.exists(self.address):
+            os.remove(self.address) # Stale socket from a previous run
+        listener = connection.Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        self._pool = ThreadPoolExecutor(max_workers=self.detect_workers, thread_name_prefix="detect")
+        threading.Thread(target=self._batch_loop, name="inference-batcher", daemon=True).start()
+        print(f"[INFO] Inference server listening on {self.address} "
+              f"(batch {self.max_batch}, wait {self.max_wait * 1000:.0f} ms)")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except connection.AuthenticationError:
+                    print("[WARN] Inference server rejected a connection with a bad key.")
+                    continue
+                with self._stats_lock:
+                    self.stats["connections"] += 1
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            self._pool.shutdown(wait=False)
+
+    def _handle(self, conn):
+        segments = {}
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = self._dispatch(message, segments)
+                except ValueError as e:
+                    reply = {"ok": False, "error": str(e), "kind": "ValueError"}
+                except Exception as e:
+                    print(f"[WARN] Inference request failed: {e}")
+                    reply = {"ok": False, "error": str(e)}
+                conn.send(reply)
+        finally:
+            conn.close()
+            for shm in segments.values():
+                _close(shm)
+
+    def _dispatch(self, message, segments):
+        op = message.get("op")
+        if op == "status":
+            return {"ok": True, "status": self.status()}
+        if op == "analyze":
+            return {"ok": True, "analyses": self._analyze(message, segments)}
+        if op == "video":
+            summary = video_analysis.analyze_video(
+                message["path"], sample_fps=message["sample_fps"], max_seconds=message["max_seconds"])
+            return {"ok": True, "summary": summary}
+        raise ValueError(f"Unknown inference op '{op}'.")
+
+    def _analyze(self, message, segments):
+        name = message["shm"]
+        if name not in segments:
+            # The client replaced its buffer with a bigger one; the old one is gone
+            for old in segments.values():
+                _close(old)
+            segments.clear()
+            segments[name] = _attach(name)
+        buf = segments[name].buf
+        pending = [_Pending(np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset))
+                   for offset, shape, dtype in message["frames"]]
+        for item in pending:
+            self._queue.put(item)
+        for item in pending:
+            item.done.wait()
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["frames"] += len(pending)
+        analyses = []
+        for item in pending:
+            if item.error is not None:
+                raise item.error
+            analyses.append(item.result)
+        return analyses
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                analyses = analysis_utils.analyze_images([item.img for item in batch], pool=self._pool)
+            except Exception as e:
+                for item in batch:
+                    item.error = e
+            else:
+                for item, analysis in zip(batch, analyses):
+                    item.result = analysis
+            with self._stats_lock:
+                self.stats["batches"] += 1
+                self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+            for item in batch:
+                item.img = None # Drop the view into the client's buffer before waking it
+                item.done.set()
+
+    def status(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["mean_batch"] = stats["frames"] / stats["batches"] if stats["batches"] else 0.0
+        return dict(analysis_utils.model_status(), model_version=analysis_utils.MODEL_VERSION,
+                    scoring_version=analysis_utils.SCORING_VERSION, pid=os.getpid(),
+                    uptime_s=round(time.time() - self.started_at), **stats)
+
+
+# --- Client ---
+class _FrameBuffer:
+    """One client thread's shared memory segment, grown on demand."""
+
+    def __init__(self):
+        self.shm = None
+
+    def write(self, imgs):
+        layout, size = [], 0
+        for img in imgs:
+            img = np.ascontiguousarray(img)
+            layout.append((size, img.shape, img.dtype.str))
+            size += -(-img.nbytes // ALIGNMENT) * ALIGNMENT
+        if self.shm is None or self.shm.size < size:
+            self.release()
+            capacity = max(MIN_BUFFER_BYTES, 1 << (size - 1).bit_length())
+            self.shm = shared_memory.SharedMemory(create=True, size=capacity)
+        for img, (offset, shape, dtype) in zip(imgs, layout):
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)[...] = img
+        return self.shm.name, layout
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __del__(self):
+        self.release()
+
+
+class InferenceClient:
+    """
+    Talks to one or more inference servers. Thread-safe: every thread gets its own
+    connection and frame buffer.
+    """
+
+    def __init__(self, addresses, authkey, timeout=120):
+        self.addresses = [a.strip() for a in addresses.split(",") if a.strip()] \
+            if isinstance(addresses, str) else list(addresses)
+        self.authkey = authkey
+        self.timeout = timeout
+        self._local = threading.local()
+        self._next_address = itertools.count()
+        self._status = None
+        self._status_at = 0.0
+        self._status_lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            address = self.addresses[next(self._next_address) % len(self.addresses)]
+            try:
+                conn = connection.Client(address, family="AF_UNIX", authkey=self.authkey)
+            except (OSError, connection.AuthenticationError) as e:
+                raise InferenceServerError(f"Cannot reach inference server at {address}: {e}") from e
+            self._local.conn = conn
+            self._local.buffer = _FrameBuffer()
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _call(self, message, timeout):
+        conn = self._connection()
+        try:
+            conn.send(message)
+            if not conn.poll(timeout):
+                # A late reply would be read as the answer to the next request
+                self._drop_connection()
+                raise InferenceServerError(f"Inference server did not answer within {timeout} s.")
+            reply = conn.recv()
+        except (EOFError, OSError) as e:
+            self._drop_connection()
+            raise InferenceServerError(f"Inference server connection lost: {e}") from e
+        if not reply["ok"]:
+            if reply.get("kind") == "ValueError":
+                raise ValueError(reply["error"])
+            raise InferenceServerError(reply["error"])
+        return reply
+
+    def analyze_images(self, imgs):
+        if not imgs:
+            return []
+        self._connection()
+        name, layout = self._local.buffer.write(imgs)
+        return self._call({"op": "analyze", "shm": name, "frames": layout}, self.timeout)["analyses"]
+
+    def analyze_video(self, path, sample_fps, max_seconds):
+        # The clip is read from disk by the server; a long one takes minutes
+        return self._call({"op": "video", "path": os.path.abspath(path), "sample_fps": sample_fps,
+                           "max_seconds": max_seconds}, None)["summary"]
+
+    def status(self):
+        """The server's model status, cached for STATUS_TTL. Unreachable servers report 'failed'."""
+        with self._status_lock:
+            if self._status is not None and time.monotonic() - self._status_at < STATUS_TTL:
+                return self._status
+            try:
+                status = self._call({"op": "status"}, STATUS_TIMEOUT)["status"]
+            except InferenceServerError as e:
+                status = {"state": "failed", "device": None, "error": str(e)}
+            self._status, self._status_at = status, time.monotonic()
+            return status
@@ -0,0 +1,250 @@
+# app/live_channel.py
+"""
+Socket.IO channel for live investigations.
+
+Every viewer of a live investigation joins the room `investigation:<id>`.
+The operator's page sends frames over the same socket, as binary
+attachments, instead of one HTTP POST per capture. The room is told about:
+
+  capture_saved    {capture_id, image_url, timestamp, count}
+  analysis_result  {capture_id, status, analysis_id, total_faces, panic_score} (or a video job summary)
+  status_changed   {investigation_id, status}
+
+Frames ('capture' events) carry a client-chosen `stream` id and a per-stream
+`seq`. The server commits frames of a stream strictly in seq order, acks each
+one, and answers a re-sent seq with the original ack, so a client can safely
+retry everything still unacked after a reconnect. `join` returns the stream's
+next expected seq for that purpose. A retry that arrives while the first
+attempt is still saving waits for that attempt's ack.
+
+Backpressure works in two places. Clients keep at most a few frames unacked.
+The server rejects anything past SOCKETIO_MAX_INFLIGHT per stream with
+`retry: true`.
+
+With several worker processes, set SOCKETIO_MESSAGE_QUEUE (e.g. a Redis URL)
+so room pushes reach viewers connected to any worker, and route clients with
+sticky sessions: a stream's ack and ordering state stays in the worker that
+received its frames.
+
+flask_socketio is optional. Without it the channel is disabled, the notify_*
+helpers are no-ops, and the live page falls back to HTTP uploads.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app, request
+from flask_login import current_user
+
+from .models import db, Investigation, Capture, AnalysisResult
+from . import capture_storage, metrics, near_duplicates, report_stats, thumbnails, uploads
+
+try:
+    from flask_socketio import SocketIO, join_room, leave_room
+except ImportError:
+    SocketIO = None
+
+import pytz
+IST = pytz.timezone("Asia/Kolkata")
+
+socketio = None # Set by init_app when flask_socketio is installed
+ORDER_WAIT_S = 5.0 # How long a frame waits for its predecessor before going ahead anyway
+RECENT_ACKS = 64 # Acks remembered per stream for retried frames
+RETRY_WAIT_S = 30.0 # How long a retried frame waits for the first attempt, still saving, to be acked
+STREAM_IDLE_S = 3600
+
+
+def room(investigation_id):
+    return f"investigation:{investigation_id}"
+
+
+# --- Per-stream ordering state ---
+class _Stream:
+    def __init__(self):
+        self.next_seq = 1
+        self.inflight = 0
+        self.acks = OrderedDict()
+        self.pending = set() # Seqs taken but not acked yet
+        self.cond = threading.Condition()
+        self.last_used = time.monotonic()
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def _get_stream(user_id, investigation_id, stream_id):
+    key = (user_id, investigation_id, str(stream_id)[:64])
+    now = time.monotonic()
+    with _streams_lock:
+        for stale in [k for k, s in _streams.items() if now - s.last_used > STREAM_IDLE_S]:
+            del _streams[stale]
+        stream = _streams.get(key)
+        if stream is None:
+            stream = _streams[key] = _Stream()
+        stream.last_used = now
+        return stream
+
+
+def _owned_investigation(investigation_id):
+    if not current_user.is_authenticated:
+        return None
+    inv = db.session.get(Investigation, investigation_id) if isinstance(investigation_id, int) else None
+    return inv if inv is not None and inv.user_id == current_user.id else None
+
+
+# --- Event Handlers ---
+def _on_connect(auth=None):
+    if not current_user.is_authenticated:
+        return False # Refuses the connection
+
+
+def _on_join(data):
+    inv = _owned_investigation((data or {}).get('investigation_id'))
+    if inv is None:
+        return {'ok': False, 'error': 'Investigation not found.'}
+    join_room(room(inv.id))
+    stream = _get_stream(current_user.id, inv.id, data.get('stream', ''))
+    return {
+        'ok': True,
+        'status': inv.status,
+        'count': Capture.query.filter_by(investigation_id=inv.id).count(),
+        'next_seq': stream.next_seq,
+    }
+
+
+def _on_leave(data):
+    investigation_id = (data or {}).get('investigation_id')
+    if isinstance(investigation_id, int):
+        leave_room(room(investigation_id))
+
+
+def _on_capture(meta, frame):
+    """One binary frame. Returns the ack the client's callback receives."""
+    meta = meta or {}
+    inv = _owned_investigation(meta.get('investigation_id'))
+    if inv is None:
+        return {'ok': False, 'error': 'Investigation not found.'}
+    seq = meta.get('seq')
+    if not isinstance(seq, int) or seq < 1:
+        return {'ok': False, 'error': 'Missing seq.'}
+    stream = _get_stream(current_user.id, inv.id, meta.get('stream', ''))
+
+    with stream.cond:
+        # Retried while the first attempt is still waiting or saving: answer with its ack
+        deadline = time.monotonic() + RETRY_WAIT_S
+        while seq in stream.pending and time.monotonic() < deadline:
+            stream.cond.wait(deadline - time.monotonic())
+        if seq in stream.pending:
+            return {'ok': False, 'seq': seq, 'error': 'Frame is still being saved.', 'retry': True}
+        if seq in stream.acks: # Retried after a lost ack
+            return dict(stream.acks[seq], duplicate=True)
+        if stream.inflight >= current_app.config['SOCKETIO_MAX_INFLIGHT']:
+            return {'ok': False, 'seq': seq, 'error': 'Too many frames in flight.', 'retry': True}
+        stream.inflight += 1
+        stream.pending.add(seq)
+        # Handlers run on separate threads; commit frames in the order they were taken
+        deadline = time.monotonic() + ORDER_WAIT_S
+        while seq > stream.next_seq and time.monotonic() < deadline:
+            stream.cond.wait(deadline - time.monotonic())
+
+    try:
+        ack = _save_frame(inv, seq, frame, meta.get('ts'))
+    except Exception as e:
+        db.session.rollback()
+        print(f"[WARN] Could not save live capture frame: {e}")
+        ack = {'ok': False, 'seq': seq, 'error': 'Could not save the capture.', 'retry': True}
+    with stream.cond:
+        stream.inflight -= 1
+        stream.pending.discard(seq)
+        if not ack.get('retry'): # Final answers are replayed to retries; retryable ones are not
+            stream.acks[seq] = ack
+            while len(stream.acks) > RECENT_ACKS:
+                stream.acks.popitem(last=False)
+        stream.next_seq = max(stream.next_seq, seq + 1)
+        stream.cond.notify_all()
+    return ack
+
+
+def _save_frame(inv, seq, frame, ts_ms):
+    if not isinstance(frame, (bytes, bytearray)) or not frame.startswith(uploads.JPEG_MAGIC):
+        return {'ok': False, 'seq': seq, 'error': 'Upload is not a JPEG image.'}
+    if len(frame) > current_app.config['CAPTURE_MAX_BYTES']:
+        return {'ok': False, 'seq': seq, 'error': 'Upload is too large.'}
+    frame = bytes(frame)
+    filename, _, size = capture_storage.store_bytes(frame)
+    capture = Capture(image_filename=filename, investigation_id=inv.id, dhash=near_duplicates.dhash_bytes(frame))
+    if isinstance(ts_ms, (int, float)) and abs(ts_ms / 1000 - time.time()) < 3600:
+        capture.timestamp = datetime.fromtimestamp(ts_ms / 1000, IST)
+    db.session.add(capture)
+    db.session.commit()
+    report_stats.invalidate(inv.user_id)
+    thumbnails.enqueue(capture.id, filename)
+    metrics.CAPTURE_UPLOAD_BYTES.observe(size)
+    metrics.CAPTURE_FILES_WRITTEN.inc()
+    payload = notify_capture(inv.id, capture, skip_sid=request.sid)
+    return dict(payload, ok=True, seq=seq)
+
+
+# --- Room Notifications (no-ops without flask_socketio) ---
+def notify_capture(investigation_id, capture, skip_sid=None):
+    """Tells the room about a saved capture. Returns the pushed payload, or None when the channel is off."""
+    if socketio is None:
+        return None
+    payload = {
+        'capture_id': capture.id,
+        'image_url': capture_storage.url_for_capture(capture.image_filename),
+        'timestamp': capture.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'count': Capture.query.filter_by(investigation_id=investigation_id).count(),
+    }
+    socketio.emit('capture_saved', payload, to=room(investigation_id), skip_sid=skip_sid)
+    return payload
+
+
+def notify_status(investigation_id, status):
+    if socketio is not None:
+        socketio.emit('status_changed', {'investigation_id': investigation_id, 'status': status},
+                      to=room(investigation_id))
+
+
+def _on_job_finished(job):
+    """analysis_jobs listener: pushes a summary of every finished job to its investigation's room."""
+    if job.kind == 'video':
+        investigation_id = job.payload.get('investigation_id')
+        payload = {'kind': 'video', 'job_id': job.id, 'status': job.status, 'error': job.error}
+        if job.status == 'done':
+            payload.update(peak_panic=job.result.get('peak_panic'), mean_panic=job.result.get('mean_panic'))
+    else:
+        capture = db.session.get(Capture, job.capture_id)
+        if capture is None:
+            return
+        investigation_id = capture.investigation_id
+        payload = {'kind': 'capture', 'job_id': job.id, 'capture_id': job.capture_id,
+                   'status': job.status, 'error': job.error}
+        result = db.session.get(AnalysisResult, job.result['analysis_id']) if job.status == 'done' else None
+        if result is not None:
+            payload.update(analysis_id=result.id, total_faces=result.total_faces, panic_score=result.panic_score)
+    socketio.emit('analysis_result', payload, to=room(investigation_id))
+
+
+def init_app(app):
+    global socketio
+    if SocketIO is None:
+        print("[WARN] flask_socketio not installed. The live channel is disabled.")
+        return
+    from . import analysis_jobs
+
+    socketio = SocketIO(
+        app,
+        async_mode=app.config['SOCKETIO_ASYNC_MODE'],
+        message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'] or None, # Shared by every worker's rooms
+        # One frame per message, plus room for the Socket.IO framing
+        max_http_buffer_size=app.config['CAPTURE_MAX_BYTES'] + 64 * 1024,
+    )
+    socketio.on_event('connect', _on_connect)
+    socketio.on_event('join', _on_join)
+    socketio.on_event('leave', _on_leave)
+    socketio.on_event('capture', _on_capture)
+    if _on_job_finished not in analysis_jobs.JOB_LISTENERS:
+        analysis_jobs.JOB_LISTENERS.append(_on_job_finished)
@@ -0,0 +1,191 @@
+# app/metrics.py
+"""
+Prometheus metrics, served at /metrics in the text exposition format.
+
+prometheus_client is optional. Without it, every metric below is a no-op
+object and /metrics is not registered, so call sites never need to check.
+METRICS_ENABLED=0 turns off the request, SQL and stage hooks and the endpoint.
+
+Several worker processes (gunicorn): set PROMETHEUS_MULTIPROC_DIR to an
+empty, writable directory before starting the server. Each process then
+writes its samples there, and /metrics aggregates them. Call
+`prometheus_client.multiprocess.mark_process_dead(worker.pid)` from
+gunicorn's child_exit hook so live gauges drop the dead worker.
+"""
+import os
+import time
+
+from flask import g, has_request_context, request, Response, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:
+    prometheus_client = None
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+class _NoopMetric:
+    """Stands in for every metric type when prometheus_client is unavailable."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def time(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _histogram(*args, **kwargs):
+    return Histogram(*args, **kwargs) if prometheus_client else _NoopMetric()
+
+def _counter(*args, **kwargs):
+    return Counter(*args, **kwargs) if prometheus_client else _NoopMetric()
+
+def _gauge(*args, **kwargs):
+    return Gauge(*args, **kwargs) if prometheus_client else _NoopMetric()
+
+
+# --- Metric Definitions ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = _histogram(
+    "http_request_duration_seconds", "Request latency per endpoint.",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS)
+DB_QUERIES_PER_REQUEST = _histogram(
+    "db_queries_per_request", "SQL statements executed while serving a request.",
+    ["endpoint"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+DB_TIME_PER_REQUEST = _histogram(
+    "db_time_per_request_seconds", "Time spent in SQL statements while serving a request.",
+    ["endpoint"], buckets=LATENCY_BUCKETS)
+DB_QUERY_DURATION = _histogram(
+    "db_query_duration_seconds", "Duration of individual SQL statements.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+
+ANALYSIS_STAGE_SECONDS = _histogram(
+    "analysis_stage_seconds", "Time per analysis pipeline stage (see analysis_utils.STAGES).",
+    ["stage"], buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+ANALYSIS_QUEUE_DEPTH = _gauge(
+    "analysis_queue_depth", "Analysis jobs waiting for a worker.", multiprocess_mode="livesum")
+ANALYSIS_JOBS_RUNNING = _gauge(
+    "analysis_jobs_running", "Analysis jobs being processed.", multiprocess_mode="livesum")
+ANALYSIS_JOBS = _counter(
+    "analysis_jobs_total", "Finished analysis jobs.", ["kind", "status"])
+ANALYSIS_SLOT_WAIT = _histogram(
+    "analysis_slot_wait_seconds", "Time analyses waited for a governor slot (see analysis_utils.AnalysisGovernor).",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+ANALYSIS_SLOTS_ACTIVE = _gauge(
+    "analysis_slots_active", "Analyses holding a governor slot.", multiprocess_mode="livesum")
+ANALYSIS_SLOT_WAITING = _gauge(
+    "analysis_slot_waiting", "Analyses waiting for a governor slot.", multiprocess_mode="livesum")
+ANALYSIS_SLOT_TIMEOUTS = _counter(
+    "analysis_slot_timeouts_total", "Analyses rejected after waiting too long for a slot.")
+FACES_PER_CAPTURE = _histogram(
+    "faces_per_capture", "Faces detected per analyzed capture.",
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+
+CAPTURE_UPLOAD_BYTES = _histogram(
+    "capture_upload_bytes", "Size of uploaded capture images.",
+    buckets=(16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6))
+CAPTURE_FILES_WRITTEN = _counter(
+    "capture_files_written_total", "Capture image files written to disk.")
+STREAMS_ACTIVE = _gauge(
+    "stream_ingests_active", "Drone streams being ingested (see stream_ingest.py).", multiprocess_mode="livesum")
+STREAM_CAPTURES = _counter(
+    "stream_captures_total", "Captures saved by stream ingest, by what triggered them.", ["reason"])
+
+VOICE_LATENCY = _histogram(
+    "voice_backend_duration_seconds", "Latency of the voice assistant's external services.",
+    ["service"], buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30))
+
+
+# --- SQLAlchemy Instrumentation ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_QUERY_DURATION.observe(elapsed)
+    if has_request_context() and "metrics_start" in g:
+        g.metrics_db_queries += 1
+        g.metrics_db_time += elapsed
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+# --- Request Instrumentation ---
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_db_queries = 0
+    g.metrics_db_time = 0.0
+
+def _after_request(response):
+    start = g.pop("metrics_start", None)
+    if start is None or request.endpoint == "metrics":
+        return response
+    endpoint = request.endpoint or "unmatched"
+    # Streamed responses (analyze_all) are timed up to the first byte
+    REQUEST_LATENCY.labels(endpoint, request.method, str(response.status_code)).observe(time.perf_counter() - start)
+    DB_QUERIES_PER_REQUEST.labels(endpoint).observe(g.metrics_db_queries)
+    DB_TIME_PER_REQUEST.labels(endpoint).observe(g.metrics_db_time)
+    return response
+
+def _observe_stage(stage, seconds):
+    ANALYSIS_STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def metrics_view():
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        abort(401)
+    if MULTIPROCESS:
+        from prometheus_client import CollectorRegistry, multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registry), content_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    if prometheus_client is None:
+        print("[WARN] prometheus_client not installed. /metrics is disabled.")
+        return
+    from . import analysis_utils
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+    if _observe_stage not in analysis_utils.STAGE_OBSERVERS:
+        analysis_utils.STAGE_OBSERVERS.append(_observe_stage)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
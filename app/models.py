@@ -55,6 +55,12 @@ class Investigation(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     captures = db.relationship('Capture', backref='investigation', lazy=True, cascade='all, delete-orphan')
 
+    # Matched to the hot queries; `flask indexes check` verifies them with EXPLAIN QUERY PLAN
+    __table_args__ = (
+        db.Index('ix_investigation_user_timestamp', 'user_id', 'timestamp'), # home, investigations, reports lists
+        db.Index('ix_investigation_user_status', 'user_id', 'status', 'timestamp'), # status counts, report_stats (covering)
+    )
+
 class Report(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
@@ -66,6 +72,10 @@ class Report(db.Model):
     )
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_report_user_id', 'user_id'),
+    )
+
 class ThreadFeedItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
@@ -75,21 +85,100 @@ class ThreadFeedItem(db.Model):
         nullable=False, 
         default=lambda: datetime.now(IST)
     )
+
+    __table_args__ = (
+        db.Index('ix_thread_feed_item_timestamp', 'timestamp'),
+    )
     
     
 # ADD THIS NEW MODEL AT THE END OF THE FILE
 class Capture(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    image_filename = db.Column(db.String(50), nullable=False)
+    image_filename = db.Column(db.String(100), nullable=False) # Path under static/captures, see capture_storage.py
     timestamp = db.Column(
         db.DateTime(timezone=True), 
         nullable=False, 
         default=lambda: datetime.now(IST)
     )
     investigation_id = db.Column(db.Integer, db.ForeignKey('investigation.id'), nullable=False)
+    dhash = db.Column(db.String(16)) # 64-bit perceptual hash (hex), see near_duplicates.py
+    thumbnails_ready = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    __table_args__ = (
+        # live_investigation's recent captures, get_captures' (timestamp, id) pages, near-duplicate windows
+        db.Index('ix_capture_investigation_timestamp', 'investigation_id', 'timestamp'),
+    )
 
     def __repr__(self):
         return f"Capture('{self.image_filename}', Investigation ID: {self.investigation_id})"
-    
-    
-    
\ No newline at end of file
+
+
+class CaptureBlob(db.Model):
+    """One stored capture file, shared by every capture with identical bytes."""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(
+        db.DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(IST)
+    )
+
+    def __repr__(self):
+        return f"CaptureBlob('{self.sha256}', refs={self.ref_count})"
+
+
+class AnalysisResult(db.Model):
+    """Stored output of one capture analysis, reusable while the versions match."""
+    id = db.Column(db.Integer, primary_key=True)
+    capture_id = db.Column(db.Integer, db.ForeignKey('capture.id'), nullable=False, unique=True)
+    content_hash = db.Column(db.String(64), nullable=False) # sha256 of the image bytes
+    model_version = db.Column(db.String(120), nullable=False)
+    scoring_version = db.Column(db.String(20), nullable=False)
+    total_faces = db.Column(db.Integer, nullable=False, default=0)
+    male_count = db.Column(db.Integer, nullable=False, default=0)
+    female_count = db.Column(db.Integer, nullable=False, default=0)
+    panic_score = db.Column(db.Float, nullable=False, default=0.0)
+    emotion_summary = db.Column(db.JSON)
+    # Set when the result was copied from a near-duplicate capture instead of inferred
+    reused_from_id = db.Column(db.Integer, db.ForeignKey('capture.id', ondelete='SET NULL'))
+    timestamp = db.Column(
+        db.DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(IST)
+    )
+    faces = db.relationship('AnalysisFace', backref='analysis', lazy=True,
+                            cascade='all, delete-orphan', order_by='AnalysisFace.face_index')
+    capture = db.relationship('Capture', foreign_keys=[capture_id],
+                              backref=db.backref('analysis', uselist=False, cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        db.Index('ix_analysis_result_lookup', 'content_hash', 'model_version', 'scoring_version'),
+    )
+
+    def __repr__(self):
+        return f"AnalysisResult(Capture ID: {self.capture_id}, Faces: {self.total_faces})"
+
+
+class AnalysisFace(db.Model):
+    """One detected face of an AnalysisResult. The bbox is the crop reference."""
+    id = db.Column(db.Integer, primary_key=True)
+    analysis_id = db.Column(db.Integer, db.ForeignKey('analysis_result.id'), nullable=False, index=True)
+    face_index = db.Column(db.Integer, nullable=False) # Index in the detector output
+    x1 = db.Column(db.Integer, nullable=False)
+    y1 = db.Column(db.Integer, nullable=False)
+    x2 = db.Column(db.Integer, nullable=False)
+    y2 = db.Column(db.Integer, nullable=False)
+    gender = db.Column(db.String(10), nullable=False)
+    age = db.Column(db.Integer, nullable=False)
+    emotion_label = db.Column(db.String(20), nullable=False)
+    det_score = db.Column(db.Float, nullable=False)
+    fear_score = db.Column(db.Float, nullable=False)
+    vulnerability = db.Column(db.Float, nullable=False)
+    gender_score = db.Column(db.Float, nullable=False)
+    raw_score = db.Column(db.Float, nullable=False)
+    panic_score = db.Column(db.Float, nullable=False)
+
+    @property
+    def bbox(self):
+        return (self.x1, self.y1, self.x2, self.y2)
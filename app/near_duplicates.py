@@ -0,0 +1,106 @@
+# app/near_duplicates.py
+"""
+Perceptual hashing of captures, to catch repeated shots of an almost static scene.
+
+Each capture gets a 64-bit difference hash (dHash) at ingest, stored as 16 hex
+characters in Capture.dhash. Two captures whose hashes differ in at most
+NEAR_DUPLICATE_MAX_DISTANCE bits, and that were taken within
+NEAR_DUPLICATE_WINDOW_S of each other in the same investigation, are treated
+as the same scene. The later one reuses the earlier one's analysis instead of
+running inference again (see analysis_store.get_cached).
+"""
+from datetime import timedelta
+
+import cv2
+import numpy as np
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from .models import db, Capture, AnalysisResult
+from . import analysis_utils
+
+HASH_SIZE = 8
+
+
+def dhash_image(gray):
+    """dHash of a greyscale image: 64 bits from horizontal gradients on a 9x8 thumbnail."""
+    small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+
+def dhash_bytes(data):
+    """dHash of encoded image bytes, or None when they do not decode."""
+    # Decoding at 1/4 scale is several times cheaper and plenty for a 9x8 thumbnail
+    gray = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    return dhash_image(gray) if gray is not None else None
+
+def dhash_file(path):
+    gray = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    return dhash_image(gray) if gray is not None else None
+
+
+def to_uint64(hashes):
+    return np.array([int(h, 16) for h in hashes], dtype=np.uint64)
+
+def hamming(query, hashes):
+    """Bit distance between one uint64 hash and an array of them."""
+    return np.bitwise_count(hashes ^ np.uint64(query))
+
+
+def find_reusable(capture):
+    """
+    The closest earlier capture of the same investigation that looks like the same
+    scene and already has a current analysis. Returns (capture, distance) or None.
+    """
+    config = current_app.config
+    if not config['NEAR_DUPLICATE_REUSE'] or not capture.dhash:
+        return None
+    window = timedelta(seconds=config['NEAR_DUPLICATE_WINDOW_S'])
+    candidates = db.session.query(Capture.id, Capture.dhash) \
+        .join(AnalysisResult, AnalysisResult.capture_id == Capture.id) \
+        .filter(
+            Capture.investigation_id == capture.investigation_id,
+            Capture.dhash.isnot(None),
+            Capture.timestamp >= capture.timestamp - window,
+            # Strictly earlier, ties broken by id, so two frames never reuse each other
+            or_(Capture.timestamp < capture.timestamp,
+                and_(Capture.timestamp == capture.timestamp, Capture.id < capture.id)),
+            AnalysisResult.model_version == analysis_utils.MODEL_VERSION,
+            AnalysisResult.scoring_version == analysis_utils.SCORING_VERSION,
+            AnalysisResult.reused_from_id.is_(None), # Always copy from a real analysis
+        ).all()
+    if not candidates:
+        return None
+    distances = hamming(int(capture.dhash, 16), to_uint64([h for _, h in candidates]))
+    best = int(np.argmin(distances))
+    if distances[best] > config['NEAR_DUPLICATE_MAX_DISTANCE']:
+        return None
+    return db.session.get(Capture, candidates[best][0]), int(distances[best])
+
+
+def duplicate_clusters(captures, max_distance):
+    """
+    Groups captures (with dhash set) whose hashes are within max_distance bits,
+    transitively. Returns lists of captures, largest first, singletons left out.
+    """
+    if len(captures) < 2:
+        return []
+    hashes = to_uint64([c.dhash for c in captures])
+    parent = list(range(len(captures)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(captures) - 1):
+        # One vectorised comparison against every later capture
+        close = np.flatnonzero(hamming(hashes[i], hashes[i + 1:]) <= max_distance) + i + 1
+        for j in close:
+            parent[find(int(j))] = find(i)
+
+    groups = {}
+    for i, c in enumerate(captures):
+        groups.setdefault(find(i), []).append(c)
+    return sorted((g for g in groups.values() if len(g) > 1), key=len, reverse=True)
@@ -0,0 +1,120 @@
+# app/panic_scoring.py
+"""
+Columnar panic scoring.
+
+FaceBatch holds the scoring inputs of many faces as NumPy columns. `offsets`
+splits the rows into captures (frames), so one call scores every face and
+every capture of a batch. The results are bit-for-bit identical to
+analysis_utils.compute_panic_score / compute_group_panic, which remain the
+per-face reference. `benchmarks/bench_panic_scoring.py` checks this and
+measures the speed-up.
+"""
+import numpy as np
+
+# Individual score weights
+W_AGE, W_FACE, W_GENDER = 0.4, 0.4, 0.2
+# Group score weights
+W_E, W_V, W_GP = 0.45, 0.35, 0.20
+ALPHA, BETA = 0.6, 0.4
+MALE_SCORE, FEMALE_SCORE = 0.8, 1.0
+
+
+def vulnerability_from_ages(ages):
+    """Vectorised get_vulnerability_from_age. NaN stands for an unknown age."""
+    ages = np.asarray(ages, dtype=np.float64)
+    return np.select(
+        [np.isnan(ages), ages <= 11, ages <= 17, ages <= 64],
+        [0.2, 1.0, 0.6, 0.2],
+        default=0.9,
+    )
+
+
+def _segment_means(values, starts, sizes):
+    """
+    Mean of each segment, equal to values[start:start + size].mean() bit for bit.
+    Segments of the same length are stacked into one 2-D array and reduced along
+    its contiguous last axis. That axis is summed with the same pairwise
+    summation as a 1-D mean. np.add.reduceat sums sequentially, so it can differ
+    in the last bits.
+    """
+    means = np.zeros(len(sizes), dtype=np.float64)
+    for size in np.unique(sizes[sizes > 0]):
+        idx = np.flatnonzero(sizes == size)
+        rows = starts[idx][:, None] + np.arange(size)
+        means[idx] = values[rows].mean(axis=1)
+    return means
+
+
+class FaceBatch:
+    """
+    Scoring inputs for N faces across one or more captures.
+
+    det_score, age, fear: float arrays of length N
+    is_male:              bool array of length N
+    offsets:              capture boundaries, e.g. [0, 3, 3, 7] means three
+                          captures with 3, 0 and 4 faces. Defaults to a single capture.
+    """
+
+    def __init__(self, det_score, age, is_male, fear, offsets=None):
+        self.det_score = np.asarray(det_score, dtype=np.float64)
+        self.age = np.asarray(age, dtype=np.float64)
+        self.is_male = np.asarray(is_male, dtype=bool)
+        self.fear = np.asarray(fear, dtype=np.float64)
+        n = len(self.det_score)
+        self.offsets = np.asarray(offsets if offsets is not None else [0, n], dtype=np.int64)
+        if self.offsets[0] != 0 or self.offsets[-1] != n or np.any(np.diff(self.offsets) < 0):
+            raise ValueError("offsets must rise from 0 to the number of faces.")
+        self.vulnerability = vulnerability_from_ages(self.age)
+        self.gender_score = np.where(self.is_male, MALE_SCORE, FEMALE_SCORE)
+
+    def __len__(self):
+        return len(self.det_score)
+
+    @property
+    def n_captures(self):
+        return len(self.offsets) - 1
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    @classmethod
+    def concat(cls, batches):
+        """One batch from several, keeping each batch's captures separate."""
+        batches = list(batches)
+        offsets = [0]
+        for batch in batches:
+            offsets.extend(offsets[-1] + batch.offsets[1:])
+        column = lambda name: np.concatenate([getattr(b, name) for b in batches]) if batches else []
+        return cls(column('det_score'), column('age'), column('is_male'), column('fear'), offsets)
+
+    def individual_scores(self):
+        """(raw_score, panic_score) arrays, one entry per face."""
+        raw = W_AGE*self.vulnerability + W_FACE*self.fear + W_GENDER*self.gender_score
+        return raw, raw*self.det_score*100
+
+    def group_scores(self, raw=None):
+        """Group PanicScore per capture (0.0 for captures without faces)."""
+        if raw is None:
+            raw, _ = self.individual_scores()
+        starts, sizes = self.offsets[:-1], self.sizes
+        mean_fear = _segment_means(self.fear, starts, sizes)
+        mean_vuln = _segment_means(self.vulnerability, starts, sizes)
+        mean_gender = _segment_means(self.gender_score, starts, sizes)
+        mean_conf = _segment_means(self.det_score, starts, sizes)
+
+        has_faces = sizes > 0
+        max_raw = np.zeros(len(sizes), dtype=np.float64)
+        if has_faces.any():
+            max_raw[has_faces] = np.maximum.reduceat(raw, starts[has_faces])
+
+        g_raw = W_E*mean_fear + W_V*mean_vuln + W_GP*mean_gender
+        gsf = np.clip(1 + (3 - sizes)/6, 0.7, 1.5)
+        g_score_raw = g_raw*mean_conf*gsf
+        panic = 100*np.clip(ALPHA*g_score_raw + BETA*max_raw, 0, 1)
+        return np.where(has_faces, panic, 0.0)
+
+    def score(self):
+        """(raw_score, panic_score, group_panic) in one pass."""
+        raw, panic = self.individual_scores()
+        return raw, panic, self.group_scores(raw)
@@ -0,0 +1,88 @@
+# app/report_stats.py
+"""
+Numbers behind the reports dashboard, computed in one pass and cached per user.
+
+compute() answers the status cards and the 7-day chart with a single
+conditional-aggregation query over the user's investigations. The days are
+bucketed in SQL on the stored IST timestamps, against today's date in IST.
+One grouped query adds the capture count per investigation.
+
+get() keeps the result for REPORT_STATS_TTL seconds. Routes that change a
+user's investigations or captures call invalidate(), so the dashboard is exact
+within one process. Other worker processes catch up once their copy expires.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, case, func
+
+from .models import db, Investigation, Capture
+
+import pytz
+IST = pytz.timezone("Asia/Kolkata")
+
+CHART_DAYS = 7
+
+_cache = {} # user_id -> (expires_at, stats)
+_generations = {} # user_id -> invalidation count, so a compute racing a write is not stored
+_lock = threading.Lock()
+
+
+def compute(user_id):
+    today = datetime.now(IST).date()
+    days = [today - timedelta(days=CHART_DAYS - 1 - i) for i in range(CHART_DAYS)]
+    day = func.date(Investigation.timestamp, type_=db.Date)
+    completed = Investigation.status == 'Completed'
+
+    def count_where(condition):
+        return func.count(case((condition, 1)))
+
+    columns = [
+        func.count(Investigation.id),
+        count_where(Investigation.status == 'Live'),
+        count_where(Investigation.status == 'Pending'),
+        count_where(completed),
+    ]
+    for d in days:
+        columns += [count_where(day == d), count_where(and_(day == d, completed))]
+    row = db.session.query(*columns).filter(Investigation.user_id == user_id).one()
+
+    capture_counts = dict(
+        db.session.query(Capture.investigation_id, func.count(Capture.id))
+        .join(Investigation, Investigation.id == Capture.investigation_id)
+        .filter(Investigation.user_id == user_id)
+        .group_by(Capture.investigation_id)
+        .all()
+    )
+    return {
+        'total_count': row[0],
+        'live_count': row[1],
+        'ongoing_count': row[2],
+        'completed_count': row[3],
+        'chart_labels': [d.strftime('%a') for d in days],
+        'chart_total': list(row[4::2]),
+        'chart_completed': list(row[5::2]),
+        'capture_counts': capture_counts,
+    }
+
+
+def get(user_id):
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get(user_id)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        generation = _generations.get(user_id, 0)
+    stats = compute(user_id)
+    with _lock:
+        if _generations.get(user_id, 0) == generation:
+            _cache[user_id] = (now + current_app.config['REPORT_STATS_TTL'], stats)
+    return stats
+
+
+def invalidate(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
+        _generations[user_id] = _generations.get(user_id, 0) + 1
@@ -4,24 +4,24 @@ import secrets
 from PIL import Image
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, abort
 from flask_login import current_user, login_user, logout_user, login_required
-from .models import db, User, Investigation, Report, ThreadFeedItem, Capture
+from .models import db, User, Investigation, Report, ThreadFeedItem, Capture, AnalysisResult, AnalysisFace
 from .forms import SignUpForm, LoginForm, UpdateProfileForm, NewInvestigationForm, EditInvestigationForm
 from collections import defaultdict,  OrderedDict
-from datetime import datetime, date, timedelta
+from datetime import datetime, timedelta
 # THIS IS THE ONLY LINE THAT WAS CHANGED
-from sqlalchemy import func, case 
+from sqlalchemy import func, case, or_, and_
 import json
 import base64
-from flask import jsonify
+import hashlib
+from flask import jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 import re
 import app.analysis_utils as analysis_utils
-import asyncio
-import sounddevice as sd
-import numpy as np
-import scipy.io.wavfile as wav
+from . import analysis_jobs, analysis_store, capture_storage, live_channel, metrics, near_duplicates, report_stats, stream_ingest, thumbnails, uploads, video_analysis
+from . import face_index as embedding_index # Route arguments are called face_index
 import tempfile
-from groq import Groq
-import edge_tts
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pytz
 IST = pytz.timezone("Asia/Kolkata")
 
@@ -35,6 +35,13 @@ def inject_forms():
         edit_investigation_form=EditInvestigationForm()
     )
 
+@main.app_template_global()
+def capture_thumbnail_url(capture, size=160):
+    """Thumbnail URL once generated, the original image until then."""
+    if capture.thumbnails_ready:
+        return capture_storage.thumbnail_urls(capture.image_filename)[str(size)]
+    return capture_storage.url_for_capture(capture.image_filename)
+
 # --- Helper Function for Saving Picture ---
 def save_picture(form_picture):
     random_hex = secrets.token_hex(8)
@@ -49,17 +56,28 @@ def save_picture(form_picture):
     return picture_fn
 
 # --- AI Assistant Configuration (can be placed before your 'main' blueprint) ---
-try:
-    groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-except Exception as e:
-    groq_client = None
-    print(f"Warning: Groq client could not be initialized. AI Assistant will not work. Error: {e}")
+# The Groq SDK is imported on first use so it does not slow down app startup.
+_groq_client = None
+_groq_client_checked = False
+
+def get_groq_client():
+    global _groq_client, _groq_client_checked
+    if not _groq_client_checked:
+        _groq_client_checked = True
+        try:
+            from groq import Groq
+            _groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+        except Exception as e:
+            _groq_client = None
+            print(f"Warning: Groq client could not be initialized. AI Assistant will not work. Error: {e}")
+    return _groq_client
 
 # --- AI Assistant Helper Functions ---
 def transcribe_audio_from_file(path):
+    groq_client = get_groq_client()
     if not groq_client:
         return "AI client not initialized."
-    with open(path, "rb") as f:
+    with open(path, "rb") as f, metrics.VOICE_LATENCY.labels("groq_transcription").time():
         transcription = groq_client.audio.transcriptions.create(
             model="whisper-large-v3",
             file=(os.path.basename(path), f.read())
@@ -67,14 +85,16 @@ def transcribe_audio_from_file(path):
     return transcription.text.strip()
 
 def get_ai_response_from_text(user_text, history):
+    groq_client = get_groq_client()
     if not groq_client:
         return "AI client not initialized."
     messages = history + [{"role": "user", "content": user_text}]
-    completion = groq_client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=messages,
-        temperature=0.3
-    )
+    with metrics.VOICE_LATENCY.labels("groq_chat").time():
+        completion = groq_client.chat.completions.create(
+            model="llama-3.1-8b-instant",
+            messages=messages,
+            temperature=0.3
+        )
     return completion.choices[0].message.content.strip()
 
 async def generate_speech_from_text(text):
@@ -82,6 +102,8 @@ async def generate_speech_from_text(text):
     if not text or not text.strip():
         return "" # Return empty string if there is no text to speak
 
+    import edge_tts
+
     tmp_file = ""
     try:
         tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3").name
@@ -89,7 +111,8 @@ async def generate_speech_from_text(text):
         voice = "hi-IN-MadhurNeural" if lang == "hi-IN" else "en-IN-NeerjaNeural"
         
         communicate = edge_tts.Communicate(text, voice=voice)
-        await communicate.save(tmp_file)
+        with metrics.VOICE_LATENCY.labels("edge_tts").time():
+            await communicate.save(tmp_file)
         
         with open(tmp_file, 'rb') as f:
             audio_data = f.read()
@@ -183,75 +206,23 @@ def investigations():
 @main.route('/reports')
 @login_required
 def reports():
-    # --- Card Counts (No changes) ---
-    total_count = Investigation.query.filter_by(author=current_user).count()
-    live_count = Investigation.query.filter_by(author=current_user, status='Live').count()
-    ongoing_count = Investigation.query.filter_by(author=current_user, status='Pending').count()
-    completed_count = Investigation.query.filter_by(author=current_user, status='Completed').count()
+    # Cards, 7-day chart and capture counts come from one aggregate query, cached per user
+    stats = report_stats.get(current_user.id)
 
-    # ===== START: NEW CHART 1 LOGIC =====
-    
-    # 1. Prepare the date range for the last 7 days
-    today = date.today()
-    seven_days_ago = today - timedelta(days=6)
-    
-    # Create an ordered dictionary to hold data for each of the last 7 days, initialized to zero
-    daily_stats = OrderedDict()
-    for i in range(7):
-        current_day = seven_days_ago + timedelta(days=i)
-        # Use weekday abbreviation ('Mon', 'Tue', etc.) as the key
-        day_key = current_day.strftime('%a') 
-        daily_stats[day_key] = {'total': 0, 'completed': 0}
-
-    # 2. Query the database for investigations in the last 7 days
-    recent_investigations = db.session.query(
-        Investigation.timestamp,
-        Investigation.status
-    ).filter(
-        Investigation.author == current_user,
-        func.date(Investigation.timestamp) >= seven_days_ago
-    ).all()
-
-    # 3. Populate the dictionary with real data from the query
-    for timestamp, status in recent_investigations:
-        day_key = timestamp.strftime('%a')
-        if day_key in daily_stats:
-            daily_stats[day_key]['total'] += 1
-            if status == 'Completed':
-                daily_stats[day_key]['completed'] += 1
-
-    # 4. Extract the labels and data for the chart
-    chart1_labels = list(daily_stats.keys())
-    chart1_total_data = [day['total'] for day in daily_stats.values()]
-    chart1_completed_data = [day['completed'] for day in daily_stats.values()]
-    
-    # ===== END: NEW CHART 1 LOGIC =====
-
-    # ===== START: MODIFIED SLIDER QUERY =====
-    # Query for the investigation cards and include the count of captures for each
-    report_investigations_query = db.session.query(
-        Investigation, 
-        func.count(Capture.id).label('capture_count')
-    ).outerjoin(Capture).filter(
-        Investigation.author == current_user
-    ).group_by(Investigation.id).order_by(Investigation.timestamp.desc()).all()
-    
-    # Process the query results into a more usable format
-    report_investigations = []
-    for inv, count in report_investigations_query:
-        inv.capture_count = count  # Attach the count to the investigation object
-        report_investigations.append(inv)
-    # ===== END: MODIFIED SLIDER QUERY =====
+    report_investigations = Investigation.query.filter_by(user_id=current_user.id)\
+                                               .order_by(Investigation.timestamp.desc()).all()
+    for inv in report_investigations:
+        inv.capture_count = stats['capture_counts'].get(inv.id, 0)  # Attach the count to the investigation object
     
     return render_template('reports.html', 
                            active_page='reports',
-                           total_count=total_count,
-                           live_count=live_count,
-                           ongoing_count=ongoing_count,
-                           completed_count=completed_count,
-                           chart1_labels=json.dumps(chart1_labels),
-                           chart1_total_data=json.dumps(chart1_total_data),
-                           chart1_completed_data=json.dumps(chart1_completed_data),
+                           total_count=stats['total_count'],
+                           live_count=stats['live_count'],
+                           ongoing_count=stats['ongoing_count'],
+                           completed_count=stats['completed_count'],
+                           chart1_labels=json.dumps(stats['chart_labels']),
+                           chart1_total_data=json.dumps(stats['chart_total']),
+                           chart1_completed_data=json.dumps(stats['chart_completed']),
                            report_investigations=report_investigations,
                            datetime=datetime,
                            )
@@ -333,6 +304,7 @@ def new_investigation():
         
         db.session.add(investigation)
         db.session.commit()
+        report_stats.invalidate(current_user.id)
         flash('Investigation Established Successfully! Status is now LIVE.', 'success')
     else:
         for field, errors in form.errors.items():
@@ -348,8 +320,14 @@ def delete_investigation(investigation_id):
     inv = Investigation.query.get_or_404(investigation_id)
     if inv.author != current_user:
         abort(403) # Forbidden
+    stream_ingest.get_registry().stop(investigation_id) # Before its captures go
+    orphans = capture_storage.release([c.image_filename for c in inv.captures])
+    analysis_store.detach_copies(inv.id)
     db.session.delete(inv)
     db.session.commit()
+    report_stats.invalidate(current_user.id)
+    capture_storage.remove_orphans(orphans) # Only once nothing references them
+    embedding_index.delete_index(investigation_id)
     flash('Investigation has been deleted.', 'success')
     return redirect(url_for('main.investigations'))
 
@@ -371,6 +349,8 @@ def update_status(investigation_id):
     if new_status:
         inv.status = new_status
         db.session.commit()
+        report_stats.invalidate(current_user.id)
+        live_channel.notify_status(inv.id, new_status)
         flash(f'Investigation status updated to {new_status}.', 'success')
     
     # If the action was 'Start' or 'Continue', the JS will send 'go_live'.
@@ -421,6 +401,7 @@ def live_investigation(investigation_id):
     if inv.status != 'Live':
         inv.status = 'Live'
         db.session.commit()
+        report_stats.invalidate(current_user.id)
 
     # ADD THIS LOGIC
     # Fetch the 12 most recent captures for this investigation
@@ -434,58 +415,280 @@ def live_investigation(investigation_id):
                            recent_captures=recent_captures)
 
 
+# --- Server-side stream ingest (see stream_ingest.py) ---
+@main.route('/investigation/<int:investigation_id>/stream/start', methods=['POST'])
+@login_required
+def start_stream(investigation_id):
+    inv = Investigation.query.get_or_404(investigation_id)
+    if inv.author != current_user:
+        abort(403)
 
-@main.route('/investigation/<int:investigation_id>/capture', methods=['POST'])
+    data = request.get_json(silent=True) or request.form
+    source = (data.get('source') or '').strip()
+    # Local files are for `flask streams ingest` only; the web can only point at an allowed feed
+    allowed_hosts = [h.strip() for h in current_app.config['STREAM_ALLOWED_HOSTS'].split(',') if h.strip()]
+    try:
+        stream_ingest.check_source(source, allowed_hosts)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        stream = stream_ingest.get_registry().start(inv.id, source)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(stream.status()), 202
+
+
+@main.route('/investigation/<int:investigation_id>/stream/stop', methods=['POST'])
 @login_required
-def save_capture(investigation_id):
+def stop_stream(investigation_id):
     inv = Investigation.query.get_or_404(investigation_id)
     if inv.author != current_user:
         abort(403)
+    stream = stream_ingest.get_registry().stop(inv.id)
+    if stream is None:
+        return jsonify({'error': 'No stream is running for this investigation.'}), 404
+    return jsonify(stream.status())
 
-    data = request.get_json()
-    if not data or 'image_data' not in data:
-        return jsonify({'error': 'Missing image data'}), 400
 
-    try:
-        image_data = re.sub('^data:image/.+;base64,', '', data['image_data'])
-        image_bytes = base64.b64decode(image_data)
-    except (TypeError, base64.binascii.Error):
-        return jsonify({'error': 'Invalid base64 data'}), 400
+@main.route('/investigation/<int:investigation_id>/stream', methods=['GET'])
+@login_required
+def stream_status(investigation_id):
+    inv = Investigation.query.get_or_404(investigation_id)
+    if inv.author != current_user:
+        abort(403)
+    stream = stream_ingest.get_registry().get(inv.id)
+    if stream is None:
+        return jsonify({'running': False})
+    return jsonify(stream.status())
 
-    random_hex = secrets.token_hex(16)
-    filename = f"{random_hex}.jpg"
-    
-    captures_dir = os.path.join(current_app.root_path, 'static/captures')
-    os.makedirs(captures_dir, exist_ok=True)
-    file_path = os.path.join(captures_dir, filename)
 
-    with open(file_path, 'wb') as f:
-        f.write(image_bytes)
+
+@main.route('/investigation/<int:investigation_id>/capture', methods=['POST'])
+@login_required
+def save_capture(investigation_id):
+    inv = Investigation.query.get_or_404(investigation_id)
+    if inv.author != current_user:
+        abort(403)
+
+    # Files are stored by content hash, see capture_storage.py
+    # Binary mode: a raw image/jpeg body or a multipart 'image' file, streamed to disk
+    if request.mimetype in ('image/jpeg', 'multipart/form-data'):
+        max_bytes = current_app.config['CAPTURE_MAX_BYTES']
+        if request.content_length and request.content_length > max_bytes:
+            return jsonify({'error': 'Upload is too large.'}), 413
+        if request.mimetype == 'image/jpeg':
+            stream = request.stream
+        else:
+            upload = request.files.get('image')
+            if upload is None:
+                return jsonify({'error': 'Missing image data'}), 400
+            stream = upload.stream
+        try:
+            filename, _, size = capture_storage.store_stream(stream, max_bytes)
+        except uploads.UploadError as e:
+            return jsonify({'error': str(e)}), e.status
+        dhash = near_duplicates.dhash_file(capture_storage.path_for(filename))
+    else:
+        # JSON mode: base64 data URI (kept for older clients)
+        data = request.get_json()
+        if not data or 'image_data' not in data:
+            return jsonify({'error': 'Missing image data'}), 400
+
+        try:
+            image_data = re.sub('^data:image/.+;base64,', '', data['image_data'])
+            image_bytes = base64.b64decode(image_data)
+        except (TypeError, base64.binascii.Error):
+            return jsonify({'error': 'Invalid base64 data'}), 400
+
+        filename, _, size = capture_storage.store_bytes(image_bytes)
+        dhash = near_duplicates.dhash_bytes(image_bytes)
+    metrics.CAPTURE_UPLOAD_BYTES.observe(size)
+    metrics.CAPTURE_FILES_WRITTEN.inc()
         
-    new_capture = Capture(image_filename=filename, investigation_id=inv.id)
+    new_capture = Capture(image_filename=filename, investigation_id=inv.id, dhash=dhash)
     db.session.add(new_capture)
     db.session.commit()
+    report_stats.invalidate(current_user.id)
+    thumbnails.enqueue(new_capture.id, filename)
+    live_channel.notify_capture(inv.id, new_capture) # Other viewers of the live page
 
-    image_url = url_for('static', filename=f'captures/{filename}')
+    image_url = capture_storage.url_for_capture(filename)
     return jsonify({'success': True, 'image_url': image_url})
 
 
-@main.route('/investigation/<int:investigation_id>/captures', methods=['GET'])
+@main.route('/investigation/<int:investigation_id>/captures/bulk', methods=['POST'])
 @login_required
-def get_captures(investigation_id):
+def save_captures_bulk(investigation_id):
+    """
+    Burst upload: N JPEG frames as multipart 'images' files, optionally with one
+    'timestamps' field per frame (epoch milliseconds). Files are written in parallel
+    and every good frame is inserted in one transaction. A bad frame only fails itself.
+    """
     inv = Investigation.query.get_or_404(investigation_id)
     if inv.author != current_user:
         abort(403)
 
-    captures = Capture.query.filter_by(investigation_id=inv.id).order_by(Capture.timestamp.desc()).all()
+    max_frames = current_app.config['CAPTURE_BULK_MAX_FRAMES']
+    max_bytes = current_app.config['CAPTURE_MAX_BYTES']
+    if request.content_length and request.content_length > max_frames * max_bytes:
+        return jsonify({'error': 'Upload is too large.'}), 413
+    files = request.files.getlist('images')
+    if not files:
+        return jsonify({'error': 'Missing image data'}), 400
+    if len(files) > max_frames:
+        return jsonify({'error': f'At most {max_frames} frames per request.'}), 413
+    timestamps = request.form.getlist('timestamps', type=float)
+    if len(timestamps) != len(files):
+        timestamps = [None] * len(files)
+
+    app = current_app._get_current_object()
+
+    def write_frame(upload):
+        with app.app_context():
+            try:
+                tmp_path, digest, size = capture_storage.stage_stream(upload.stream, max_bytes)
+            except uploads.UploadError as e:
+                return {'error': str(e), 'status': e.status}
+            except OSError as e:
+                print(f"[WARN] Could not write bulk capture frame: {e}")
+                return {'error': 'Could not store the frame.', 'status': 500}
+            return {'tmp_path': tmp_path, 'digest': digest, 'size': size,
+                    'dhash': near_duplicates.dhash_file(tmp_path)}
+
+    with ThreadPoolExecutor(max_workers=current_app.config['CAPTURE_BULK_WORKERS']) as pool:
+        written = list(pool.map(write_frame, files))
+
+    results, stored = [], []
+    for index, (frame, ms) in enumerate(zip(written, timestamps)):
+        if 'error' in frame:
+            results.append({'index': index, 'success': False, 'error': frame['error'], 'status': frame['status']})
+            continue
+        try:
+            filename = capture_storage.store_staged(frame['tmp_path'], frame['digest'], frame['size'])
+        except OSError as e:
+            print(f"[WARN] Could not store bulk capture frame: {e}")
+            results.append({'index': index, 'success': False, 'error': 'Could not store the frame.', 'status': 500})
+            continue
+        capture = Capture(image_filename=filename, investigation_id=inv.id, dhash=frame['dhash'])
+        if ms is not None:
+            capture.timestamp = datetime.fromtimestamp(ms / 1000, IST)
+        db.session.add(capture)
+        stored.append((index, capture, frame))
+    try:
+        db.session.commit() # One commit for the whole burst
+    except Exception as e:
+        db.session.rollback() # Also undoes the blob references
+        print(f"[WARN] Bulk capture insert failed: {e}")
+        # Files placed for blobs nobody else holds are now unreferenced
+        capture_storage.remove_orphans([capture.image_filename for _, capture, _ in stored])
+        return jsonify({'error': 'Could not save the captures.'}), 500
+    report_stats.invalidate(current_user.id)
+
+    for index, capture, frame in stored:
+        thumbnails.enqueue(capture.id, capture.image_filename)
+        metrics.CAPTURE_UPLOAD_BYTES.observe(frame['size'])
+        metrics.CAPTURE_FILES_WRITTEN.inc()
+        live_channel.notify_capture(inv.id, capture)
+        results.append({'index': index, 'success': True, 'capture_id': capture.id,
+                         'image_url': capture_storage.url_for_capture(capture.image_filename)})
+    results.sort(key=lambda r: r['index'])
+    saved = len(stored)
+    return jsonify({'saved': saved, 'failed': len(files) - saved, 'results': results}), (200 if saved else 400)
 
-    captures_data = [{
-        'id': capture.id, # <-- ADDED THIS LINE
-        'url': url_for('static', filename=f'captures/{capture.image_filename}'),
-        'timestamp': capture.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-    } for capture in captures]
 
-    return jsonify(captures_data)
+@main.route('/investigation/<int:investigation_id>/captures', methods=['GET'])
+@login_required
+def get_captures(investigation_id):
+    inv = Investigation.query.get_or_404(investigation_id)
+    if inv.author != current_user:
+        abort(403)
+
+    limit = request.args.get('limit', current_app.config['CAPTURES_PAGE_SIZE'], type=int)
+    if limit is None or limit < 1:
+        return jsonify({'error': 'limit must be a positive integer.'}), 400
+    limit = min(limit, current_app.config['CAPTURES_MAX_PAGE_SIZE'])
+    cursor = request.args.get('cursor')
+    after = None
+    if cursor:
+        try:
+            after = _decode_capture_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor.'}), 400
+
+    # The validator changes whenever a capture is added, deleted or gets its thumbnails
+    total, last_id, thumbs_ready = db.session.query(
+        func.count(Capture.id),
+        func.max(Capture.id),
+        func.sum(case((Capture.thumbnails_ready, 1), else_=0)),
+    ).filter(Capture.investigation_id == inv.id).one()
+    etag = hashlib.sha1(f"{inv.id}:{total}:{last_id}:{thumbs_ready}:{cursor}:{limit}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        # Keyset pagination, newest first: (timestamp, id) strictly below the cursor
+        query = Capture.query.filter(Capture.investigation_id == inv.id)
+        if after is not None:
+            ts, capture_id = after
+            query = query.filter(or_(Capture.timestamp < ts,
+                                     and_(Capture.timestamp == ts, Capture.id < capture_id)))
+        captures = query.order_by(Capture.timestamp.desc(), Capture.id.desc()).limit(limit + 1).all()
+        next_cursor = _encode_capture_cursor(captures[limit - 1]) if len(captures) > limit else None
+
+        captures_data = [{
+            'id': capture.id, # <-- ADDED THIS LINE
+            'url': capture_storage.url_for_capture(capture.image_filename),
+            'thumbnails': capture_storage.thumbnail_urls(capture.image_filename) if capture.thumbnails_ready else None,
+            'timestamp': capture.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        } for capture in captures[:limit]]
+        response = jsonify({'captures': captures_data, 'next_cursor': next_cursor, 'total': total})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' # Always revalidate, usually as a 304
+    return response
+
+
+def _encode_capture_cursor(capture):
+    raw = f"{capture.timestamp.replace(tzinfo=None).isoformat()}|{capture.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def _decode_capture_cursor(cursor):
+    """(timestamp, id) from a cursor. Raises ValueError when it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        ts, capture_id = raw.split('|')
+        return datetime.fromisoformat(ts), int(capture_id)
+    except (ValueError, UnicodeDecodeError, base64.binascii.Error) as e:
+        raise ValueError(str(e))
+
+
+# --- Health & Readiness ---
+def warming_up_response():
+    """503 for analysis routes while the models are not usable yet."""
+    status = analysis_utils.model_status()
+    if status['state'] in ('unavailable', 'failed'):
+        return jsonify({"error": "Analysis models are not available.", "model_state": status['state']}), 503
+    analysis_utils.start_warmup() # Kicks off loading in 'lazy' mode
+    response = jsonify({
+        "status": "warming_up",
+        "error": "Analysis models are warming up. Please try again shortly.",
+        "model_state": status['state'],
+    })
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+@main.route('/healthz')
+def healthz():
+    return jsonify({"status": "ok"})
+
+@main.route('/readyz')
+def readyz():
+    ready = analysis_utils.models_ready()
+    payload = {
+        "status": "ready" if ready else "not_ready",
+        "models": analysis_utils.model_status(),
+        "analysis_queue": analysis_jobs.get_queue().stats(),
+        "analysis_governor": analysis_utils.GOVERNOR.stats(),
+    }
+    return jsonify(payload), (200 if ready else 503)
 
 
 # ================================================
@@ -501,42 +704,202 @@ def analyze_capture(capture_id):
         abort(403) # Ensure user has permission
 
     # Construct the full path to the image file
-    image_path = os.path.join(current_app.root_path, 'static/captures', capture.image_filename)
+    image_path = capture_storage.path_for(capture.image_filename)
 
     if not os.path.exists(image_path):
         return jsonify({"error": "Capture file not found."}), 404
 
-    # Call the analysis function from our utility file
-    analysis_results = analysis_utils.analyze_image_from_path(image_path)
+    # Stored results come back immediately without queueing any inference.
+    # Content-addressed files are named by their digest, so only legacy ones are hashed
+    digest = capture_storage.digest_of(capture.image_filename) or analysis_store.file_digest(image_path)
+    cached = analysis_store.get_cached(capture, digest)
+    if cached is not None:
+        return jsonify({'job_id': None, 'capture_id': capture.id, 'status': 'done',
+                        'result': analysis_store.render(cached)})
 
-    if "error" in analysis_results:
-        return jsonify(analysis_results), 500
+    # New analyses need the models; ask the client to retry while they load
+    if not analysis_utils.models_ready():
+        return warming_up_response()
 
-    # ===== START: NEW CODE TO SAVE ANALYSIS =====
+    # Hand the analysis to the background workers and return straight away
     try:
-        # Check if analysis already exists to avoid duplicates
-        existing_analysis = AnalysisResult.query.filter_by(capture_id=capture.id).first()
-        if not existing_analysis:
-            existing_analysis = AnalysisResult(capture_id=capture.id)
-
-        group_stats = analysis_results.get('group_stats', {})
-        existing_analysis.male_count = group_stats.get('male_count', 0)
-        existing_analysis.female_count = group_stats.get('female_count', 0)
-        existing_analysis.panic_score = group_stats.get('panic_score', 0.0)
-        
-        # Aggregate emotions from individual faces into a dictionary
-        emotions = [face.get('emotion_label', 'unknown') for face in analysis_results.get('faces', [])]
-        emotion_counts = {emotion: emotions.count(emotion) for emotion in set(emotions) if emotion != 'unknown'}
-        existing_analysis.emotion_summary = emotion_counts
+        job, _ = analysis_jobs.get_queue().submit(capture.id, current_user.id)
+    except analysis_jobs.QueueFullError as e:
+        response = jsonify({"error": "Analysis queue is full. Please try again shortly."})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
 
-        db.session.add(existing_analysis)
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        print(f"Error saving analysis result: {e}")
-    # ===== END: NEW CODE TO SAVE ANALYSIS =====
+    payload = job.to_dict()
+    payload['status_url'] = url_for('main.analysis_job_status', job_id=job.id)
+    return jsonify(payload), 202
+
+
+@main.route('/analysis/jobs/<job_id>', methods=['GET'])
+@login_required
+def analysis_job_status(job_id):
+    job = analysis_jobs.get_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job."}), 404
+    if job.user_id != current_user.id:
+        abort(403)
+
+    # Long-poll: ?wait=N blocks for up to N seconds until the job finishes
+    wait = min(request.args.get('wait', 0, type=float), 30.0)
+    if wait > 0 and not job.finished:
+        job.wait(wait)
+
+    return jsonify(job.to_dict())
+
+
+@main.route('/investigation/<int:investigation_id>/analyze_all', methods=['POST'])
+@login_required
+def analyze_investigation(investigation_id):
+    inv = Investigation.query.get_or_404(investigation_id)
+    if inv.author != current_user:
+        abort(403)
+    if not analysis_utils.models_ready():
+        return warming_up_response()
+    if not analysis_jobs.claim_batch(inv.id):
+        return jsonify({"error": "A batch analysis is already running for this investigation."}), 409
+
+    # Progress and per-capture results are streamed as NDJSON, one event per line
+    events = analysis_jobs.analyze_investigation(
+        inv.id,
+        chunk_size=current_app.config['ANALYSIS_BATCH_IMAGES'],
+        workers=current_app.config['ANALYSIS_WORKERS'],
+        user_id=current_user.id,
+    )
+    lines = (json.dumps(event) + '\n' for event in events)
+    response = current_app.response_class(stream_with_context(lines), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let a proxy buffer the stream
+    response.call_on_close(lambda: analysis_jobs.release_batch(investigation_id))
+    return response
+
+
+@main.route('/investigation/<int:investigation_id>/analyze_video', methods=['POST'])
+@login_required
+def analyze_video(investigation_id):
+    inv = Investigation.query.get_or_404(investigation_id)
+    if inv.author != current_user:
+        abort(403)
+
+    # Reject before the multipart body is read: request.files spools all of it to disk
+    max_bytes = current_app.config['VIDEO_MAX_BYTES']
+    if request.content_length and request.content_length > max_bytes:
+        return jsonify({"error": "Video is too large."}), 413
+    if not analysis_utils.models_ready():
+        return warming_up_response()
+    request.max_content_length = max_bytes # Also caps chunked bodies with no Content-Length
+
+    try:
+        video = request.files.get('video')
+    except RequestEntityTooLarge:
+        return jsonify({"error": "Video is too large."}), 413
+    if video is None or not video.filename:
+        return jsonify({"error": "No video uploaded."}), 400
+    _, ext = os.path.splitext(video.filename)
+    if ext.lower() not in video_analysis.VIDEO_EXTENSIONS:
+        return jsonify({"error": f"Unsupported video type '{ext}'."}), 400
+
+    sample_fps = request.form.get('sample_fps', current_app.config['VIDEO_SAMPLE_FPS'], type=float)
+    if not sample_fps or not 0 < sample_fps <= 30:
+        return jsonify({"error": "sample_fps must be between 0 and 30."}), 400
+
+    # The clip lives in the instance folder until its job finishes
+    upload_dir = current_app.config['VIDEO_UPLOAD_DIR']
+    os.makedirs(upload_dir, exist_ok=True)
+    video_path = os.path.join(upload_dir, secrets.token_hex(8) + ext.lower())
+    video.save(video_path)
+
+    try:
+        job = analysis_jobs.get_queue().submit_video(video_path, current_user.id, inv.id, sample_fps)
+    except analysis_jobs.QueueFullError as e:
+        os.remove(video_path)
+        response = jsonify({"error": "Analysis queue is full. Please try again shortly."})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+
+    payload = job.to_dict()
+    payload['status_url'] = url_for('main.analysis_job_status', job_id=job.id)
+    return jsonify(payload), 202
+
+
+@main.route('/capture/<int:capture_id>/faces/<int:face_index>.jpg', methods=['GET'])
+@login_required
+def face_crop(capture_id, face_index):
+    capture = Capture.query.get_or_404(capture_id)
+    if capture.investigation.author != current_user:
+        abort(403)
+    if capture.analysis is None:
+        abort(404)
+    face = AnalysisFace.query.filter_by(analysis_id=capture.analysis.id, face_index=face_index).first_or_404()
+
+    image_path = capture_storage.path_for(capture.image_filename)
+    if not os.path.exists(image_path):
+        abort(404)
+    data = analysis_utils.encode_face_crop(image_path, os.path.getmtime(image_path), face.bbox)
+    if data is None:
+        abort(404)
+
+    response = current_app.response_class(data, mimetype='image/jpeg')
+    version = analysis_store.crop_version(capture.analysis.content_hash, face.bbox)
+    response.set_etag(version)
+    # URLs carry ?v=<crop version>, derived from the image and the box, so a matching one can be cached for good
+    if request.args.get('v') == version:
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+@main.route('/capture/<int:capture_id>/faces/<int:face_index>/similar', methods=['GET'])
+@login_required
+def similar_faces(capture_id, face_index):
+    capture = Capture.query.get_or_404(capture_id)
+    if capture.investigation.author != current_user:
+        abort(403)
+    k = max(1, min(request.args.get('k', 10, type=int), 100))
+    min_score = request.args.get('min_score', 0.0, type=float)
+
+    index = embedding_index.get_index(capture.investigation_id)
+    query = index.lookup(capture.id, face_index)
+    if query is None:
+        return jsonify({"error": "This face has no stored embedding. Analyze the capture first."}), 404
+
+    started = time.perf_counter()
+    hits, mode = index.search(query, k=k, exclude=(capture.id, face_index))
+    search_ms = 1000 * (time.perf_counter() - started)
+    hits = [hit for hit in hits if hit[2] >= min_score]
+
+    # One query for the matched captures and their current faces (crop URL versions)
+    rows = db.session.query(Capture, AnalysisResult.content_hash, AnalysisFace) \
+        .join(AnalysisResult, AnalysisResult.capture_id == Capture.id) \
+        .join(AnalysisFace, AnalysisFace.analysis_id == AnalysisResult.id) \
+        .filter(Capture.id.in_({hit[0] for hit in hits})).all()
+    faces = {(c.id, face.face_index): (c, analysis_store.crop_version(content_hash, face.bbox))
+             for c, content_hash, face in rows}
+
+    matches = []
+    for match_capture_id, match_face_index, score in hits:
+        if (match_capture_id, match_face_index) not in faces:
+            continue # Capture deleted or re-analyzed since it was indexed
+        match_capture, version = faces[(match_capture_id, match_face_index)]
+        matches.append({
+            "capture_id": match_capture_id,
+            "face_index": match_face_index,
+            "similarity": round(score, 4),
+            "crop_url": url_for('main.face_crop', capture_id=match_capture_id, face_index=match_face_index, v=version),
+            "image_url": capture_storage.url_for_capture(match_capture.image_filename),
+            "timestamp": match_capture.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        })
 
-    return jsonify(analysis_results)
+    return jsonify({
+        "capture_id": capture.id,
+        "face_index": face_index,
+        "matches": matches,
+        "search": {"mode": mode, "ms": round(search_ms, 2), "indexed_faces": index.live_count()},
+    })
 # ================================================
 # END: NEW ROUTE FOR CAPTURE ANALYSIS
 # ================================================
@@ -20,51 +20,126 @@ document.addEventListener('DOMContentLoaded', function () {
             updateTime();
         }
 
-        // --- Capture Logic with Fetch API ---
+        // --- Capture Logic ---
+        // Frames go over the live channel's socket (app/live_channel.py) when it is connected,
+        // otherwise as one HTTP POST each
         const captureBtn = document.getElementById('capture-btn');
+        const capturesGrid = document.getElementById('captures-grid');
         const captureCountDisplay = document.getElementById('capture-count-display'); // Get the counter element
 
         // Initialize a variable to hold the count
         let totalCaptures = parseInt(captureCountDisplay.textContent.replace(/\D/g, ''), 10) || 0;
 
+        const addCapture = (imageUrl, count) => {
+            if (capturesGrid) {
+                const maxThumbnails = 12;
+                if (capturesGrid.children.length >= maxThumbnails) {
+                    capturesGrid.removeChild(capturesGrid.lastChild); // Remove the oldest
+                }
+                const img = document.createElement('img');
+                img.src = imageUrl;
+                img.classList.add('capture-thumbnail');
+                capturesGrid.prepend(img); // Add new capture to the start
+            }
+            // The server's count also covers captures taken from other tabs
+            totalCaptures = Number.isInteger(count) ? count : totalCaptures + 1;
+            captureCountDisplay.textContent = `(${totalCaptures})`;
+        };
+
+        // --- Live Channel ---
+        const MAX_IN_FLIGHT = 4; // Unacked frames before new ones wait
+        const ACK_TIMEOUT_MS = 10000;
+        const socket = typeof io === 'function' ? io({ transports: ['websocket'] }) : null;
+        const streamId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+        const outbox = []; // Frames not acked yet, in seq order: { seq, ts, data, sent, attempt }
+        let nextSeq = 1;
+
+        const pump = () => {
+            if (!socket || !socket.connected) return;
+            let inFlight = outbox.filter(frame => frame.sent).length;
+            for (const frame of outbox) {
+                if (inFlight >= MAX_IN_FLIGHT) break;
+                if (frame.sent) continue;
+                frame.sent = true;
+                inFlight++;
+                const attempt = ++frame.attempt;
+                const meta = { investigation_id: Number(investigationId), stream: streamId, seq: frame.seq, ts: frame.ts };
+                socket.timeout(ACK_TIMEOUT_MS).emit('capture', meta, frame.data, (err, ack) => {
+                    if (attempt !== frame.attempt || !outbox.includes(frame)) return; // Superseded by a re-send
+                    if (err || !ack || (!ack.ok && ack.retry)) {
+                        frame.sent = false; // The server answers a re-sent seq with its original ack
+                        setTimeout(pump, 1000);
+                        return;
+                    }
+                    outbox.splice(outbox.indexOf(frame), 1);
+                    if (!ack.ok) {
+                        console.error('Failed to save capture:', ack.error);
+                    } else if (!ack.duplicate) {
+                        addCapture(ack.image_url, ack.count);
+                    }
+                    pump();
+                });
+            }
+        };
+
+        if (socket) {
+            socket.on('connect', () => {
+                socket.emit('join', { investigation_id: Number(investigationId), stream: streamId }, (reply) => {
+                    if (!reply || !reply.ok) return;
+                    totalCaptures = reply.count;
+                    captureCountDisplay.textContent = `(${totalCaptures})`;
+                    // After a reconnect, everything unacked goes out again
+                    outbox.forEach(frame => { frame.sent = false; });
+                    pump();
+                });
+            });
+            socket.on('capture_saved', (data) => addCapture(data.image_url, data.count));
+            socket.on('status_changed', (data) => {
+                const statusTag = livePageContainer.querySelector('.status-tag');
+                if (statusTag) statusTag.textContent = data.status;
+            });
+            socket.on('analysis_result', (data) => console.info('Analysis finished:', data));
+        }
+
+        const uploadOverHttp = (blob) => fetch(`/investigation/${investigationId}/capture`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'image/jpeg' },
+            body: blob
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                addCapture(data.image_url);
+            } else {
+                console.error('Failed to save capture:', data.error);
+            }
+        });
+
         if (captureBtn) {
             captureBtn.addEventListener('click', () => {
                 const canvas = document.getElementById('canvas');
-                const capturesGrid = document.getElementById('captures-grid');
                 if (!canvas || !capturesGrid || !video || video.readyState < 3) return;
 
                 const context = canvas.getContext('2d');
                 canvas.width = video.videoWidth;
                 canvas.height = video.videoHeight;
                 context.drawImage(video, 0, 0, canvas.width, canvas.height);
-                const dataUrl = canvas.toDataURL('image/jpeg');
+                const takenAt = Date.now();
                 
                 captureBtn.disabled = true;
                 captureBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Saving...';
 
-                fetch(`/investigation/${investigationId}/capture`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ image_data: dataUrl })
+                // Encode the frame as JPEG bytes (no base64 data URI)
+                new Promise((resolve, reject) => {
+                    canvas.toBlob(blob => blob ? resolve(blob) : reject(new Error('Could not encode frame')), 'image/jpeg', 0.92);
                 })
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success) {
-                        const maxThumbnails = 12;
-                        if (capturesGrid.children.length >= maxThumbnails) {
-                            capturesGrid.removeChild(capturesGrid.lastChild); // Remove the oldest
-                        }
-                        const img = document.createElement('img');
-                        img.src = data.image_url;
-                        img.classList.add('capture-thumbnail');
-                        capturesGrid.prepend(img); // Add new capture to the start
-                        // ===== START: NEW COUNTER LOGIC =====
-                        totalCaptures++; // Increment the count
-                        captureCountDisplay.textContent = `(${totalCaptures})`; // Update the display
-                        // ===== END: NEW COUNTER LOGIC =====
-                    } else {
-                        console.error('Failed to save capture:', data.error);
-                    }
+                .then(blob => {
+                    if (!socket || !socket.connected) return uploadOverHttp(blob);
+                    // Queued frames are acked asynchronously, so the button is free right away
+                    return blob.arrayBuffer().then(data => {
+                        outbox.push({ seq: nextSeq++, ts: takenAt, data: data, sent: false, attempt: 0 });
+                        pump();
+                    });
                 })
                 .catch(error => console.error('Error during capture:', error))
                 .finally(() => {
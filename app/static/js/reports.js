@@ -198,34 +198,119 @@ document.addEventListener('DOMContentLoaded', function () {
         modalSubtitle.textContent = 'Loading captures...'; // 2. Set a loading state
         // ===== END: MODIFIED SECTION =====
         modalGrid.innerHTML = '<p class="placeholder-text">Loading...</p>';
+        capturesModal.dataset.investigationId = investigationId;
         openModal(capturesModal);
-        
-        fetch(`/investigation/${investigationId}/captures`)
-            .then(response => response.json())
-            .then(captures => {
-                // ===== START: MODIFIED SECTION =====
-                const captureCount = captures.length; // 3. Get the count
-                modalSubtitle.textContent = `Viewing ${captureCount} captured images for this investigation.`; // 4. Update the text
-                // ===== END: MODIFIED SECTION =====
-                
-                modalGrid.innerHTML = '';
-                if (captures.length > 0) {
-                    captures.forEach(capture => {
+        loadCapturePages(investigationId, modalGrid, modalSubtitle);
+    });
+
+    // Captures arrive one page at a time; the next page loads when the end of the grid scrolls into view
+    let capturesObserver = null;
+    function loadCapturePages(investigationId, modalGrid, modalSubtitle) {
+        if (capturesObserver) capturesObserver.disconnect();
+        const sentinel = document.createElement('div');
+        sentinel.className = 'captures-page-sentinel';
+        let nextCursor = null;
+        let loading = false;
+
+        const loadPage = (cursor) => {
+            loading = true;
+            const params = new URLSearchParams({ limit: 60 });
+            if (cursor) params.set('cursor', cursor);
+            return fetch(`/investigation/${investigationId}/captures?${params}`)
+                .then(response => response.json())
+                .then(page => {
+                    // The modal may have been reopened for another investigation meanwhile
+                    if (capturesModal.dataset.investigationId !== String(investigationId)) return;
+                    if (!cursor) {
+                        modalSubtitle.textContent = `Viewing ${page.total} captured images for this investigation.`;
+                        modalGrid.innerHTML = '';
+                        if (page.total === 0) {
+                            modalGrid.innerHTML = '<p class="placeholder-text">No captures found.</p>';
+                        }
+                    }
+                    page.captures.forEach(capture => {
                         const imgWrapper = document.createElement('div');
                         imgWrapper.className = 'capture-image-wrapper';
                         imgWrapper.dataset.captureId = capture.id; // IMPORTANT
-                        imgWrapper.innerHTML = `<img src="${capture.url}" alt="Capture">`;
+                        // Thumbnails once generated; the full image is only fetched by the analysis views
+                        const thumbs = capture.thumbnails;
+                        imgWrapper.innerHTML = thumbs
+                            ? `<img src="${thumbs['160']}" srcset="${thumbs['160']} 160w, ${thumbs['640']} 640w" sizes="(max-width: 600px) 90vw, 300px" alt="Capture" loading="lazy">`
+                            : `<img src="${capture.url}" alt="Capture" loading="lazy">`;
                         modalGrid.appendChild(imgWrapper);
                     });
-                } else {
-                    modalGrid.innerHTML = '<p class="placeholder-text">No captures found.</p>';
-                }
-            })
-            .catch(error => {
-                console.error('Error fetching captures:', error);
-                modalSubtitle.textContent = 'Could not load captures.'; // Handle error state
-                modalGrid.innerHTML = '<p class="placeholder-text error">Could not load captures.</p>';
-            });
+                    nextCursor = page.next_cursor;
+                    if (nextCursor) {
+                        modalGrid.appendChild(sentinel); // Keep it after the last capture
+                    } else {
+                        sentinel.remove();
+                        capturesObserver.disconnect();
+                    }
+                })
+                .finally(() => { loading = false; });
+        };
+
+        capturesObserver = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting) && nextCursor && !loading) {
+                loadPage(nextCursor).catch(error => console.error('Error fetching captures:', error));
+            }
+        }, { root: modalGrid, rootMargin: '400px' }); // The grid is the scrolling element
+        capturesObserver.observe(sentinel);
+
+        loadPage(null).catch(error => {
+            console.error('Error fetching captures:', error);
+            modalSubtitle.textContent = 'Could not load captures.'; // Handle error state
+            modalGrid.innerHTML = '<p class="placeholder-text error">Could not load captures.</p>';
+        });
+    }
+
+    // --- 4b. Analyze All -> Stream batch progress (NDJSON) ---
+    const analyzeAllBtn = document.getElementById('analyze-all-btn');
+    analyzeAllBtn.addEventListener('click', async () => {
+        const investigationId = capturesModal.dataset.investigationId;
+        const modalSubtitle = capturesModal.querySelector('#captures-modal-subtitle');
+        const markCapture = (captureId, className) => {
+            const wrapper = capturesModal.querySelector(`.capture-image-wrapper[data-capture-id="${captureId}"]`);
+            if (wrapper) wrapper.classList.add(className);
+        };
+
+        analyzeAllBtn.disabled = true;
+        analyzeAllBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Analyzing...';
+        try {
+            const response = await fetch(`/investigation/${investigationId}/analyze_all`, { method: 'POST' });
+            if (!response.ok) {
+                const data = await response.json();
+                throw new Error(data.error || `Server responded with status: ${response.status}`);
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffered = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffered += decoder.decode(value, { stream: true });
+                const lines = buffered.split('\n');
+                buffered = lines.pop(); // Keep any partial line for the next chunk
+                lines.filter(line => line.trim()).forEach(line => {
+                    const event = JSON.parse(line);
+                    if (event.type === 'start') {
+                        modalSubtitle.textContent = `Analyzing ${event.pending} captures (${event.skipped} already analyzed)...`;
+                    } else if (event.type === 'result') {
+                        markCapture(event.capture_id, event.status === 'failed' ? 'analysis-failed' : 'analyzed');
+                        modalSubtitle.textContent = `Analyzed ${event.done} of ${event.pending} captures...`;
+                    } else if (event.type === 'end') {
+                        modalSubtitle.textContent = `Batch complete: ${event.analyzed} analyzed, ${event.cached} reused, ${event.failed} failed.`;
+                    }
+                });
+            }
+        } catch (error) {
+            console.error('Batch analysis failed:', error);
+            modalSubtitle.textContent = `Batch analysis failed: ${error.message}`;
+        } finally {
+            analyzeAllBtn.disabled = false;
+            analyzeAllBtn.innerHTML = '<i class="fas fa-layer-group"></i> Analyze All';
+        }
     });
 
     // --- 5. Capture Click -> Open Group Analysis Modal ---
@@ -238,8 +323,7 @@ document.addEventListener('DOMContentLoaded', function () {
         grid.innerHTML = '<p class="placeholder-text">Analyzing image... Please wait.</p>';
         openModal(groupAnalysisModal);
 
-        fetch(`/capture/${captureId}/analyze`, { method: 'POST' })
-            .then(response => response.json())
+        runAnalysis(captureId)
             .then(data => {
                 if (data.error) throw new Error(data.error);
                 populateAndOpenGroupModal(data);
@@ -250,6 +334,35 @@ document.addEventListener('DOMContentLoaded', function () {
             });
     });
 
+    // Analysis runs as a background job: enqueue it, then long-poll until it finishes
+    async function runAnalysis(captureId) {
+        const grid = groupAnalysisModal.querySelector('#group-faces-grid');
+        let job;
+        while (true) {
+            const response = await fetch(`/capture/${captureId}/analyze`, { method: 'POST' });
+            job = await response.json();
+            // Queue full (429) or models still loading (503): wait as the server asks, then retry
+            const retryable = response.status === 429 || (response.status === 503 && job.status === 'warming_up');
+            if (!retryable) break;
+            if (job.status === 'warming_up') {
+                grid.innerHTML = '<p class="placeholder-text">Analysis models are warming up... Please wait.</p>';
+            }
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 2;
+            await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+        }
+        if (job.error) throw new Error(job.error);
+
+        while (job.status === 'queued' || job.status === 'running') {
+            const poll = await fetch(`${job.status_url}?wait=25`);
+            const status_url = job.status_url;
+            job = await poll.json();
+            job.status_url = status_url;
+            if (job.error && !job.status) throw new Error(job.error);
+        }
+        if (job.status === 'failed') throw new Error(job.error || 'Analysis failed');
+        return job.result;
+    }
+
     function populateAndOpenGroupModal(data) {
         const { group_stats, faces } = data;
         
@@ -273,7 +386,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 });
                 
                 card.innerHTML = `
-                    <img src="${face.crop_base64}" alt="Face crop">
+                    <img src="${face.crop_url}" alt="Face crop" loading="lazy">
                     <div class="face-card-info">
                         ${face.gender}, ${face.age_range}<br>
                         <strong>Panic: ${face.panic_score}%</strong>
@@ -295,7 +408,7 @@ document.addEventListener('DOMContentLoaded', function () {
     });
 
     function populateAndOpenPersonModal(personData) {
-        document.getElementById('person-detail-img').src = personData.crop_base64;
+        document.getElementById('person-detail-img').src = personData.crop_url;
         document.getElementById('person-detail-gender').textContent = personData.gender;
         document.getElementById('person-detail-age').textContent = personData.age_range;
         document.getElementById('person-detail-emotion').textContent = personData.emotion_label;
@@ -0,0 +1,436 @@
+# app/stream_ingest.py
+"""
+Server-side auto-capture from a drone video feed.
+
+The live page only captures when the operator clicks. A stream ingest instead
+opens the drone's feed itself and saves frames as captures on its own:
+
+  interval  every STREAM_INTERVAL_S seconds (0 turns it off)
+  scene     when the frame's dHash is at least STREAM_SCENE_BITS bits away from the last saved frame
+  face      when a cheap Haar cascade pass finds more faces than the last saved frame had
+
+The source is anything cv2.VideoCapture opens: rtsp://, http(s):// MJPEG or HLS,
+or a local file, which is played back at its own frame rate and so stands in
+for a drone during testing. Live sources are reopened when they drop.
+
+Decoding runs in a child process (`python -m app.stream_ingest`), so it never
+competes with the web workers for the GIL. Each stream gets its own limits there:
+  - STREAM_MAX_FPS caps how many frames per second are decoded and looked at;
+    the others are only grabbed, which is cheaper than a full read.
+  - STREAM_MIN_GAP_S is the shortest time between two saved frames.
+  - STREAM_NICE, STREAM_THREADS and STREAM_CPUS set the process's niceness,
+    OpenCV's thread count and its CPU affinity.
+
+The child sends the sampled JPEGs back over a pipe. A thread in the starting
+process saves them like any other capture: content-addressed storage, a
+Capture row, thumbnails and a live channel push.
+
+Streams are started per investigation through
+POST /investigation/<id>/stream/start (and stopped through .../stream/stop) or in the foreground with
+`flask streams ingest`. Like the analysis job queue, the registry of running
+streams lives in one web process.
+
+URLs from the web go through check_source before any process starts: the host
+must resolve to public addresses, or be listed in STREAM_ALLOWED_HOSTS. The
+check cannot see HTTP redirects or DNS changes made after it. Deployments that
+expose the routes widely should therefore list their drones' hosts in
+STREAM_ALLOWED_HOSTS, which then becomes a strict allow-list.
+"""
+import ipaddress
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from multiprocessing import connection
+from urllib.parse import urlparse
+
+import cv2
+from flask import current_app
+
+from .models import db, Capture
+from . import capture_storage, live_channel, metrics, near_duplicates, report_stats, thumbnails
+
+import pytz
+IST = pytz.timezone("Asia/Kolkata")
+
+LIVE_SCHEMES = ('rtsp', 'rtsps', 'rtmp', 'http', 'https') # Sources the web routes accept
+FACE_DETECT_WIDTH = 320 # The Haar pass runs on a frame scaled down to this width
+STATS_EVERY_S = 2.0 # How often the child reports its counters
+RECONNECT_MAX_S = 30.0
+JPEG_QUALITY = 90
+
+
+# --- Sampling (child process) ---
+class FrameSampler:
+    """Decides which of a stream's frames are worth saving."""
+
+    def __init__(self, interval_s=10.0, scene_bits=12, detect_faces=True, min_gap_s=1.0):
+        self.interval_s = interval_s
+        self.scene_bits = scene_bits
+        self.min_gap_s = min_gap_s
+        self.cascade = None
+        if detect_faces:
+            if hasattr(cv2, 'CascadeClassifier'):
+                self.cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+            else: # OpenCV 5 moved the Haar cascades out of the main package
+                print("[WARN] This OpenCV build has no Haar cascades. Face-triggered captures are off.")
+        self.last_saved_at = None
+        self.last_hash = None
+        self.last_faces = 0
+        self._faces = None # Count for the frame just checked, reused by saved()
+
+    def count_faces(self, gray):
+        scale = FACE_DETECT_WIDTH / gray.shape[1]
+        if scale < 1:
+            gray = cv2.resize(gray, (FACE_DETECT_WIDTH, round(gray.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+        return len(self.cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(20, 20)))
+
+    def check(self, frame, now):
+        """Returns (reason, dhash) when `frame` should be saved, else (None, dhash)."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        dhash = near_duplicates.dhash_image(gray)
+        self._faces = None
+        if self.last_saved_at is None:
+            return 'first', dhash
+        elapsed = now - self.last_saved_at
+        if elapsed < self.min_gap_s:
+            return None, dhash
+        if self.interval_s and elapsed >= self.interval_s:
+            return 'interval', dhash
+        if self.scene_bits and bin(int(dhash, 16) ^ int(self.last_hash, 16)).count('1') >= self.scene_bits:
+            return 'scene', dhash
+        if self.cascade is not None:
+            faces = self._faces = self.count_faces(gray)
+            if faces > self.last_faces:
+                return 'face', dhash
+            self.last_faces = min(self.last_faces, faces) # Faces that left can trigger again when they return
+        return None, dhash
+
+    def saved(self, frame, dhash, now):
+        self.last_saved_at = now
+        self.last_hash = dhash
+        if self.cascade is not None:
+            self.last_faces = self._faces if self._faces is not None \
+                else self.count_faces(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+
+
+def _limit_cpu(options):
+    try:
+        if options.get('nice'):
+            os.nice(options['nice'])
+        if options.get('cpus') and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, options['cpus'])
+    except OSError as e:
+        print(f"[WARN] Could not apply stream CPU limits: {e}")
+    cv2.setNumThreads(options.get('threads') or 1)
+
+
+def sample_stream(source, options, stop):
+    """
+    Reads `source` until it ends or `stop` is set. Yields ('frame', jpeg, dhash, epoch_ms, reason)
+    for every sampled frame and ('stats', {...}) now and then.
+    """
+    is_file = os.path.exists(source)
+    sampler = FrameSampler(options['interval_s'], options['scene_bits'], options['detect_faces'], options['min_gap_s'])
+    eval_every = 1.0 / options['max_fps'] if options['max_fps'] else 0.0
+    stats = Counter()
+    backoff = 1.0
+    last_stats = time.monotonic()
+
+    while not stop.is_set():
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            if is_file:
+                yield ('error', f"Cannot open {source}.")
+                return
+            stats['reconnects'] += 1
+            stop.wait(backoff)
+            backoff = min(backoff * 2, RECONNECT_MAX_S)
+            continue
+        # A file is played back in real time, so it behaves like a live feed
+        frame_s = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 25.0) if is_file else 0.0
+        started = time.monotonic()
+        next_eval = started
+        try:
+            while not stop.is_set():
+                if frame_s:
+                    ahead = started + stats['frames_read'] * frame_s - time.monotonic()
+                    if ahead > 0:
+                        stop.wait(ahead)
+                # grab() skips decoding work for the frames that are not looked at
+                if not cap.grab():
+                    break
+                backoff = 1.0
+                stats['frames_read'] += 1
+                now = time.monotonic()
+                if now - last_stats >= STATS_EVERY_S:
+                    yield ('stats', dict(stats))
+                    last_stats = now
+                if now < next_eval:
+                    continue
+                next_eval = now + eval_every
+                ok, frame = cap.retrieve()
+                if not ok:
+                    continue
+                stats['frames_evaluated'] += 1
+                reason, dhash = sampler.check(frame, now)
+                if reason is None:
+                    continue
+                ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                if not ok:
+                    continue
+                sampler.saved(frame, dhash, now)
+                stats['sampled'] += 1
+                yield ('frame', buffer.tobytes(), dhash, int(time.time() * 1000), reason)
+        finally:
+            cap.release()
+        if is_file:
+            break
+        stats['reconnects'] += 1 # The live feed dropped; open it again
+        stop.wait(backoff)
+        backoff = min(backoff * 2, RECONNECT_MAX_S)
+    yield ('stats', dict(stats))
+
+
+def _child_main(fd):
+    """
+    Entry point of `python -m app.stream_ingest <fd>`. Reads {source, options} as JSON
+    from stdin and sends its messages over the inherited pipe `fd`. SIGTERM stops it.
+    """
+    request = json.load(sys.stdin)
+    conn = connection.Connection(fd, readable=False)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    _limit_cpu(request['options'])
+    try:
+        for message in sample_stream(request['source'], request['options'], stop):
+            conn.send(message)
+    except (BrokenPipeError, EOFError): # The saving side is gone
+        return
+    except Exception as e:
+        conn.send(('error', str(e)))
+    try:
+        conn.send(('eof',))
+    except OSError:
+        pass
+    conn.close()
+
+
+# --- Saving (starting process) ---
+def save_frame(investigation_id, data, dhash, epoch_ms):
+    """Stores one sampled frame as a capture of the investigation. Needs an app context."""
+    filename, _, size = capture_storage.store_bytes(data)
+    capture = Capture(image_filename=filename, investigation_id=investigation_id, dhash=dhash,
+                      timestamp=datetime.fromtimestamp(epoch_ms / 1000, IST))
+    db.session.add(capture)
+    db.session.commit()
+    report_stats.invalidate(capture.investigation.user_id)
+    thumbnails.enqueue(capture.id, filename)
+    metrics.CAPTURE_UPLOAD_BYTES.observe(size)
+    metrics.CAPTURE_FILES_WRITTEN.inc()
+    live_channel.notify_capture(investigation_id, capture)
+    return capture
+
+
+class StreamIngest:
+    """One running stream: a decoding child process plus a thread here that saves what it samples."""
+
+    def __init__(self, app, investigation_id, source, options):
+        self.app = app
+        self.investigation_id = investigation_id
+        self.source = source
+        self.options = options
+        self.started_at = time.time()
+        self.stats = {}
+        self.reasons = Counter()
+        self.captures = 0
+        self.error = None
+        self.finished = threading.Event()
+        # A fresh interpreter, not a fork of this threaded process (nor a multiprocessing
+        # spawn, which would re-run the web app's main module and load the models again)
+        read_fd, write_fd = os.pipe()
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', __name__, str(write_fd)], stdin=subprocess.PIPE, pass_fds=(write_fd,),
+            cwd=os.path.dirname(app.root_path))
+        os.close(write_fd)
+        self._conn = connection.Connection(read_fd, writable=False)
+        # The source goes through stdin so stream credentials never show up in `ps`
+        self._process.stdin.write(json.dumps({'source': source, 'options': options}).encode())
+        self._process.stdin.close()
+        metrics.STREAMS_ACTIVE.inc()
+        self._thread = threading.Thread(target=self._receive, name=f"stream-save-{investigation_id}", daemon=True)
+        self._thread.start()
+
+    def _receive(self):
+        try:
+            while True:
+                try:
+                    message = self._conn.recv()
+                except (EOFError, OSError):
+                    break
+                kind = message[0]
+                if kind == 'eof':
+                    break
+                if kind == 'stats':
+                    self.stats = message[1]
+                elif kind == 'error':
+                    self.error = message[1]
+                    print(f"[WARN] Stream ingest for investigation {self.investigation_id} failed: {self.error}")
+                elif kind == 'frame':
+                    _, data, dhash, epoch_ms, reason = message
+                    with self.app.app_context():
+                        try:
+                            save_frame(self.investigation_id, data, dhash, epoch_ms)
+                        except Exception as e:
+                            db.session.rollback()
+                            print(f"[WARN] Could not save stream frame: {e}")
+                            continue
+                    self.captures += 1
+                    self.reasons[reason] += 1
+                    metrics.STREAM_CAPTURES.labels(reason).inc()
+        finally:
+            self._conn.close()
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+            metrics.STREAMS_ACTIVE.dec()
+            self.finished.set()
+
+    def stop(self, timeout=10):
+        if self._process.poll() is None:
+            self._process.terminate() # The child finishes its current frame and says eof
+        if not self.finished.wait(timeout):
+            self._process.kill()
+
+    def status(self):
+        return {
+            'investigation_id': self.investigation_id,
+            'source': _redact(self.source),
+            'running': not self.finished.is_set(),
+            'started_at': self.started_at,
+            'captures': self.captures,
+            'reasons': dict(self.reasons),
+            'frames_read': self.stats.get('frames_read', 0),
+            'frames_evaluated': self.stats.get('frames_evaluated', 0),
+            'reconnects': self.stats.get('reconnects', 0),
+            'error': self.error,
+        }
+
+
+def _redact(source):
+    """Drops credentials from a stream URL before it is shown anywhere."""
+    parsed = urlparse(source)
+    if parsed.password is None:
+        return source
+    return parsed._replace(netloc=f"{parsed.username}:***@{parsed.hostname}" + (f":{parsed.port}" if parsed.port else "")).geturl()
+
+
+# --- Registry ---
+class StreamRegistry:
+    def __init__(self, app):
+        self.app = app
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def start(self, investigation_id, source, **overrides):
+        """Starts ingesting `source` for an investigation. Raises ValueError when it cannot."""
+        with self._lock:
+            current = self._streams.get(investigation_id)
+            if current is not None and not current.finished.is_set():
+                raise ValueError('A stream is already running for this investigation.')
+            running = sum(not s.finished.is_set() for s in self._streams.values())
+            if running >= self.app.config['STREAM_MAX_ACTIVE']:
+                raise ValueError('Too many streams are running.')
+            stream = StreamIngest(self.app, investigation_id, source, stream_options(self.app.config, **overrides))
+            self._streams[investigation_id] = stream
+            return stream
+
+    def stop(self, investigation_id):
+        with self._lock:
+            stream = self._streams.pop(investigation_id, None)
+        if stream is not None:
+            stream.stop()
+        return stream
+
+    def get(self, investigation_id):
+        with self._lock:
+            return self._streams.get(investigation_id)
+
+
+def stream_options(config, **overrides):
+    options = {
+        'interval_s': config['STREAM_INTERVAL_S'],
+        'scene_bits': config['STREAM_SCENE_BITS'],
+        'detect_faces': config['STREAM_DETECT_FACES'],
+        'min_gap_s': config['STREAM_MIN_GAP_S'],
+        'max_fps': config['STREAM_MAX_FPS'],
+        'nice': config['STREAM_NICE'],
+        'threads': config['STREAM_THREADS'],
+        'cpus': [int(c) for c in config['STREAM_CPUS'].split(',') if c.strip()],
+    }
+    options.update((k, v) for k, v in overrides.items() if v is not None)
+    return options
+
+
+def is_live_source(source):
+    return urlparse(source).scheme.lower() in LIVE_SCHEMES
+
+
+def _allowed(host, addresses, allowed_hosts):
+    for entry in allowed_hosts:
+        if entry.lower() == host.lower():
+            return True
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            continue
+        if any(address in network for address in addresses):
+            return True
+    return False
+
+def check_source(source, allowed_hosts):
+    """
+    Validates a stream URL from a web request, so users cannot point the server at
+    itself or the internal network. The host must be in `allowed_hosts` (names, IPs or
+    CIDRs) when that list is set. Hosts that resolve to loopback, private, link-local or
+    other non-global addresses are refused unless listed there explicitly.
+    Raises ValueError with a message for the user.
+    """
+    if not is_live_source(source):
+        raise ValueError('source must be an rtsp://, rtmp:// or http(s):// stream URL.')
+    parsed = urlparse(source)
+    try:
+        host, port = parsed.hostname, parsed.port
+    except ValueError:
+        raise ValueError('source has an invalid port.')
+    if not host:
+        raise ValueError('source has no host.')
+    try:
+        addresses = {ipaddress.ip_address(info[4][0].split('%')[0])
+                     for info in socket.getaddrinfo(host, port or 0, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f"Cannot resolve {host}.")
+    if _allowed(host, addresses, allowed_hosts):
+        return
+    if allowed_hosts:
+        raise ValueError(f"{host} is not in STREAM_ALLOWED_HOSTS.")
+    if not all(address.is_global for address in addresses):
+        raise ValueError(f"{host} is an internal address. Add it to STREAM_ALLOWED_HOSTS to use it.")
+
+
+def init_app(app):
+    app.extensions['stream_ingest'] = StreamRegistry(app)
+
+def get_registry():
+    return current_app.extensions['stream_ingest']
+
+
+if __name__ == '__main__':
+    _child_main(int(sys.argv[1]))
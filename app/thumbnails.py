@@ -0,0 +1,110 @@
+# app/thumbnails.py
+"""
+Small WebP renditions of captures for grids and previews.
+
+Every capture gets one thumbnail per capture_storage.THUMBNAIL_SIZES (longest
+side). They are generated after the upload response by a background thread,
+so ingest latency does not change, and Capture.thumbnails_ready is set once
+they exist. Until then the UI falls back to the original image.
+`flask captures thumbnails-backfill` covers captures stored before this existed.
+"""
+import os
+import queue
+import threading
+
+import cv2
+from flask import current_app
+
+from .models import db, Capture
+from . import capture_storage
+
+WEBP_QUALITY = 80
+MAX_BATCH = 32 # Captures marked ready per UPDATE
+
+
+def generate(image_path, targets):
+    """
+    Writes one thumbnail per (size, path) in `targets` from a single decode.
+    Returns False when the image cannot be read.
+    """
+    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if img is None:
+        return False
+    for size, path in sorted(targets, reverse=True):
+        h, w = img.shape[:2]
+        scale = size / max(h, w)
+        if scale < 1:
+            # Each size is resized from the previous (larger) one, which is cheaper than from the original
+            img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode(capture_storage.THUMBNAIL_EXTENSION, img, [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY])
+        if not ok:
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{threading.get_ident()}.part"
+        with open(partial, 'wb') as f:
+            f.write(buffer.tobytes())
+        os.replace(partial, path)
+    return True
+
+def generate_for(image_filename):
+    """Thumbnails for a stored capture. Identical captures share them, so existing files are kept."""
+    targets = [(size, capture_storage.thumbnail_path(image_filename, size)) for size in capture_storage.THUMBNAIL_SIZES]
+    missing = [(size, path) for size, path in targets if not os.path.exists(path)]
+    if not missing:
+        return True
+    return generate(capture_storage.path_for(image_filename), missing)
+
+
+# --- Background Worker ---
+class ThumbnailWorker:
+    """One daemon thread draining a queue of (capture_id, image_filename)."""
+
+    def __init__(self, app):
+        self.app = app
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, capture_id, image_filename):
+        self._queue.put((capture_id, image_filename))
+        with self._lock:
+            if self._thread is None: # Started on first use, like the analysis workers
+                self._thread = threading.Thread(target=self._loop, name="thumbnail-worker", daemon=True)
+                self._thread.start()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                ready = []
+                for capture_id, image_filename in batch:
+                    try:
+                        if generate_for(image_filename):
+                            ready.append(capture_id)
+                        else:
+                            print(f"[WARN] Could not make thumbnails for capture {capture_id}.")
+                    except Exception as e:
+                        print(f"[WARN] Thumbnail generation failed for capture {capture_id}: {e}")
+                if ready:
+                    try:
+                        Capture.query.filter(Capture.id.in_(ready)).update(
+                            {Capture.thumbnails_ready: True}, synchronize_session=False)
+                        db.session.commit()
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"[WARN] Could not mark thumbnails ready: {e}")
+
+
+def init_app(app):
+    app.extensions['thumbnails'] = ThumbnailWorker(app)
+
+def enqueue(capture_id, image_filename):
+    current_app.extensions['thumbnails'].enqueue(capture_id, image_filename)
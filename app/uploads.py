@@ -0,0 +1,59 @@
+# app/uploads.py
+"""
+Streaming writes of uploaded images to disk.
+
+Request bodies are copied in fixed-size chunks, so memory use does not grow
+with the size of the upload, and oversized bodies are cut off at the limit
+instead of being read in full. Data goes to a `.part` file that is renamed
+into place only once it is complete, so readers never see half a capture.
+"""
+import os
+
+CHUNK_SIZE = 64 * 1024
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+
+class UploadError(Exception):
+    """A rejected upload. `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def save_stream(stream, path, max_bytes, magic=JPEG_MAGIC, chunk_size=CHUNK_SIZE, hasher=None):
+    """
+    Copies `stream` to `path` and returns the number of bytes written.
+    `hasher` (a hashlib object) is fed every chunk on the way.
+    Raises UploadError when the data does not start with `magic`, is empty,
+    or exceeds max_bytes. Nothing is left on disk in that case.
+    """
+    partial = path + ".part"
+    written = 0
+    try:
+        with open(partial, "wb") as f:
+            head = stream.read(len(magic))
+            if head != magic:
+                raise UploadError("Upload is not a JPEG image.", 415)
+            f.write(head)
+            written = len(head)
+            if hasher is not None:
+                hasher.update(head)
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadError("Upload is too large.", 413)
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+        os.replace(partial, path)
+    except BaseException:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+    return written
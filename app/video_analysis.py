@@ -0,0 +1,295 @@
+# app/video_analysis.py
+"""
+Panic-score time series for recorded clips and frame streams.
+
+Frames are sampled at `sample_fps`. The face detector runs on every sampled
+frame. Detected faces are linked to tracks by IoU with the track's last box.
+A face that lost its track for a few frames is re-linked by appearance
+similarity. Age, gender and emotion are inferred only when a track is new, its
+appearance has drifted from when it was last inferred, its box has grown or
+shrunk noticeably, or the attributes are older than `refresh_s`. Every other
+frame reuses the track's attributes with that frame's box and detector score.
+Each sampled frame is scored like a still capture (panic_scoring.FaceBatch,
+which matches analysis_utils.compute_group_panic exactly).
+"""
+import itertools
+
+import cv2
+import numpy as np
+
+from . import analysis_utils
+from .panic_scoring import FaceBatch
+
+SIGNATURE_SIZE = 24 # Side of the grey patch used as a cheap appearance signature
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.webm'}
+
+
+# --- Helpers ---
+def box_iou(a, b):
+    """IoU matrix between two (N, 4) and (M, 4) box arrays."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+def appearance_signature(img, bbox):
+    """Zero-mean, unit-norm grey patch of the face. The dot product of two is their correlation."""
+    x1, y1, x2, y2 = (int(v) for v in bbox[:4])
+    crop = img[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)]
+    if crop.size == 0:
+        return None
+    grey = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    patch = cv2.resize(grey, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    patch -= patch.mean()
+    norm = np.linalg.norm(patch)
+    return patch / norm if norm > 1e-6 else patch
+
+def similarity(a, b):
+    if a is None or b is None:
+        return 0.0
+    return float(np.dot(a, b))
+
+def _box_area(bbox):
+    return max(float(bbox[2] - bbox[0]), 1.0) * max(float(bbox[3] - bbox[1]), 1.0)
+
+
+# --- Tracks ---
+class FaceTrack:
+    def __init__(self, track_id, bbox, det_score, signature, t):
+        self.id = track_id
+        self.bbox = bbox
+        self.det_score = det_score
+        self.signature = signature
+        self.first_seen = t
+        self.last_seen = t
+        self.missed = 0
+        self.inferences = 0
+        self.peak_panic = 0.0
+        # Set by the last inference
+        self.gender = None
+        self.age = None
+        self.emotion_label = None
+        self.emo_fear = 0.0
+        self.inferred_at = None
+        self.inferred_signature = None
+        self.inferred_area = None
+
+    def needs_inference(self, t, appearance_threshold, scale_change, refresh_s):
+        if self.inferred_at is None:
+            return True
+        if similarity(self.signature, self.inferred_signature) < appearance_threshold:
+            return True
+        ratio = _box_area(self.bbox) / self.inferred_area
+        if ratio > scale_change or ratio < 1.0 / scale_change:
+            return True
+        return refresh_s is not None and t - self.inferred_at >= refresh_s
+
+    def summary(self):
+        return {
+            "track_id": self.id,
+            "first_seen": round(self.first_seen, 3),
+            "last_seen": round(self.last_seen, 3),
+            "gender": self.gender,
+            "age": self.age,
+            "age_range": analysis_utils.age_to_range(self.age) if self.age is not None else None,
+            "emotion_label": self.emotion_label,
+            "inferences": self.inferences,
+            "peak_panic": round(self.peak_panic, 4),
+        }
+
+
+# --- Analyzer ---
+class VideoAnalyzer:
+    """
+    Stateful per-clip analyzer. Feed decoded BGR frames in time order to
+    process_frame(), or use analyze_file() for a clip on disk.
+    """
+
+    def __init__(self, sample_fps=2.0, iou_threshold=0.3, appearance_threshold=0.7,
+                 relink_threshold=0.8, scale_change=1.5, refresh_s=10.0, max_missed=5):
+        self.sample_fps = sample_fps
+        self.iou_threshold = iou_threshold
+        self.appearance_threshold = appearance_threshold
+        self.relink_threshold = relink_threshold
+        self.scale_change = scale_change
+        self.refresh_s = refresh_s
+        self.max_missed = max_missed
+        self.tracks = []
+        self.finished_tracks = []
+        self.series = []
+        self.detections = 0
+        self.inferences = 0
+        self._next_id = itertools.count()
+
+    def _match(self, bboxes, signatures):
+        """Returns {detection index: track} using IoU first, then appearance for lost tracks."""
+        matches = {}
+        claimed = set()
+        visible = [t for t in self.tracks if t.missed == 0]
+        if visible and len(bboxes):
+            iou = box_iou(np.array([t.bbox for t in visible]), bboxes[:, :4])
+            # Greedy assignment, best overlap first
+            for flat in np.argsort(-iou, axis=None):
+                ti, di = (int(v) for v in np.unravel_index(flat, iou.shape))
+                if iou[ti, di] < self.iou_threshold:
+                    break
+                if di in matches or visible[ti].id in claimed:
+                    continue
+                matches[di] = visible[ti]
+                claimed.add(visible[ti].id)
+
+        for di in range(len(bboxes)):
+            if di in matches:
+                continue
+            best, best_sim = None, self.relink_threshold
+            for track in self.tracks:
+                if track.id in claimed:
+                    continue
+                sim = similarity(track.signature, signatures[di])
+                if sim >= best_sim:
+                    best, best_sim = track, sim
+            if best is not None:
+                matches[di] = best
+                claimed.add(best.id)
+        return matches
+
+    def _infer(self, img, tracks, kps_by_track, t):
+        """Age/gender (per face) and one batched emotion pass for the tracks that need it."""
+        from insightface.app.common import Face
+
+        crops = []
+        for track in tracks:
+            face = Face(bbox=np.asarray(track.bbox, dtype=np.float32), kps=kps_by_track.get(track.id),
+                        det_score=track.det_score)
+            analysis_utils.run_face_models(img, face, tasks=('genderage',))
+            track.gender = "Male" if face.gender == 1 else "Female"
+            track.age = int(face.age) if hasattr(face, "age") else 25
+            x1, y1, x2, y2 = (int(v) for v in track.bbox)
+            crops.append(img[max(y1, 0):y2, max(x1, 0):x2])
+
+        labels, fears = analysis_utils.get_emotions_vit_batch(crops)
+        for track, label, fear in zip(tracks, labels, fears):
+            track.emotion_label = label
+            track.emo_fear = fear
+            track.inferred_at = t
+            track.inferred_signature = track.signature
+            track.inferred_area = _box_area(track.bbox)
+            track.inferences += 1
+        self.inferences += len(tracks)
+
+    def process_frame(self, img, t, frame_index=None):
+        """Detects, tracks and scores one frame taken at `t` seconds. Returns its time-series point."""
+        bboxes, kpss = analysis_utils.detect_boxes(img)
+        self.detections += len(bboxes)
+        signatures = [appearance_signature(img, b) for b in bboxes]
+        matches = self._match(bboxes, signatures)
+
+        seen, kps_by_track = [], {}
+        for di in range(len(bboxes)):
+            track = matches.get(di)
+            if track is None:
+                track = FaceTrack(next(self._next_id), bboxes[di, :4].tolist(), float(bboxes[di, 4]), signatures[di], t)
+                self.tracks.append(track)
+            else:
+                track.bbox = bboxes[di, :4].tolist()
+                track.det_score = float(bboxes[di, 4])
+                track.signature = signatures[di]
+                track.missed = 0
+            track.last_seen = t
+            seen.append(track)
+            if kpss is not None:
+                kps_by_track[track.id] = kpss[di]
+
+        # Tracks not seen in this frame age out after max_missed sampled frames
+        seen_ids = set(track.id for track in seen)
+        for track in self.tracks:
+            if track.id not in seen_ids:
+                track.missed += 1
+        self.finished_tracks.extend(track for track in self.tracks if track.missed > self.max_missed)
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+        stale = [track for track in seen
+                 if track.needs_inference(t, self.appearance_threshold, self.scale_change, self.refresh_s)]
+        if stale:
+            self._infer(img, stale, kps_by_track, t)
+
+        batch = FaceBatch(
+            det_score=[track.det_score for track in seen],
+            age=[track.age for track in seen],
+            is_male=[track.gender == "Male" for track in seen],
+            fear=[track.emo_fear for track in seen],
+        )
+        _, panic_scores, group_scores = batch.score()
+        for track, panic_score in zip(seen, panic_scores):
+            track.peak_panic = max(track.peak_panic, float(panic_score))
+        male_count = int(batch.is_male.sum())
+
+        point = {
+            "t": round(t, 3),
+            "frame": frame_index,
+            "faces": len(seen),
+            "male_count": male_count,
+            "female_count": len(seen) - male_count,
+            "inferred": len(stale),
+            "track_ids": [track.id for track in seen],
+            "panic_score": round(float(group_scores[0]), 4),
+        }
+        self.series.append(point)
+        return point
+
+    def analyze_file(self, path, max_seconds=None):
+        """Samples a clip (or any cv2.VideoCapture source) at sample_fps and returns summary()."""
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise ValueError("Could not open the video.")
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+            if fps <= 0 or fps > 240:
+                fps = 30.0 # Missing or bogus container metadata
+            step = max(1, int(round(fps / self.sample_fps)))
+            frame_index = 0
+            # grab() skips decoding work for the frames that are not sampled
+            while cap.grab():
+                if frame_index % step == 0:
+                    ok, img = cap.retrieve()
+                    if not ok:
+                        break
+                    t = frame_index / fps
+                    if max_seconds is not None and t > max_seconds:
+                        break
+                    self.process_frame(img, t, frame_index)
+                frame_index += 1
+        finally:
+            cap.release()
+        return self.summary(source_fps=fps, source_frames=frame_index)
+
+    def summary(self, **extra):
+        scores = [p["panic_score"] for p in self.series]
+        peak = max(self.series, key=lambda p: p["panic_score"]) if self.series else None
+        tracks = sorted(self.finished_tracks + self.tracks, key=lambda track: track.id)
+        return dict(
+            extra,
+            sample_fps=self.sample_fps,
+            sampled_frames=len(self.series),
+            duration_s=self.series[-1]["t"] if self.series else 0.0,
+            detections=self.detections,
+            inferences=self.inferences, # vs. `detections` for per-frame analysis
+            peak_panic=peak["panic_score"] if peak else 0.0,
+            peak_t=peak["t"] if peak else None,
+            mean_panic=round(float(np.mean(scores)), 4) if scores else 0.0,
+            tracks=[track.summary() for track in tracks],
+            series=self.series,
+        )
+
+
+def analyze_video(path, sample_fps=2.0, max_seconds=None):
+    """Convenience wrapper: tracked panic time series for the clip at `path`."""
+    if analysis_utils.INFERENCE_CLIENT is not None:
+        return analysis_utils.INFERENCE_CLIENT.analyze_video(path, sample_fps, max_seconds)
+    return VideoAnalyzer(sample_fps=sample_fps).analyze_file(path, max_seconds=max_seconds)
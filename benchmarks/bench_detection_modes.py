@@ -0,0 +1,107 @@
+# benchmarks/bench_detection_modes.py
+"""
+Latency and recall of the face detection modes (fixed / adaptive / tiled / auto).
+
+There is no hand-labelled ground truth for the bundled captures, so recall is
+measured against the union of every mode's detections (merged with NMS).
+A face counts as found by a mode if one of its boxes overlaps it with IoU >= 0.5.
+Only the detector pass is timed. The per-face attribute models cost the same in
+every mode.
+
+Usage:
+    python benchmarks/bench_detection_modes.py
+    python benchmarks/bench_detection_modes.py --captures /data/drone_frames --output det_modes.json
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import analysis_utils  # noqa: E402
+
+
+def iou_matrix(a, b):
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--captures", default=os.path.join(ROOT, "app", "static", "captures"))
+    parser.add_argument("--modes", nargs="+", default=list(analysis_utils.DETECTION_MODES))
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per image and mode.")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    analysis_utils.initialize_models()
+    if not analysis_utils.models_ready():
+        sys.exit(f"Models not available: {analysis_utils.model_status()}")
+
+    latencies = {mode: [] for mode in args.modes}
+    found = {mode: 0 for mode in args.modes}
+    detections = {mode: 0 for mode in args.modes}
+    reference_total = 0
+    paths = sorted(glob.glob(os.path.join(args.captures, "*.jpg")))
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        analysis_utils.detect_boxes(img, "fixed")  # warm the session for this image size
+        boxes = {}
+        for mode in args.modes:
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                bboxes, _ = analysis_utils.detect_boxes(img, mode)
+                latencies[mode].append(time.perf_counter() - start)
+            boxes[mode] = bboxes
+            detections[mode] += len(bboxes)
+
+        union = np.concatenate(list(boxes.values()), axis=0)
+        if union.shape[0] == 0:
+            continue
+        reference = union[analysis_utils.nms(union[:, :4], union[:, 4])][:, :4]
+        reference_total += len(reference)
+        for mode, bboxes in boxes.items():
+            if len(bboxes):
+                found[mode] += int((iou_matrix(reference, bboxes[:, :4]).max(axis=1) >= 0.5).sum())
+
+    report = {"images": len(paths), "reference_faces": reference_total, "modes": {}}
+    for mode in args.modes:
+        lat = sorted(latencies[mode])
+        report["modes"][mode] = {
+            "p50_ms": 1000 * statistics.median(lat) if lat else None,
+            "p95_ms": 1000 * lat[int(0.95 * (len(lat) - 1))] if lat else None,
+            "mean_ms": 1000 * statistics.fmean(lat) if lat else None,
+            "detections": detections[mode],
+            "recall": found[mode] / reference_total if reference_total else None,
+        }
+
+    print(f"{report['images']} images, {reference_total} faces in the union reference\n")
+    print("| mode | p50 ms | p95 ms | detections | recall |")
+    print("|---|---|---|---|---|")
+    for mode, r in report["modes"].items():
+        recall = f"{r['recall']:.1%}" if r["recall"] is not None else "n/a"
+        print(f"| {mode} | {r['p50_ms']:.1f} | {r['p95_ms']:.1f} | {r['detections']} | {recall} |")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
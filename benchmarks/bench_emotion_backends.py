@@ -0,0 +1,123 @@
+# benchmarks/bench_emotion_backends.py
+"""
+Accuracy and latency comparison of the emotion backends.
+
+Faces are detected once with InsightFace on every image in the capture directory.
+Each backend then classifies the same preprocessed crops. Results are compared to
+the torch fp32 reference against emotion_backends.TOLERANCES.
+
+Usage:
+    flask emotion export                       # writes the ONNX files first
+    python benchmarks/bench_emotion_backends.py --output emotion_backends.json
+    python benchmarks/bench_emotion_backends.py --backends torch onnx-int8 --limit 50
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import analysis_utils, emotion_backends  # noqa: E402
+
+
+def collect_face_crops(image_dir, limit):
+    from insightface.app import FaceAnalysis
+
+    face_app = FaceAnalysis(name="buffalo_l")
+    face_app.prepare(ctx_id=0, det_size=(640, 640))
+    crops = []
+    paths = sorted(glob.glob(os.path.join(image_dir, "*.jpg")))[:limit]
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        for f in face_app.get(img):
+            x1, y1, x2, y2 = map(int, f.bbox)
+            crop = img[y1:y2, x1:x2]
+            if crop.size:
+                crops.append(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB))
+    return len(paths), crops
+
+
+def run_backend(backend, batches):
+    backend.predict_proba(batches[0])  # warm-up, not timed
+    probs, latencies = [], []
+    for pixel_values in batches:
+        start = time.perf_counter()
+        probs.append(backend.predict_proba(pixel_values))
+        latencies.append(time.perf_counter() - start)
+    return np.concatenate(probs, axis=0), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--captures", default=os.path.join(ROOT, "app", "static", "captures"))
+    parser.add_argument("--limit", type=int, default=1000, help="Max number of images to use.")
+    parser.add_argument("--backends", nargs="+", default=list(emotion_backends.BACKENDS))
+    parser.add_argument("--batch-size", type=int, default=analysis_utils.EMOTION_BATCH_SIZE)
+    parser.add_argument("--model-dir", default=os.path.join(ROOT, "instance", "models"))
+    parser.add_argument("--output", help="Write the JSON report here as well as printing it.")
+    args = parser.parse_args()
+
+    from transformers import ViTImageProcessor
+
+    n_images, crops = collect_face_crops(args.captures, args.limit)
+    if not crops:
+        sys.exit("No faces found in the capture directory.")
+    processor = ViTImageProcessor.from_pretrained(emotion_backends.EMOTION_MODEL_ID)
+    batches = [processor(images=crops[i:i + args.batch_size], return_tensors="np",
+                         input_data_format="channels_last")["pixel_values"]
+               for i in range(0, len(crops), args.batch_size)]
+
+    backends = ["torch"] + [b for b in args.backends if b != "torch"]  # reference first
+    reference = None
+    report = {"images": n_images, "faces": len(crops), "batch_size": args.batch_size, "backends": {}}
+    for name in backends:
+        try:
+            backend = emotion_backends.load_backend(name, args.model_dir)
+        except Exception as e:
+            report["backends"][name] = {"error": str(e)}
+            continue
+        probs, latencies = run_backend(backend, batches)
+        labels = np.argmax(probs, axis=-1)
+        fear = analysis_utils.fear_scores_from_probs(probs)
+        if reference is None:
+            reference = (labels, fear)
+        diff = np.abs(fear - reference[1])
+        agreement = float(np.mean(labels == reference[0]))
+        tolerance = emotion_backends.TOLERANCES[name]
+        report["backends"][name] = {
+            "total_s": float(sum(latencies)),
+            "ms_per_face": 1000 * sum(latencies) / len(crops),
+            "faces_per_s": len(crops) / sum(latencies),
+            "label_agreement": agreement,
+            "max_fear_abs_diff": float(diff.max()),
+            "mean_fear_abs_diff": float(diff.mean()),
+            "within_tolerance": bool(diff.max() <= tolerance["max_fear_abs_diff"]
+                                     and agreement >= tolerance["min_label_agreement"]),
+        }
+
+    print(f"{report['faces']} faces from {report['images']} images, batch size {args.batch_size}\n")
+    print("| backend | ms/face | faces/s | label agreement | max |Δfear| | within tolerance |")
+    print("|---|---|---|---|---|---|")
+    for name, r in report["backends"].items():
+        if "error" in r:
+            print(f"| {name} | error: {r['error']} |||||")
+            continue
+        print(f"| {name} | {r['ms_per_face']:.2f} | {r['faces_per_s']:.1f} | {r['label_agreement']:.2%} "
+              f"| {r['max_fear_abs_diff']:.4f} | {'yes' if r['within_tolerance'] else 'NO'} |")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# benchmarks/bench_face_index.py
+"""
+Query latency and recall of the face embedding index on synthetic embeddings.
+
+Identities are random unit vectors. Each face is its identity plus noise,
+which roughly imitates ArcFace clusters. The same index is queried twice:
+first with an exact scan, then through the IVF index. IVF recall@k is
+measured against the exact results.
+
+Usage:
+    python benchmarks/bench_face_index.py
+    python benchmarks/bench_face_index.py --faces 100000 --dtype float16 --nprobe 16 --output face_index.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import face_index  # noqa: E402
+
+
+def synthetic_embeddings(n_faces, faces_per_identity, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    identities = rng.standard_normal((max(1, n_faces // faces_per_identity), face_index.EMBEDDING_DIM)).astype(np.float32)
+    identities /= np.linalg.norm(identities, axis=1, keepdims=True)
+    owner = rng.integers(0, len(identities), n_faces)
+    faces = identities[owner] + noise * rng.standard_normal((n_faces, face_index.EMBEDDING_DIM)).astype(np.float32) / np.sqrt(face_index.EMBEDDING_DIM)
+    return faces
+
+
+def run_queries(index, queries, k):
+    latencies, results, mode = [], [], None
+    for capture_id in queries:
+        query = index.lookup(capture_id, 0)
+        start = time.perf_counter()
+        hits, mode = index.search(query, k=k, exclude=(capture_id, 0))
+        latencies.append(time.perf_counter() - start)
+        results.append({hit[0] for hit in hits})
+    lat = sorted(latencies)
+    return mode, results, {
+        "p50_ms": 1000 * statistics.median(lat),
+        "p95_ms": 1000 * lat[int(0.95 * (len(lat) - 1))],
+        "max_ms": 1000 * lat[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, default=100_000)
+    parser.add_argument("--faces-per-identity", type=int, default=20)
+    parser.add_argument("--noise", type=float, default=0.8)
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+    parser.add_argument("--nprobe", type=int, default=face_index.NPROBE)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Threshold above the index size so adding never starts a background build
+        face_index.configure(tmp, args.dtype, approx_threshold=args.faces + 1, nprobe=args.nprobe)
+        index = face_index.get_index(1)
+        embeddings = synthetic_embeddings(args.faces, args.faces_per_identity, args.noise)
+        started = time.perf_counter()
+        for start in range(0, args.faces, 1000): # One "capture" per face, appended in chunks
+            chunk = embeddings[start:start + 1000]
+            index.append(np.arange(start, start + len(chunk)), np.zeros(len(chunk)), chunk)
+        load_s = time.perf_counter() - started
+
+        queries = np.random.default_rng(1).choice(args.faces, args.queries, replace=False)
+        exact_mode, exact_results, exact_lat = run_queries(index, queries, args.k)
+
+        started = time.perf_counter()
+        n_lists = index.build_ivf()
+        build_s = time.perf_counter() - started
+        ivf_mode, ivf_results, ivf_lat = run_queries(index, queries, args.k)
+
+        recall = statistics.fmean(len(a & b) / max(1, len(a)) for a, b in zip(exact_results, ivf_results))
+        report = {
+            "faces": args.faces,
+            "dtype": args.dtype,
+            "index_mb": (os.path.getsize(index.vectors_path) + os.path.getsize(index.rows_path)) / 1e6,
+            "load_s": load_s,
+            exact_mode: exact_lat,
+            ivf_mode: dict(ivf_lat, lists=n_lists, nprobe=args.nprobe, build_s=build_s, recall_at_k=recall),
+        }
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
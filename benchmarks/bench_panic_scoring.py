@@ -0,0 +1,114 @@
+# benchmarks/bench_panic_scoring.py
+"""
+Per-face dict scoring vs. the columnar FaceBatch scorer on synthetic faces.
+
+The dict path is what analysis_utils used before FaceBatch: one
+get_vulnerability_from_age + compute_panic_score call and one dict per face,
+then compute_group_panic per capture. Both paths score the same synthetic
+faces. The run fails if any individual or group score differs, even in the
+last bit.
+
+Usage:
+    python benchmarks/bench_panic_scoring.py
+    python benchmarks/bench_panic_scoring.py --faces 100000 --captures 1 100 5000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import analysis_utils  # noqa: E402
+from app.panic_scoring import FaceBatch  # noqa: E402
+
+
+def synthetic_faces(n_faces, n_captures, seed=0):
+    rng = np.random.default_rng(seed)
+    det_score = rng.uniform(0.5, 1.0, n_faces).astype(np.float32).astype(np.float64) # detector output is float32
+    age = rng.integers(1, 90, n_faces)
+    is_male = rng.random(n_faces) < 0.5
+    fear = rng.random(n_faces)
+    cuts = np.sort(rng.integers(0, n_faces + 1, n_captures - 1))
+    offsets = np.concatenate([[0], cuts, [n_faces]])
+    return det_score, age, is_male, fear, offsets
+
+
+def score_dicts(det_score, age, is_male, fear, offsets):
+    individual, groups = [], []
+    for c in range(len(offsets) - 1):
+        face_data_list = []
+        for i in range(offsets[c], offsets[c + 1]):
+            age_vuln = analysis_utils.get_vulnerability_from_age(int(age[i]))
+            gender_score = 0.8 if is_male[i] else 1.0
+            raw_score, panic_score = analysis_utils.compute_panic_score(
+                age_vuln, float(fear[i]), gender_score, float(det_score[i]))
+            individual.append((raw_score, panic_score))
+            face_data_list.append({
+                'emo_fear': float(fear[i]), 'age_vuln': age_vuln,
+                'gender_score': gender_score, 'face_conf': float(det_score[i]), 'raw_score': raw_score
+            })
+        groups.append(float(analysis_utils.compute_group_panic(face_data_list)['PanicScore']))
+    return individual, groups
+
+
+def score_batch(det_score, age, is_male, fear, offsets):
+    raw, panic, groups = FaceBatch(det_score, age, is_male, fear, offsets).score()
+    return raw, panic, groups
+
+
+def timed(fn, args, repeat):
+    times, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, default=10_000)
+    parser.add_argument("--captures", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    report = {"faces": args.faces, "runs": []}
+    for n_captures in args.captures:
+        data = synthetic_faces(args.faces, n_captures)
+        dict_s, (individual, dict_groups) = timed(score_dicts, data, args.repeat)
+        batch_s, (raw, panic, batch_groups) = timed(score_batch, data, args.repeat)
+
+        exact = (
+            all(r == raw[i] and p == panic[i] for i, (r, p) in enumerate(individual))
+            and all(a == b for a, b in zip(dict_groups, batch_groups))
+        )
+        report["runs"].append({
+            "captures": n_captures,
+            "dict_ms": 1000 * dict_s,
+            "batch_ms": 1000 * batch_s,
+            "speedup": dict_s / batch_s,
+            "exact": exact,
+        })
+
+    print(f"{args.faces} synthetic faces, median of {args.repeat} runs\n")
+    print("| captures | dicts ms | FaceBatch ms | speed-up | identical scores |")
+    print("|---|---|---|---|---|")
+    for r in report["runs"]:
+        print(f"| {r['captures']} | {r['dict_ms']:.2f} | {r['batch_ms']:.2f} | {r['speedup']:.1f}x | {'yes' if r['exact'] else 'NO'} |")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if not all(r["exact"] for r in report["runs"]):
+        sys.exit("FaceBatch scores differ from the per-face reference.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# benchmarks/bench_pipeline.py
+"""
+End-to-end and per-stage benchmark of the still-image analysis pipeline.
+
+Each image goes through what a capture analysis does when served: decode,
+detection, per-face attributes, crop, emotion preprocessing and forward pass,
+scoring, and JPEG encoding of every face crop. Stage times come from
+analysis_utils.stage_timer. Per-image latency covers the whole sequence.
+
+The report is JSON. Save it with --output and diff runs to see whether a
+change helped.
+
+Usage:
+    python benchmarks/bench_pipeline.py --output before.json
+    python benchmarks/bench_pipeline.py --threads 4 --detection-mode adaptive --output after.json
+    python benchmarks/bench_pipeline.py --captures /data/drone_frames --limit 50 --repeat 3
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentiles(values):
+    import numpy as np
+
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": 1000 * p50, "p95": 1000 * p95, "p99": 1000 * p99,
+            "mean": 1000 * sum(values) / len(values), "max": 1000 * max(values)}
+
+
+def pin_threads(threads):
+    """Must run before torch / onnxruntime are imported so their pools pick it up."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import cv2
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    cv2.setNumThreads(threads)
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--captures", default=os.path.join(ROOT, "app", "static", "captures"))
+    parser.add_argument("--limit", type=int, default=None, help="Use only the first N images.")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the image set.")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed images before measuring.")
+    parser.add_argument("--threads", type=int, default=None, help="Pin torch/OpenMP/OpenCV thread counts.")
+    parser.add_argument("--detection-mode", default="fixed")
+    parser.add_argument("--emotion-backend", default="torch")
+    parser.add_argument("--model-dir", default=os.path.join(ROOT, "instance", "models"))
+    parser.add_argument("--output", help="Write the JSON report here as well as printing it.")
+    args = parser.parse_args()
+
+    if args.threads:
+        pin_threads(args.threads)
+
+    import cv2  # noqa: F401  (after pin_threads)
+    from app import analysis_utils
+
+    analysis_utils.configure(args.emotion_backend, args.model_dir, args.detection_mode)
+    analysis_utils.initialize_models()
+    if not analysis_utils.models_ready():
+        sys.exit(f"Models not available: {analysis_utils.model_status()}")
+
+    paths = sorted(glob.glob(os.path.join(args.captures, "*.jpg")))[:args.limit]
+    if not paths:
+        sys.exit(f"No .jpg files in {args.captures}")
+
+    current = defaultdict(float)
+    lock = threading.Lock()
+
+    def observe(stage, seconds):
+        with lock:
+            current[stage] += seconds
+
+    def run_one(path):
+        img, error = analysis_utils.load_image(path)
+        if error:
+            return None
+        analysis = analysis_utils.analyze_image(img)
+        mtime = os.path.getmtime(path)
+        for face in analysis["faces"]:
+            analysis_utils.encode_face_crop(path, mtime, tuple(face["bbox"]))
+        return analysis
+
+    for path in paths[:args.warmup]:
+        run_one(path)
+    analysis_utils.encode_face_crop.cache_clear()
+    analysis_utils._decoded_image.cache_clear()
+
+    analysis_utils.STAGE_OBSERVERS.append(observe)
+    latencies, stage_samples = [], defaultdict(list)
+    n_images = n_faces = failed = 0
+    wall_start = time.perf_counter()
+    for _ in range(args.repeat):
+        for path in paths:
+            current.clear()
+            start = time.perf_counter()
+            analysis = run_one(path)
+            latencies.append(time.perf_counter() - start)
+            if analysis is None:
+                failed += 1
+                continue
+            n_images += 1
+            n_faces += len(analysis["faces"])
+            for stage in analysis_utils.STAGES:
+                stage_samples[stage].append(current.get(stage, 0.0))
+        analysis_utils.encode_face_crop.cache_clear() # Every pass encodes its crops again
+        analysis_utils._decoded_image.cache_clear()
+    wall_s = time.perf_counter() - wall_start
+    analysis_utils.STAGE_OBSERVERS.remove(observe)
+
+    stage_total = sum(sum(v) for v in stage_samples.values())
+    report = {
+        "config": {
+            "captures": args.captures,
+            "threads": args.threads,
+            "detection_mode": args.detection_mode,
+            "emotion_backend": args.emotion_backend,
+            "model_version": analysis_utils.MODEL_VERSION,
+            "device": analysis_utils.model_status()["device"],
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "images": n_images,
+        "failed": failed,
+        "faces": n_faces,
+        "wall_s": wall_s,
+        "images_per_s": n_images / wall_s,
+        "faces_per_s": n_faces / wall_s,
+        "latency_ms": percentiles(latencies),
+        "stages": {
+            stage: {
+                "total_s": sum(stage_samples[stage]),
+                "share": sum(stage_samples[stage]) / stage_total if stage_total else 0.0,
+                "per_image_ms": percentiles(stage_samples[stage]),
+            }
+            for stage in analysis_utils.STAGES
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# benchmarks/bench_startup.py
+"""
+Import-time and cold-start benchmark.
+
+Every run happens in a fresh interpreter so nothing is cached between runs.
+For each run we measure:
+  - import_s:         `import app`
+  - create_app_s:     create_app()
+  - first_request_s:  time from process start to the first GET /login response
+  - models_ready_s:   time from process start until the background warm-up finishes
+                      (only with --wait-for-models)
+
+Usage:
+    python benchmarks/bench_startup.py --runs 5 --warmup background
+    python benchmarks/bench_startup.py --runs 3 --warmup eager   # old behaviour
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+flask_app = app.create_app()
+t2 = time.perf_counter()
+client = flask_app.test_client()
+status = client.get('/login').status_code
+t3 = time.perf_counter()
+result = {"import_s": t1 - t0, "create_app_s": t2 - t1, "first_request_s": t3 - t0, "status": status}
+if WAIT_FOR_MODELS:
+    from app import analysis_utils
+    while analysis_utils.MODEL_STATE in ("cold", "loading"):
+        time.sleep(0.05)
+    result["models_ready_s"] = time.perf_counter() - t0
+    result["model_state"] = analysis_utils.MODEL_STATE
+print("RESULT " + json.dumps(result))
+"""
+
+
+def run_once(warmup, wait_for_models):
+    env = dict(os.environ, ANALYSIS_WARMUP=warmup)
+    code = f"WAIT_FOR_MODELS = {wait_for_models!r}\n" + CHILD
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    line = next(l for l in out.splitlines() if l.startswith("RESULT "))
+    return json.loads(line[len("RESULT "):])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmup", choices=["background", "lazy", "eager"], default="background")
+    parser.add_argument("--wait-for-models", action="store_true")
+    args = parser.parse_args()
+
+    runs = [run_once(args.warmup, args.wait_for_models) for _ in range(args.runs)]
+    summary = {"warmup": args.warmup, "runs": args.runs}
+    for key in ("import_s", "create_app_s", "first_request_s", "models_ready_s"):
+        values = [r[key] for r in runs if key in r]
+        if values:
+            summary[key] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+    summary["raw"] = runs
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
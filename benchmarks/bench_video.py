@@ -0,0 +1,98 @@
+# benchmarks/bench_video.py
+"""
+Tracked video analysis vs. analyzing every sampled frame independently.
+
+Both passes see the same sampled frames. The tracked pass is VideoAnalyzer:
+detector on every frame, attributes and emotion only for new or changed tracks.
+The per-frame pass runs analysis_utils.analyze_image on each frame. The report
+covers wall time, attribute/emotion inferences, and how far the two panic
+series drift apart.
+
+Usage:
+    python benchmarks/bench_video.py clip.mp4
+    python benchmarks/bench_video.py clip.mp4 --sample-fps 5 --output video.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import analysis_utils, video_analysis  # noqa: E402
+
+
+def sampled_frames(path, sample_fps, max_seconds):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        sys.exit(f"Could not open {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    step = max(1, int(round(fps / sample_fps)))
+    frames, index = [], 0
+    while cap.grab():
+        if index % step == 0:
+            ok, img = cap.retrieve()
+            if not ok or index / fps > max_seconds:
+                break
+            frames.append((index / fps, index, img))
+        index += 1
+    cap.release()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video")
+    parser.add_argument("--sample-fps", type=float, default=2.0)
+    parser.add_argument("--max-seconds", type=float, default=120.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    analysis_utils.initialize_models()
+    if not analysis_utils.models_ready():
+        sys.exit(f"Models not available: {analysis_utils.model_status()}")
+
+    frames = sampled_frames(args.video, args.sample_fps, args.max_seconds)
+    if not frames:
+        sys.exit("No frames decoded.")
+    analysis_utils.analyze_image(frames[0][2])  # warm-up, not timed
+
+    analyzer = video_analysis.VideoAnalyzer(sample_fps=args.sample_fps)
+    start = time.perf_counter()
+    for t, index, img in frames:
+        analyzer.process_frame(img, t, index)
+    tracked_s = time.perf_counter() - start
+    tracked = analyzer.summary()
+
+    start = time.perf_counter()
+    per_frame = [analysis_utils.analyze_image(img) for _, _, img in frames]
+    per_frame_s = time.perf_counter() - start
+
+    tracked_series = np.array([p["panic_score"] for p in tracked["series"]])
+    per_frame_series = np.array([a["panic_score"] for a in per_frame])
+    diff = np.abs(tracked_series - per_frame_series)
+    report = {
+        "frames": len(frames),
+        "sample_fps": args.sample_fps,
+        "tracked": {"total_s": tracked_s, "ms_per_frame": 1000 * tracked_s / len(frames),
+                    "inferences": tracked["inferences"], "tracks": len(tracked["tracks"])},
+        "per_frame": {"total_s": per_frame_s, "ms_per_frame": 1000 * per_frame_s / len(frames),
+                      "inferences": sum(a["total_faces"] for a in per_frame)},
+        "speedup": per_frame_s / tracked_s if tracked_s else None,
+        "panic_max_abs_diff": float(diff.max()),
+        "panic_mean_abs_diff": float(diff.mean()),
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
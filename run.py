@@ -1,5 +1,5 @@
 # run.py
-from app import create_app, db
+from app import create_app, db, live_channel
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -9,4 +9,8 @@ if __name__ == '__main__':
     with app.app_context():
         # This will create the database tables if they don't exist
         db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+    if live_channel.socketio is not None:
+        # Serves the live channel's websocket alongside the app
+        live_channel.socketio.run(app, debug=True)
+    else:
+        app.run(debug=True)
\ No newline at end of file
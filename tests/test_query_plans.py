@@ -0,0 +1,84 @@
+# tests/test_query_plans.py
+"""
+The busiest pages must not fall back to full table scans.
+
+Each test requests a real route on an in-memory database built from the models,
+records every SELECT it runs, and checks SQLite's EXPLAIN QUERY PLAN for a plain
+"SCAN <table>" (a scan with no index). Run with `python -m pytest`.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app
+from app.commands import query_plan, recorded_selects
+from app.models import db, IST, User, Investigation, Report, ThreadFeedItem, Capture
+
+
+@pytest.fixture
+def app():
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'ANALYSIS_WARMUP': 'lazy',
+        'METRICS_ENABLED': False,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def seeded(app):
+    """A user with two investigations, a report, a feed item and a few captures."""
+    user = User(username='analyst', email='analyst@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    live = Investigation(title='Crowd at gate 4', status='Live', user_id=user.id)
+    db.session.add_all([live, Investigation(title='Stadium exit', user_id=user.id)])
+    db.session.flush()
+    now = datetime.now(IST)
+    db.session.add_all([Capture(image_filename=f'{i}.jpg', investigation_id=live.id,
+                                timestamp=now - timedelta(seconds=i)) for i in range(3)])
+    db.session.add(Report(title='Weekly summary', file_type='pdf', user_id=user.id))
+    db.session.add(ThreadFeedItem(title='Crowd building up', icon='fa-users'))
+    db.session.commit()
+    return user.id, live.id
+
+
+@pytest.fixture
+def client(app, seeded):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(seeded[0])
+        session['_fresh'] = True
+    return client
+
+
+def assert_indexed(app, client, url):
+    with recorded_selects(db.engine) as statements:
+        response = client.get(url)
+    assert response.status_code == 200, url
+    assert statements, url
+    for statement, parameters in statements:
+        plan, scans = query_plan(db.engine, statement, parameters)
+        assert not scans, f"{url} scans {', '.join(scans)}:\n{statement}\n" + "\n".join(plan)
+
+
+@pytest.mark.parametrize('url', [
+    '/',
+    '/investigations',
+    '/reports',
+    '/investigation/{id}/live',
+    '/investigation/{id}/captures',
+])
+def test_page_queries_use_indexes(app, client, seeded, url):
+    assert_indexed(app, client, url.format(id=seeded[1]))
+
+
+def test_next_captures_page_uses_indexes(app, client, seeded):
+    first = client.get(f'/investigation/{seeded[1]}/captures?limit=2').get_json()
+    assert first['next_cursor']
+    assert_indexed(app, client, f"/investigation/{seeded[1]}/captures?limit=2&cursor={first['next_cursor']}")